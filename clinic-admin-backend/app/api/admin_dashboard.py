@@ -1,8 +1,14 @@
 from typing import List, Optional
 from datetime import datetime, date, timedelta
+import logging
 from fastapi import APIRouter, HTTPException, status, Depends, Query
+from fastapi.responses import PlainTextResponse
 from bson import ObjectId
-from ..core.database import get_collection
+from pymongo.errors import DuplicateKeyError
+from ..core.database import get_collection, get_analytics_collection
+from ..core import plan_limits
+from ..core.db_instrumentation import command_listener
+from ..core.profiling import request_profiler
 from ..auth.dependencies import get_current_admin, get_super_admin, get_current_admin_hybrid, get_super_admin_hybrid
 from ..models.admin import AdminInDB
 from ..models.clinic import (
@@ -13,18 +19,25 @@ from ..models.professional import (
     ProfessionalCreate, ProfessionalUpdate, ProfessionalResponse, ProfessionalInDB,
     ProfessionalCredentialsUpdate
 )
+from ..models.trusted import trusted_response
+from ..utils.json_response import BSONJSONResponse
 from ..models.subscription_plan import (
     SubscriptionPlanInDB, SubscriptionPlanCreate, SubscriptionPlanUpdate, 
     SubscriptionPlanResponse, SYSTEM_PLAN_IDS
 )
 from ..utils.email_generator import (
     generate_professional_email, generate_clinic_email_domain, 
-    validate_email_uniqueness, get_n8n_folder_name
+    email_variants_filter, next_available_email, get_n8n_folder_name
 )
 from ..auth.security import get_password_hash
 
 router = APIRouter(prefix="/admin", tags=["Admin Dashboard"])
 
+logger = logging.getLogger(__name__)
+
+# Attempts at a free professional email before giving up (concurrent creations)
+EMAIL_ALLOCATION_ATTEMPTS = 5
+
 
 @router.get("/test")
 async def test_admin_api():
@@ -35,14 +48,7 @@ async def test_admin_api():
 async def get_subscription_plans():
     """Get subscription plans from database"""
     try:
-        print(f"[PLANS] Getting subscription plans...")
         plans_collection = await get_collection("subscription_plans")
-        print(f"[PLANS] Got collection")
-        
-        # Check total count
-        total_count = await plans_collection.count_documents({})
-        active_count = await plans_collection.count_documents({"is_active": True})
-        print(f"[PLANS] Total plans: {total_count}, Active: {active_count}")
         
         cursor = plans_collection.find({"is_active": True}).sort("display_order", 1)
         
@@ -50,12 +56,10 @@ async def get_subscription_plans():
         plan_counter = 0
         async for plan_doc in cursor:
             try:
-                print(f"[PLANS] Processing plan: {plan_doc.get('plan_id', 'NO_ID')}")
                 plan = SubscriptionPlanInDB.from_mongo(plan_doc)
-                print(f"[PLANS] Parsed plan data: {plan.plan_id}")
                 
                 plans[plan.plan_id] = {
-                    "id": str(plan_doc["_id"]),  # MongoDB ObjectId as string
+                    "id": plan_doc["_id"],  # Encoded as a string by the response class
                     "plan_id": plan.plan_id,      # Logical plan ID
                     "name": plan.name,
                     "price": plan.price,
@@ -63,33 +67,28 @@ async def get_subscription_plans():
                     "features": plan.features.model_dump(),
                     "max_professionals": plan.max_professionals,
                     "max_patients": plan.max_patients,
-                    "created_at": plan.created_at.isoformat() if plan.created_at else None,
-                    "updated_at": plan.updated_at.isoformat() if plan.updated_at else None
+                    "created_at": plan.created_at,
+                    "updated_at": plan.updated_at
                 }
                 plan_counter += 1
-                print(f"[PLANS] Added plan to response")
                 
-            except Exception as plan_error:
-                print(f"[PLANS] Error processing plan {plan_doc.get('plan_id')}: {plan_error}")
-                import traceback
-                traceback.print_exc()
+            except Exception:
+                logger.exception("[PLANS] Error processing plan %s", plan_doc.get('plan_id'))
         
-        print(f"[PLANS] Returning {plan_counter} plans")
+        logger.debug("[PLANS] Returning %d plans", plan_counter)
         return plans
         
-    except Exception as e:
-        print(f"[PLANS] CRITICAL ERROR: {e}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("[PLANS] CRITICAL ERROR")
         return {}
 
 
 @router.get("/dashboard/stats")
 async def get_admin_dashboard_stats(current_admin: AdminInDB = Depends(get_current_admin_hybrid)):
     """Get admin dashboard statistics"""
-    clinics_collection = await get_collection("clinics")
-    patients_collection = await get_collection("patients")
-    professionals_collection = await get_collection("professionals")
+    clinics_collection = await get_analytics_collection("clinics")
+    patients_collection = await get_analytics_collection("patients")
+    professionals_collection = await get_analytics_collection("professionals")
     
     # Get clinic stats - only count non-deleted clinics
     total_clinics = await clinics_collection.count_documents({"status_clinic": {"$ne": "deleted"}})
@@ -142,24 +141,58 @@ async def get_admin_dashboard_stats(current_admin: AdminInDB = Depends(get_curre
     }
 
 
+@router.get("/performance/db")
+async def get_db_performance_stats(
+    reset: bool = Query(False, description="Clear the aggregates after reading them"),
+    current_admin: AdminInDB = Depends(get_super_admin_hybrid)
+):
+    """MongoDB queries and time per route since startup (or the last reset)"""
+    stats = command_listener.get_stats()
+    if reset:
+        command_listener.reset()
+    return stats
+
+
+@router.get("/performance/profiles")
+async def list_request_profiles(current_admin: AdminInDB = Depends(get_super_admin_hybrid)):
+    """Stored request profiles, newest first (stacks omitted)"""
+    return {"profiles": request_profiler.list_profiles()}
+
+
+@router.get("/performance/profiles/{profile_id}")
+async def get_request_profile(
+    profile_id: str,
+    format: str = Query("json", pattern="^(json|collapsed)$", description="json, or collapsed stacks for flamegraph tools"),
+    current_admin: AdminInDB = Depends(get_super_admin_hybrid)
+):
+    """A stored request profile with its MongoDB breakdown"""
+    profile = request_profiler.get_profile(profile_id)
+    if not profile:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found"
+        )
+    if format == "collapsed":
+        return PlainTextResponse(request_profiler.collapsed_stacks(profile))
+    return profile
+
+
 @router.get("/subscription-plans")
 async def get_subscription_plans_endpoint(current_admin: AdminInDB = Depends(get_current_admin_hybrid)):
     """Get available subscription plans"""
     try:
-        print(f"[PLANS_ENDPOINT] Request from admin: {current_admin.username}")
+        logger.debug("[PLANS_ENDPOINT] Request from admin: %s", current_admin.username)
         
         plans = await get_subscription_plans()
-        print(f"[PLANS_ENDPOINT] Got {len(plans)} plans")
+        logger.debug("[PLANS_ENDPOINT] Got %d plans", len(plans))
         
         if not plans:
-            print(f"[PLANS_ENDPOINT] WARNING: No plans found")
+            logger.warning("[PLANS_ENDPOINT] No plans found")
         
         return plans
         
     except Exception as e:
-        print(f"[PLANS_ENDPOINT] CRITICAL ERROR: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[PLANS_ENDPOINT] CRITICAL ERROR")
         raise HTTPException(status_code=500, detail=f"Subscription plans error: {str(e)}")
 
 
@@ -167,40 +200,18 @@ async def get_subscription_plans_endpoint(current_admin: AdminInDB = Depends(get
 async def list_clinics(current_admin: AdminInDB = Depends(get_current_admin_hybrid)):
     """Get list of all clinics"""
     try:
-        print(f"[CLINICS] Request from admin: {current_admin.username}")
+        logger.debug("[CLINICS] Request from admin: %s", current_admin.username)
         
         clinics_collection = await get_collection("clinics")
-        print(f"[CLINICS] Got collection")
-        
-        # Check total count (exclude deleted)
-        total_count = await clinics_collection.count_documents({"status_clinic": {"$ne": "deleted"}})
-        print(f"[CLINICS] Total active clinics in DB: {total_count}")
         
         cursor = clinics_collection.find({"status_clinic": {"$ne": "deleted"}}).sort("created_at", -1)
-        clinics = []
+        clinics = await cursor.to_list(length=None)
         
-        async for clinic in cursor:
-            try:
-                print(f"[CLINICS] Processing clinic: {clinic.get('clinic_id', 'NO_ID')}")
-                clinic_data = ClinicInDB.from_mongo(clinic)
-                print(f"[CLINICS] Parsed clinic data: {clinic_data.clinic_id}")
-                
-                response_data = ClinicResponse(**clinic_data.model_dump())
-                clinics.append(response_data)
-                print(f"[CLINICS] Added clinic to response")
-                
-            except Exception as clinic_error:
-                print(f"[CLINICS] Error processing clinic {clinic.get('clinic_id')}: {clinic_error}")
-                import traceback
-                traceback.print_exc()
-        
-        print(f"[CLINICS] Returning {len(clinics)} clinics")
-        return clinics
+        logger.debug("[CLINICS] Returning %d clinics", len(clinics))
+        return trusted_response(ClinicResponse, clinics)
         
     except Exception as e:
-        print(f"[CLINICS] CRITICAL ERROR: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[CLINICS] CRITICAL ERROR")
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 
@@ -587,15 +598,12 @@ async def get_clinic_payments(
     
     # Find all payments for this clinic
     cursor = payments_collection.find({"clinic_id": clinic_id}).sort("payment_date", -1)
-    payments = []
+    payments = await cursor.to_list(length=None)
+    for payment in payments:
+        payment["id"] = payment.pop("_id")
     
-    async for payment in cursor:
-        # Convert MongoDB document to dict and handle ObjectId
-        payment_dict = dict(payment)
-        payment_dict["id"] = str(payment_dict.pop("_id"))
-        payments.append(payment_dict)
-    
-    return payments
+    # Raw documents, encoded directly (ObjectId and datetimes included)
+    return BSONJSONResponse(payments)
 
 
 @router.post("/clinics/{clinic_id}/payments")
@@ -667,15 +675,15 @@ async def record_clinic_payment(
                 
                 new_expiration = current_exp_date + timedelta(days=extension_days)
                 
-                print(f"[DEBUG] new_expiration type: {type(new_expiration)}, value: {new_expiration}")
-                print(f"[DEBUG] isoformat result: {new_expiration.isoformat()}")
-                print(f"[DEBUG] plan_config features: {plan_config['features']}")
+                logger.debug("new_expiration type: %s, value: %s", type(new_expiration), new_expiration)
+                logger.debug("isoformat result: %s", new_expiration)
+                logger.debug("plan_config features: %s", plan_config['features'])
                 
                 # Update clinic subscription
                 try:
                     # Convert the date object to ISO string format for MongoDB storage
                     expiration_str = new_expiration.isoformat() if isinstance(new_expiration, date) else str(new_expiration)
-                    print(f"[DEBUG] Final expiration string: {expiration_str}")
+                    logger.debug("Final expiration string: %s", expiration_str)
                     
                     await clinics_collection.update_one(
                         {"_id": clinic["_id"]},
@@ -691,9 +699,9 @@ async def record_clinic_payment(
                             }
                         }
                     )
-                    print("[DEBUG] MongoDB update successful")
-                except Exception as e:
-                    print(f"[DEBUG] MongoDB update failed: {e}")
+                    logger.debug("MongoDB update successful")
+                except Exception:
+                    logger.exception("MongoDB update failed")
                     raise
                 
                 # Update payment record
@@ -723,13 +731,41 @@ async def get_clinic_professionals(
     
     # Find all professionals for this clinic
     cursor = professionals_collection.find({"clinic_id": clinic_id}).sort("created_at", -1)
-    professionals = []
-    
-    async for professional in cursor:
-        prof_data = ProfessionalInDB.from_mongo(professional)
-        professionals.append(ProfessionalResponse(**prof_data.model_dump()))
+    professionals = await cursor.to_list(length=None)
     
-    return professionals
+    return trusted_response(ProfessionalResponse, professionals)
+
+
+async def _insert_with_unique_email(professionals_collection, professional_dict: dict, base_email: str):
+    """
+    Insert a professional under the next free numbered variant of base_email
+    
+    Addresses are allocated per clinic, the same scope as the
+    (clinic_id, email) unique index: only the clinic's addresses sharing the
+    local-part prefix are read (range scan on that index), and the index
+    arbitrates concurrent creations - the loser of a race re-reads the
+    prefix and takes the next suffix.
+    """
+    for _ in range(EMAIL_ALLOCATION_ATTEMPTS):
+        taken = await professionals_collection.find(
+            {"clinic_id": professional_dict["clinic_id"], "email": email_variants_filter(base_email)},
+            {"_id": 0, "email": 1}
+        ).to_list(length=None)
+        professional_dict["email"] = next_available_email(base_email, [prof["email"] for prof in taken])
+        professional_dict.pop("_id", None)
+        try:
+            return await professionals_collection.insert_one(professional_dict)
+        except DuplicateKeyError as e:
+            if "email" not in (e.details or {}).get("keyPattern", {}):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Professional with this license number already exists"
+                )
+    
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="Could not allocate a unique professional email, please retry"
+    )
 
 
 @router.post("/clinics/{clinic_id}/professionals")
@@ -753,16 +789,6 @@ async def create_clinic_professional(
             detail="Clinic not found"
         )
     
-    # Check professional limit
-    current_count = await professionals_collection.count_documents({"clinic_id": clinic_id})
-    max_allowed = clinic.get("max_professionals_allowed", clinic.get("max_professionals", 5))
-    
-    if current_count >= max_allowed:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Professional limit reached ({max_allowed}). Upgrade subscription plan."
-        )
-    
     # Generate email domain if not exists
     clinic_domain = clinic.get("email_domain") or clinic.get("domain_name", "")
     if not clinic_domain:
@@ -783,14 +809,6 @@ async def create_clinic_professional(
         clinic_domain
     )
     
-    # Check email uniqueness
-    existing_professionals = await professionals_collection.find({}, {"email": 1}).to_list(1000)
-    existing_emails = [prof["email"] for prof in existing_professionals]
-    
-    is_unique, final_email = validate_email_uniqueness(professional_email, existing_emails)
-    if not is_unique:
-        professional_email = final_email
-    
     # Check if license number already exists (if provided and not empty)
     if professional_data.license_number and professional_data.license_number.strip():
         existing_license = await professionals_collection.find_one({
@@ -803,6 +821,14 @@ async def create_clinic_professional(
                 detail="Professional with this license number already exists"
             )
     
+    # Take a seat on the plan (atomic, cannot overshoot under concurrency)
+    admitted, max_allowed = await plan_limits.admit(clinic_id, "professionals")
+    if not admitted:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Professional limit reached ({max_allowed}). Upgrade subscription plan."
+        )
+    
     # Create professional record
     professional_dict = professional_data.model_dump()
     
@@ -814,26 +840,18 @@ async def create_clinic_professional(
     
     professional_dict.update({
         "clinic_id": clinic_id,
-        "email": professional_email,
         "password_hash": get_password_hash(professional_dict.pop("password")),
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow()
     })
     
-    result = await professionals_collection.insert_one(professional_dict)
+    try:
+        result = await _insert_with_unique_email(professionals_collection, professional_dict, professional_email)
+    except Exception:
+        await plan_limits.release(clinic_id, "professionals")
+        raise
     professional_dict["_id"] = str(result.inserted_id)  # Convert ObjectId to string
     
-    # Update clinic professional count
-    await clinics_collection.update_one(
-        {"_id": clinic["_id"]},
-        {
-            "$set": {
-                "professionals_count": current_count + 1,
-                "updated_at": datetime.utcnow()
-            }
-        }
-    )
-    
     professional_db = ProfessionalInDB.from_mongo(professional_dict)
     return ProfessionalResponse(**professional_db.model_dump())
 
@@ -960,7 +978,6 @@ async def delete_clinic_professional(
 ):
     """Delete (deactivate) a professional"""
     professionals_collection = await get_collection("professionals")
-    clinics_collection = await get_collection("clinics")
     
     # Find and deactivate professional
     filter_dict = {}
@@ -982,7 +999,7 @@ async def delete_clinic_professional(
         )
     
     # Soft delete - mark as inactive
-    await professionals_collection.update_one(
+    previous = await professionals_collection.find_one_and_update(
         {"_id": professional["_id"]},
         {
             "$set": {
@@ -991,29 +1008,13 @@ async def delete_clinic_professional(
                 "can_login": False,
                 "updated_at": datetime.utcnow()
             }
-        }
+        },
+        projection={"status_professional": 1}
     )
     
-    # Update clinic professional count
-    current_count = await professionals_collection.count_documents({
-        "clinic_id": clinic_id,
-        "status_professional": "active"
-    })
-    
-    clinic = await clinics_collection.find_one({
-        "$or": [{"_id": ObjectId(clinic_id)}, {"clinic_id": clinic_id}]
-    } if ObjectId.is_valid(clinic_id) else {"clinic_id": clinic_id})
-    
-    if clinic:
-        await clinics_collection.update_one(
-            {"_id": clinic["_id"]},
-            {
-                "$set": {
-                    "professionals_count": current_count,
-                    "updated_at": datetime.utcnow()
-                }
-            }
-        )
+    # Free the plan seat (only on the active -> inactive transition)
+    if previous and previous.get("status_professional") != "inactive":
+        await plan_limits.release(clinic_id, "professionals")
     
     return {"message": "Professional deactivated successfully"}
 
@@ -230,9 +230,9 @@ async def clinic_login(login_data: ClinicLoginRequest):
         "max_professionals": clinic["max_professionals"],
         "max_patients": clinic["max_patients"],
         "whatsapp_session_name": clinic.get("whatsapp_session_name"),
-        "created_at": clinic["created_at"].isoformat() if clinic.get("created_at") else None,
-        "updated_at": clinic["updated_at"].isoformat() if clinic.get("updated_at") else None,
-        "last_login": clinic.get("last_login").isoformat() if clinic.get("last_login") else None
+        "created_at": clinic.get("created_at"),
+        "updated_at": clinic.get("updated_at"),
+        "last_login": clinic.get("last_login")
     }
     
     return {
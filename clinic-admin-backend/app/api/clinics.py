@@ -2,7 +2,7 @@ from typing import List, Optional
 from datetime import datetime, date, timedelta
 from fastapi import APIRouter, HTTPException, status, Depends, Query
 from bson import ObjectId
-from ..core.database import get_collection
+from ..core.database import get_collection, get_analytics_collection
 from ..core.uuid_generator import UUIDGenerator
 from ..auth.dependencies import get_current_admin, get_admin_or_moderator, get_current_admin_hybrid, get_admin_or_moderator_hybrid
 from ..auth.security import get_password_hash
@@ -13,6 +13,7 @@ from ..models.clinic import (
     ClinicSchedule, ClinicContactInfo, WorkingHours
 )
 from ..models.professional import ProfessionalResponse
+from ..models.trusted import trusted_response
 from pydantic import BaseModel
 from typing import List, Dict, Any
 
@@ -50,7 +51,7 @@ router = APIRouter(prefix="/clinics", tags=["Clinics Management"])
 @router.get("/stats", response_model=ClinicStatsResponse)
 async def get_clinics_stats(current_admin: AdminInDB = Depends(get_admin_or_moderator_hybrid)):
     """Get clinic statistics"""
-    clinics_collection = await get_collection("clinics")
+    clinics_collection = await get_analytics_collection("clinics")
     
     # Get counts
     total_clinics = await clinics_collection.count_documents({})
@@ -101,15 +102,9 @@ async def list_public_clinics(
     
     # Get clinics
     cursor = clinics_collection.find(filter_dict).limit(limit).sort("created_at", -1)
-    clinics = []
-    
-    async for clinic in cursor:
-        clinic_data = ClinicInDB.from_mongo(clinic)
-        # Create public response with limited information
-        public_clinic = ClinicResponse(**clinic_data.model_dump())
-        clinics.append(public_clinic)
+    clinics = await cursor.to_list(length=limit)
     
-    return clinics
+    return trusted_response(ClinicResponse, clinics)
 
 
 @router.get("/", response_model=List[ClinicResponse])
@@ -140,13 +135,9 @@ async def list_clinics(
     
     # Get clinics
     cursor = clinics_collection.find(filter_dict).skip(skip).limit(limit).sort("created_at", -1)
-    clinics = []
-    
-    async for clinic in cursor:
-        clinic_data = ClinicInDB.from_mongo(clinic)
-        clinics.append(ClinicResponse(**clinic_data.model_dump()))
+    clinics = await cursor.to_list(length=limit)
     
-    return clinics
+    return trusted_response(ClinicResponse, clinics)
 
 
 @router.get("/{clinic_id}", response_model=ClinicResponse)
@@ -169,8 +160,7 @@ async def get_clinic(clinic_id: str, current_admin: AdminInDB = Depends(get_admi
             detail="Clinic not found"
         )
     
-    clinic_data = ClinicInDB.from_mongo(clinic)
-    return ClinicResponse(**clinic_data.model_dump())
+    return trusted_response(ClinicResponse, clinic)
 
 
 @router.post("/", response_model=ClinicResponse, status_code=status.HTTP_201_CREATED)
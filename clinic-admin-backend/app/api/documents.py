@@ -1,16 +1,22 @@
 import os
 import uuid
-import io
+import asyncio
 from typing import List, Optional
 from datetime import datetime
-from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File, Form
-from fastapi.responses import FileResponse, RedirectResponse
+from urllib.parse import quote
+from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File, Form, Query, BackgroundTasks, Request
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
 from bson import ObjectId
+from ..core.config import settings
 from ..core.database import get_collection
 from ..core.storage_service import get_storage_service
-from ..auth.dependencies import get_current_admin, get_admin_or_moderator, get_current_admin_hybrid, get_admin_or_moderator_hybrid
+from ..core.storage_resilience import StorageUnavailableError
+from ..core import storage_usage, storage_migration, document_previews, document_bundle, patient_access
+from ..auth.dependencies import get_current_admin, get_admin_or_moderator, get_current_admin_hybrid, get_admin_or_moderator_hybrid, get_patient_reader, get_document_reader
 from ..models.admin import AdminInDB
+from ..utils.range_responses import build_range_response, file_validators
 from ..models.document import DocumentCreate, DocumentResponse, DocumentInDB, PatientShare, PatientShareResponse
+from ..models.trusted import trusted_response
 import logging
 
 logger = logging.getLogger(__name__)
@@ -29,8 +35,32 @@ ALLOWED_EXTENSIONS = {
 # Ensure upload directory exists for fallback
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# Initialize storage service (MinIO by default)
-storage_service = get_storage_service(use_minio=True)
+# The storage service is created on first use (get_storage_service) so that
+# importing this module never touches the network
+
+
+def _preview_url(document_id: str) -> str:
+    """API path serving a document's thumbnail"""
+    return f"/api/documents/{document_id}/preview"
+
+
+def _storage_unavailable(error: Exception) -> HTTPException:
+    """503 for storage outages (open circuit, deadline exceeded) so clients retry"""
+    logger.warning(f"⚠️ Document storage unavailable: {str(error)}")
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Document storage temporarily unavailable",
+        headers={"Retry-After": str(int(settings.storage_breaker_reset_seconds))}
+    )
+
+
+def _document_etag(document: dict) -> Optional[str]:
+    """Strong ETag from the stored checksum (content hash, else MinIO ETag)"""
+    if document.get("sha256"):
+        return f'"{document["sha256"]}"'
+    if document.get("storage_type") == "minio" and document.get("etag"):
+        return f'"{document["etag"].strip(chr(34))}"'
+    return None
 
 
 @router.post("/patients/{patient_id}/upload", response_model=DocumentResponse)
@@ -81,25 +111,41 @@ async def upload_document(
             detail="Invalid document type"
         )
     
+    # Size the spooled upload without reading it into memory
+    file.file.seek(0, os.SEEK_END)
+    file_size = file.file.tell()
+    file.file.seek(0)
+    
+    if file_size > MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File size exceeds maximum allowed size of {MAX_FILE_SIZE // 1024 // 1024}MB"
+        )
+    
+    # Account the upload against the clinic's plan storage quota
+    accepted, limit_bytes = await storage_usage.reserve_document_storage(clinic_id, file_size)
+    if not accepted:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Storage limit reached ({limit_bytes // storage_usage.BYTES_PER_GB}GB). Upgrade subscription plan."
+        )
+    
+    # Blob reference and reservation to drop if the documents record never gets written
+    pending_blob_id = None
+    reservation_pending = True
     try:
-        # Read file content
-        content = await file.read()
-        file_size = len(content)
-        
-        # Create file-like object for storage service
-        file_data = io.BytesIO(content)
-        
-        # Upload to storage service (MinIO)
-        upload_result = await storage_service.upload_medical_document(
+        # Upload to storage service (MinIO); identical content is stored once
+        upload_result = await get_storage_service().upload_medical_document(
             clinic_id=clinic_id,
             patient_id=patient_id,
-            file_data=file_data,
+            file_data=file.file,
             filename=file.filename,
             file_size=file_size,
             document_type=document_type,
             description=description,
             content_type=file.content_type or "application/octet-stream"
         )
+        pending_blob_id = upload_result.get("blob_id")
         
         # Create document record in database
         documents_collection = await get_collection("documents")
@@ -120,20 +166,35 @@ async def upload_document(
             "object_name": upload_result.get("object_name"),
             "document_id": upload_result.get("document_id"),
             "etag": upload_result.get("etag"),
+            "blob_id": upload_result.get("blob_id"),
+            "sha256": upload_result.get("sha256"),
             # Legacy compatibility
             "file_path": upload_result.get("object_name", upload_result.get("file_path"))
         }
         
         result = await documents_collection.insert_one(document_data)
         document_data["_id"] = str(result.inserted_id)
+        pending_blob_id = None
+        reservation_pending = False
+        
+        await storage_usage.record_document_added(clinic_id, patient_id)
         
         document_db = DocumentInDB.from_mongo(document_data)
         
         logger.info(f"✅ Document uploaded: {file.filename} for patient {patient_id} in clinic {clinic_id}")
         
-        return DocumentResponse(**document_db.model_dump())
+        response = DocumentResponse(**document_db.model_dump())
+        if upload_result.get("preview_ready"):
+            response.preview_url = _preview_url(response.id)
+        return response
         
     except Exception as e:
+        if reservation_pending:
+            await storage_usage.cancel_document_reservation(clinic_id, file_size)
+        if pending_blob_id:
+            await get_storage_service().release_document_blob(clinic_id, pending_blob_id)
+        if isinstance(e, StorageUnavailableError):
+            raise _storage_unavailable(e)
         logger.error(f"❌ Document upload failed: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -144,9 +205,38 @@ async def upload_document(
 @router.get("/patients/{patient_id}/documents", response_model=List[DocumentResponse])
 async def get_patient_documents(
     patient_id: str,
-    current_admin: AdminInDB = Depends(get_admin_or_moderator_hybrid)
+    reader = Depends(get_patient_reader),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=500)
+):
+    """Get documents for a patient (served from the documents collection, paginated)"""
+    
+    if not ObjectId.is_valid(patient_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid patient ID format"
+        )
+    
+    documents_collection = await get_collection("documents")
+    cursor = documents_collection.find({"patient_id": patient_id}).sort("created_at", -1).skip(skip).limit(limit)
+    
+    documents = await cursor.to_list(length=limit)
+    
+    # One lookup for the whole page instead of one per document
+    ready_previews = await document_previews.get_ready_previews(doc.get("blob_id") for doc in documents)
+    for document in documents:
+        if document.get("blob_id") in ready_previews:
+            document["preview_url"] = _preview_url(str(document["_id"]))
+    
+    return trusted_response(DocumentResponse, documents)
+
+
+@router.get("/patients/{patient_id}/bundle.zip")
+async def download_patient_documents_bundle(
+    patient_id: str,
+    reader = Depends(get_patient_reader)
 ):
-    """Get all documents for a patient"""
+    """Stream all documents of a patient as a single ZIP archive"""
     
     if not ObjectId.is_valid(patient_id):
         raise HTTPException(
@@ -154,23 +244,88 @@ async def get_patient_documents(
             detail="Invalid patient ID format"
         )
     
+    patients_collection = await get_collection("patients")
+    patient = await patients_collection.find_one(
+        {"_id": ObjectId(patient_id)},
+        {"first_name": 1, "last_name": 1}
+    )
+    
+    if not patient:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Patient not found"
+        )
+    
+    documents_collection = await get_collection("documents")
+    cursor = documents_collection.find(
+        {"patient_id": patient_id},
+        {
+            "file_name": 1, "file_size": 1, "document_type": 1, "created_at": 1,
+            "clinic_id": 1, "storage_type": 1, "object_name": 1, "file_path": 1, "etag": 1
+        }
+    ).sort("created_at", 1).batch_size(100)
+    
+    patient_name = f"{patient.get('first_name', '')}_{patient.get('last_name', '')}".strip("_") or patient_id
+    archive_name = quote(f"{patient_name}_documents.zip".replace(" ", "_"))
+    
+    return StreamingResponse(
+        document_bundle.stream_documents_zip(get_storage_service(), cursor),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{archive_name}"}
+    )
+
+
+@router.get("/{document_id}/preview")
+async def get_document_preview(
+    document_id: str,
+    reader = Depends(get_document_reader)
+):
+    """Serve a document's thumbnail (rendered in the background after upload)"""
+    
+    if not ObjectId.is_valid(document_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid document ID format"
+        )
+    
     documents_collection = await get_collection("documents")
-    cursor = documents_collection.find({"patient_id": patient_id}).sort("created_at", -1)
+    document = await documents_collection.find_one(
+        {"_id": ObjectId(document_id)},
+        {"clinic_id": 1, "blob_id": 1, "storage_type": 1}
+    )
+    
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document not found"
+        )
+    
+    preview_location = await document_previews.get_preview_location(
+        get_storage_service(), document.get("clinic_id"), document.get("blob_id")
+    )
+    if not preview_location:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Preview not available"
+        )
     
-    documents = []
-    async for doc in cursor:
-        document_db = DocumentInDB.from_mongo(doc)
-        documents.append(DocumentResponse(**document_db.model_dump()))
+    if get_storage_service().get_storage_type() == "minio":
+        try:
+            preview_url = await get_storage_service().get_document_download_url(document["clinic_id"], preview_location)
+        except StorageUnavailableError as e:
+            raise _storage_unavailable(e)
+        return RedirectResponse(url=preview_url)
     
-    return documents
+    return FileResponse(path=preview_location, media_type=document_previews.PREVIEW_CONTENT_TYPE)
 
 
-@router.get("/{document_id}/download")
+@router.api_route("/{document_id}/download", methods=["GET", "HEAD"])
 async def download_document(
     document_id: str,
-    current_admin: AdminInDB = Depends(get_admin_or_moderator_hybrid)
+    request: Request,
+    reader = Depends(get_document_reader)
 ):
-    """Download a document (MinIO or legacy local)"""
+    """Download a document (MinIO or legacy local) with Range / If-Range support"""
     
     if not ObjectId.is_valid(document_id):
         raise HTTPException(
@@ -189,9 +344,9 @@ async def download_document(
     
     try:
         storage_type = document.get("storage_type", "local")
+        media_type = document.get("file_type") or "application/octet-stream"
         
         if storage_type == "minio":
-            # MinIO storage - generate presigned URL and redirect
             clinic_id = document.get("clinic_id")
             object_name = document.get("object_name") or document.get("file_path")
             
@@ -201,7 +356,25 @@ async def download_document(
                     detail="Missing storage information for MinIO document"
                 )
             
-            download_url = await storage_service.get_document_download_url(clinic_id, object_name)
+            if settings.storage_proxy_downloads:
+                # Clients cannot reach MinIO - stream ranges through the API
+                return build_range_response(
+                    request.headers,
+                    request.method,
+                    size=document.get("file_size", 0),
+                    media_type=media_type,
+                    etag=_document_etag(document),
+                    last_modified=document.get("migrated_at") or document.get("created_at"),
+                    filename=document.get("file_name"),
+                    stream_factory=lambda start, count: get_storage_service().iter_document_content(
+                        document, offset=start, length=count
+                    )
+                )
+            
+            # MinIO storage - generate presigned URL and redirect (MinIO serves ranges itself)
+            download_url = await get_storage_service().get_document_download_url(
+                clinic_id, object_name, filename=document.get("file_name")
+            )
             
             # Return redirect to presigned URL
             return RedirectResponse(url=download_url)
@@ -215,12 +388,22 @@ async def download_document(
                     detail="File not found on disk"
                 )
             
-            return FileResponse(
-                path=file_path,
-                filename=document["file_name"],
-                media_type=document["file_type"]
+            size, file_etag, modified = await asyncio.to_thread(file_validators, file_path)
+            return build_range_response(
+                request.headers,
+                request.method,
+                size=size,
+                media_type=media_type,
+                etag=_document_etag(document) or file_etag,
+                last_modified=modified,
+                filename=document.get("file_name"),
+                file_path=file_path
             )
             
+    except HTTPException:
+        raise
+    except StorageUnavailableError as e:
+        raise _storage_unavailable(e)
     except Exception as e:
         logger.error(f"❌ Document download failed: {str(e)}")
         raise HTTPException(
@@ -254,13 +437,17 @@ async def delete_document(
     try:
         storage_type = document.get("storage_type", "local")
         
-        if storage_type == "minio":
+        if document.get("blob_id"):
+            # Shared content-addressed blob - the object goes with the last reference
+            await get_storage_service().release_document_blob(document["clinic_id"], document["blob_id"])
+            
+        elif storage_type == "minio":
             # MinIO storage
             clinic_id = document.get("clinic_id")
             object_name = document.get("object_name") or document.get("file_path")
             
             if clinic_id and object_name:
-                success = await storage_service.delete_medical_document(clinic_id, object_name)
+                success = await get_storage_service().delete_medical_document(clinic_id, object_name)
                 if not success:
                     logger.warning(f"⚠️ Failed to delete file from MinIO: {object_name}")
             
@@ -269,9 +456,17 @@ async def delete_document(
             file_path = document["file_path"]
             if os.path.exists(file_path):
                 os.remove(file_path)
+            if document.get("migration_blob_id"):
+                # Reference taken by an unfinished migration of this document
+                await get_storage_service().release_document_blob(document["clinic_id"], document["migration_blob_id"])
         
         # Delete document record from database
-        await documents_collection.delete_one({"_id": ObjectId(document_id)})
+        result = await documents_collection.delete_one({"_id": ObjectId(document_id)})
+        
+        if result.deleted_count and document.get("clinic_id"):
+            await storage_usage.record_document_removed(
+                document["clinic_id"], document["patient_id"], document.get("file_size", 0)
+            )
         
         logger.info(f"✅ Document deleted: {document.get('file_name')} (ID: {document_id})")
         
@@ -372,21 +567,34 @@ async def share_patient(
                 "notes": notes
             }}
         )
-        return {"message": "Patient sharing updated successfully"}
+        message = "Patient sharing updated successfully"
     else:
         await shares_collection.insert_one(share_data)
-        return {"message": "Patient shared successfully"}
+        message = "Patient shared successfully"
+    
+    # Granted only once the share is stored, so a failed write leaves no access behind
+    await patient_access.grant_access(
+        shared_with, patient_id, patient.get("clinic_id"),
+        patient_access.share_source(current_professional["_id"]), permissions
+    )
+    
+    return {"message": message}
 
 
 @router.get("/patients/shared-with-me", response_model=List[PatientShareResponse])
 async def get_patients_shared_with_me(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=100),
     current_admin: AdminInDB = Depends(get_admin_or_moderator_hybrid)
 ):
-    """Get patients that have been shared with the current professional"""
+    """Get patients that have been shared with the current professional (paginated)"""
     
     # Get current professional
     professionals_collection = await get_collection("professionals")
-    current_professional = await professionals_collection.find_one({"admin_id": current_admin.admin_id})
+    current_professional = await professionals_collection.find_one(
+        {"admin_id": current_admin.admin_id},
+        {"first_name": 1, "last_name": 1}
+    )
     
     if not current_professional:
         raise HTTPException(
@@ -394,19 +602,38 @@ async def get_patients_shared_with_me(
             detail="Professional profile not found"
         )
     
-    # Get shares
+    # Get one page of shares (index: shared_with + shared_at)
     shares_collection = await get_collection("patient_shares")
     patients_collection = await get_collection("patients")
     
-    cursor = shares_collection.find({"shared_with": current_professional["_id"]}).sort("shared_at", -1)
+    cursor = shares_collection.find({"shared_with": current_professional["_id"]}).sort(
+        [("shared_at", -1), ("_id", -1)]
+    ).skip(skip).limit(limit)
+    shares = await cursor.to_list(length=limit)
+    
+    # Resolve names for the whole page with two $in queries
+    patient_ids = {ObjectId(share["patient_id"]) for share in shares if ObjectId.is_valid(share["patient_id"])}
+    sharer_ids = {share["shared_by"] for share in shares}
+    
+    patients_by_id = {
+        str(patient["_id"]): patient
+        async for patient in patients_collection.find(
+            {"_id": {"$in": list(patient_ids)}},
+            {"first_name": 1, "last_name": 1}
+        )
+    }
+    sharers_by_id = {
+        professional["_id"]: professional
+        async for professional in professionals_collection.find(
+            {"_id": {"$in": list(sharer_ids)}},
+            {"first_name": 1, "last_name": 1}
+        )
+    }
     
     shared_patients = []
-    async for share in cursor:
-        # Get patient details
-        patient = await patients_collection.find_one({"_id": ObjectId(share["patient_id"])})
-        
-        # Get sharing professional details
-        sharing_professional = await professionals_collection.find_one({"_id": share["shared_by"]})
+    for share in shares:
+        patient = patients_by_id.get(share["patient_id"])
+        sharing_professional = sharers_by_id.get(share["shared_by"])
         
         if patient and sharing_professional:
             share_response = PatientShareResponse(
@@ -465,6 +692,10 @@ async def revoke_patient_share(
             detail="Share record not found"
         )
     
+    await patient_access.revoke_access(
+        professional_id, patient_id, patient_access.share_source(current_professional["_id"])
+    )
+    
     return {"message": "Patient sharing revoked successfully"}
 
 
@@ -474,16 +705,10 @@ async def get_clinic_storage_stats(
     clinic_id: str,
     current_admin: AdminInDB = Depends(get_admin_or_moderator_hybrid)
 ):
-    """Get storage statistics for a clinic"""
+    """Get storage statistics for a clinic (served from usage counters)"""
     try:
-        stats = await storage_service.get_clinic_storage_statistics(clinic_id)
-        
-        # Add document count from database
-        documents_collection = await get_collection("documents")
-        doc_count = await documents_collection.count_documents({"clinic_id": clinic_id})
-        
-        stats["documents_in_database"] = doc_count
-        stats["storage_service_type"] = storage_service.get_storage_type()
+        stats = await storage_usage.get_clinic_storage_usage(clinic_id)
+        stats["storage_service_type"] = get_storage_service().get_storage_type()
         
         return {
             "clinic_id": clinic_id,
@@ -498,89 +723,73 @@ async def get_clinic_storage_stats(
         )
 
 
-@router.post("/storage/migrate/{clinic_id}")
+@router.post("/storage/reconcile/{clinic_id}", status_code=status.HTTP_202_ACCEPTED)
+async def reconcile_clinic_storage_stats(
+    clinic_id: str,
+    background_tasks: BackgroundTasks,
+    current_admin: AdminInDB = Depends(get_current_admin_hybrid)
+):
+    """Rebuild a clinic's storage usage counters and blob references in the background"""
+    background_tasks.add_task(storage_usage.run_storage_reconciliation, clinic_id)
+    background_tasks.add_task(get_storage_service().reconcile_blobs, clinic_id)
+    return {
+        "message": f"Storage usage reconciliation scheduled for clinic {clinic_id}",
+        "clinic_id": clinic_id
+    }
+
+
+@router.get("/storage/cache/stats")
+async def get_document_cache_stats(
+    current_admin: AdminInDB = Depends(get_current_admin_hybrid)
+):
+    """Hit/miss metrics and occupancy of the local document cache"""
+    return get_storage_service().get_cache_stats()
+
+
+@router.post("/storage/migrate/{clinic_id}", status_code=status.HTTP_202_ACCEPTED)
 async def migrate_clinic_documents_to_minio(
     clinic_id: str,
+    concurrency: int = Query(storage_migration.DEFAULT_CONCURRENCY, ge=1, le=storage_migration.MAX_CONCURRENCY),
+    retry_failed: bool = Query(False),
     current_admin: AdminInDB = Depends(get_current_admin_hybrid)
 ):
-    """Migrate clinic documents from local storage to MinIO"""
+    """Start a background migration of clinic documents from local storage to MinIO"""
     try:
-        documents_collection = await get_collection("documents")
-        
-        # Find all local documents for clinic
-        local_docs = await documents_collection.find({
-            "clinic_id": clinic_id,
-            "$or": [
-                {"storage_type": "local"},
-                {"storage_type": {"$exists": False}}
-            ]
-        }).to_list(None)
-        
-        if not local_docs:
-            return {
-                "message": "No local documents found for migration",
-                "migrated_count": 0
-            }
-        
-        migrated_count = 0
-        errors = []
-        
-        for doc in local_docs:
-            try:
-                file_path = doc.get("file_path")
-                if not file_path or not os.path.exists(file_path):
-                    errors.append(f"File not found: {file_path}")
-                    continue
-                
-                # Read local file
-                with open(file_path, "rb") as f:
-                    file_data = io.BytesIO(f.read())
-                    file_size = len(file_data.getvalue())
-                    file_data.seek(0)
-                
-                # Upload to MinIO
-                upload_result = await storage_service.upload_medical_document(
-                    clinic_id=clinic_id,
-                    patient_id=doc["patient_id"],
-                    file_data=file_data,
-                    filename=doc["file_name"],
-                    file_size=file_size,
-                    document_type=doc.get("document_type", "medical_record"),
-                    description=doc.get("description"),
-                    content_type=doc.get("file_type", "application/octet-stream")
-                )
-                
-                # Update document record
-                await documents_collection.update_one(
-                    {"_id": doc["_id"]},
-                    {"$set": {
-                        "storage_type": "minio",
-                        "bucket_name": upload_result.get("bucket_name"),
-                        "object_name": upload_result.get("object_name"),
-                        "document_id": upload_result.get("document_id"),
-                        "etag": upload_result.get("etag"),
-                        "migrated_at": datetime.utcnow()
-                    }}
-                )
-                
-                # Delete local file after successful migration
-                os.remove(file_path)
-                migrated_count += 1
-                
-            except Exception as e:
-                errors.append(f"Failed to migrate {doc.get('file_name', 'unknown')}: {str(e)}")
-                continue
-        
+        job = await storage_migration.start_migration_job(
+            clinic_id,
+            concurrency=concurrency,
+            retry_failed=retry_failed,
+            started_by=current_admin.username
+        )
         return {
-            "message": f"Migration completed for clinic {clinic_id}",
-            "migrated_count": migrated_count,
-            "total_documents": len(local_docs),
-            "errors": errors
+            "message": f"Migration started for clinic {clinic_id}",
+            "job_id": job["job_id"],
+            "status_url": f"/api/documents/storage/migrate/jobs/{job['job_id']}",
+            "job": job
         }
         
+    except storage_migration.MigrationAlreadyRunning as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Migration already running for clinic {clinic_id} (job {e.job_id})"
+        )
     except Exception as e:
         logger.error(f"❌ Migration failed: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error during migration: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+@router.get("/storage/migrate/jobs/{job_id}")
+async def get_migration_job_status(
+    job_id: str,
+    current_admin: AdminInDB = Depends(get_current_admin_hybrid)
+):
+    """Get progress and throughput of a storage migration job"""
+    job = await storage_migration.get_migration_job(job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Migration job not found"
+        )
+    return job
\ No newline at end of file
@@ -2,13 +2,15 @@ from typing import List, Optional
 from datetime import datetime
 from fastapi import APIRouter, HTTPException, status, Depends, Query, UploadFile, File, Form
 from bson import ObjectId
-from ..core.database import get_collection
-from ..auth.dependencies import get_current_admin, get_admin_or_moderator, get_current_admin_hybrid, get_admin_or_moderator_hybrid
+from ..core.database import get_collection, get_analytics_collection
+from ..core import patient_access, plan_limits
+from ..auth.dependencies import get_current_admin, get_admin_or_moderator, get_current_admin_hybrid, get_admin_or_moderator_hybrid, get_patient_reader
 from ..models.admin import AdminInDB
 from ..models.patient import (
     PatientCreate, PatientUpdate, PatientResponse, PatientInDB,
     MedicalFile, VisitHistory
 )
+from ..models.trusted import trusted_response
 
 router = APIRouter(prefix="/patients", tags=["Patients Management"])
 
@@ -42,13 +44,9 @@ async def list_patients(
     
     # Get patients
     cursor = patients_collection.find(filter_dict).skip(skip).limit(limit).sort("created_at", -1)
-    patients = []
+    patients = await cursor.to_list(length=limit)
     
-    async for patient in cursor:
-        patient_data = PatientInDB.from_mongo(patient)
-        patients.append(PatientResponse(**patient_data.model_dump()))
-    
-    return patients
+    return trusted_response(PatientResponse, patients)
 
 
 @router.get("/search/by-dni", response_model=PatientResponse)
@@ -72,12 +70,11 @@ async def search_patient_by_dni(
             detail=f"No se encontró ningún paciente con DNI '{dni}' en la clínica especificada"
         )
     
-    patient_data = PatientInDB.from_mongo(patient)
-    return PatientResponse(**patient_data.model_dump())
+    return trusted_response(PatientResponse, patient)
 
 
 @router.get("/{patient_id}", response_model=PatientResponse)
-async def get_patient(patient_id: str, current_admin: AdminInDB = Depends(get_admin_or_moderator_hybrid)):
+async def get_patient(patient_id: str, reader = Depends(get_patient_reader)):
     """Get patient by ID"""
     patients_collection = await get_collection("patients")
     
@@ -95,8 +92,7 @@ async def get_patient(patient_id: str, current_admin: AdminInDB = Depends(get_ad
             detail="Patient not found"
         )
     
-    patient_data = PatientInDB.from_mongo(patient)
-    return PatientResponse(**patient_data.model_dump())
+    return trusted_response(PatientResponse, patient)
 
 
 @router.get("/clinic/{clinic_id}", response_model=List[PatientResponse])
@@ -115,13 +111,9 @@ async def get_patients_by_clinic(
         filter_dict["status_patient"] = status
     
     cursor = patients_collection.find(filter_dict).skip(skip).limit(limit).sort("last_visit", -1)
-    patients = []
-    
-    async for patient in cursor:
-        patient_data = PatientInDB.from_mongo(patient)
-        patients.append(PatientResponse(**patient_data.model_dump()))
+    patients = await cursor.to_list(length=limit)
     
-    return patients
+    return trusted_response(PatientResponse, patients)
 
 
 @router.post("/", response_model=PatientResponse, status_code=status.HTTP_201_CREATED)
@@ -150,7 +142,27 @@ async def create_patient(patient: PatientCreate, current_admin: AdminInDB = Depe
     patient_data["shared_with"] = []
     # last_visit should be None until patient has an actual visit
     
-    result = await patients_collection.insert_one(patient_data)
+    # Take a seat on the clinic's plan (atomic, cannot overshoot under concurrency)
+    seat_taken = patient_data.get("status_patient") != "archived"
+    if seat_taken:
+        admitted, max_patients = await plan_limits.admit(patient.clinic_id, "patients")
+        if not admitted:
+            if max_patients is None:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Clinic not found"
+                )
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Patient limit reached ({max_patients}). Upgrade subscription plan."
+            )
+    
+    try:
+        result = await patients_collection.insert_one(patient_data)
+    except Exception:
+        if seat_taken:
+            await plan_limits.release(patient.clinic_id, "patients")
+        raise
     patient_data["_id"] = str(result.inserted_id)  # Convert ObjectId to string
     
     patient_db = PatientInDB.from_mongo(patient_data)
@@ -197,12 +209,30 @@ async def update_patient(
                 detail="A patient with this DNI already exists in the clinic"
             )
     
+    # Un-archiving needs a free seat on the plan
+    unarchiving = patient.get("status_patient") == "archived" and update_data.get("status_patient", "archived") != "archived"
+    if unarchiving:
+        admitted, max_patients = await plan_limits.admit(patient["clinic_id"], "patients")
+        if not admitted:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Patient limit reached ({max_patients}). Upgrade subscription plan."
+            )
+    
     # Update patient
-    await patients_collection.update_one(
+    previous = await patients_collection.find_one_and_update(
         {"_id": ObjectId(patient_id)},
-        {"$set": update_data}
+        {"$set": update_data},
+        projection={"status_patient": 1}
     )
     
+    # Settle seats against the status actually replaced
+    if "status_patient" in update_data:
+        was_seated = previous is not None and previous.get("status_patient") != "archived"
+        is_seated = previous is not None and update_data.get("status_patient", previous.get("status_patient")) != "archived"
+        if int(is_seated) - int(was_seated) < int(unarchiving):
+            await plan_limits.release(patient["clinic_id"], "patients")
+    
     # Get updated patient
     updated_patient = await patients_collection.find_one({"_id": ObjectId(patient_id)})
     patient_db = PatientInDB.from_mongo(updated_patient)
@@ -253,12 +283,9 @@ async def advanced_medical_records_search(
         cursor = patients_collection.find(filter_dict).skip(skip).limit(limit)
         cursor = cursor.sort("last_visit", -1)
         
-        patients = []
-        async for patient in cursor:
-            patient_data = PatientInDB.from_mongo(patient)
-            patients.append(PatientResponse(**patient_data.model_dump()))
+        patients = await cursor.to_list(length=limit)
         
-        return patients
+        return trusted_response(PatientResponse, patients)
         
     except Exception as e:
         raise HTTPException(
@@ -274,8 +301,8 @@ async def get_medical_records_analytics(
 ):
     """Get analytics about medical records for a clinic"""
     from datetime import timedelta
-    patients_collection = await get_collection("patients")
-    documents_collection = await get_collection("documents")
+    patients_collection = await get_analytics_collection("patients")
+    documents_collection = await get_analytics_collection("documents")
     
     try:
         # Get patient statistics
@@ -410,12 +437,9 @@ async def advanced_medical_records_search(
         cursor = patients_collection.find(filter_dict).skip(skip).limit(limit)
         cursor = cursor.sort("last_visit", -1)
         
-        patients = []
-        async for patient in cursor:
-            patient_data = PatientInDB.from_mongo(patient)
-            patients.append(PatientResponse(**patient_data.model_dump()))
+        patients = await cursor.to_list(length=limit)
         
-        return patients
+        return trusted_response(PatientResponse, patients)
         
     except Exception as e:
         raise HTTPException(
@@ -431,8 +455,8 @@ async def get_medical_records_analytics(
 ):
     """Get analytics about medical records for a clinic"""
     from datetime import timedelta
-    patients_collection = await get_collection("patients")
-    documents_collection = await get_collection("documents")
+    patients_collection = await get_analytics_collection("patients")
+    documents_collection = await get_analytics_collection("documents")
     
     try:
         # Get patient statistics
@@ -489,12 +513,14 @@ async def upload_patient_document(
 @router.get("/{patient_id}/documents")
 async def get_patient_documents_api(
     patient_id: str,
-    current_admin: AdminInDB = Depends(get_admin_or_moderator_hybrid)
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=500),
+    reader = Depends(get_patient_reader)
 ):
     """Get patient documents - redirects to documents API"""  
     # Import here to avoid circular imports
     from .documents import get_patient_documents
-    return await get_patient_documents(patient_id, current_admin)
+    return await get_patient_documents(patient_id, reader, skip=skip, limit=limit)
 
 
 @router.delete("/{patient_id}")
@@ -516,21 +542,26 @@ async def delete_patient(patient_id: str, current_admin: AdminInDB = Depends(get
         )
     
     # Soft delete
-    await patients_collection.update_one(
+    previous = await patients_collection.find_one_and_update(
         {"_id": ObjectId(patient_id)},
         {"$set": {
             "status_patient": "archived",
             "updated_at": datetime.utcnow()
-        }}
+        }},
+        projection={"status_patient": 1}
     )
     
+    # Free the plan seat (only on the first archive)
+    if previous and previous.get("status_patient") != "archived":
+        await plan_limits.release(patient["clinic_id"], "patients")
+    
     return {"message": "Patient archived successfully"}
 
 
 @router.get("/{patient_id}/history", response_model=List[dict])
 async def get_patient_history(
     patient_id: str, 
-    current_admin: AdminInDB = Depends(get_admin_or_moderator_hybrid)
+    reader = Depends(get_patient_reader)
 ):
     """Get patient visit history"""
     patients_collection = await get_collection("patients")
@@ -611,6 +642,9 @@ async def share_patient_with_professional(
             "$set": {"updated_at": datetime.utcnow()}
         }
     )
+    await patient_access.grant_access(
+        professional_id, patient_id, patient["clinic_id"], patient_access.PATIENT_RECORD_SOURCE
+    )
     
     # Get updated patient
     updated_patient = await patients_collection.find_one({"_id": ObjectId(patient_id)})
@@ -662,12 +696,9 @@ async def advanced_medical_records_search(
         cursor = patients_collection.find(filter_dict).skip(skip).limit(limit)
         cursor = cursor.sort("last_visit", -1)
         
-        patients = []
-        async for patient in cursor:
-            patient_data = PatientInDB.from_mongo(patient)
-            patients.append(PatientResponse(**patient_data.model_dump()))
+        patients = await cursor.to_list(length=limit)
         
-        return patients
+        return trusted_response(PatientResponse, patients)
         
     except Exception as e:
         raise HTTPException(
@@ -683,8 +714,8 @@ async def get_medical_records_analytics(
 ):
     """Get analytics about medical records for a clinic"""
     from datetime import timedelta
-    patients_collection = await get_collection("patients")
-    documents_collection = await get_collection("documents")
+    patients_collection = await get_analytics_collection("patients")
+    documents_collection = await get_analytics_collection("documents")
     
     try:
         # Get patient statistics
@@ -847,12 +878,9 @@ async def advanced_medical_records_search(
         cursor = patients_collection.find(filter_dict).skip(skip).limit(limit)
         cursor = cursor.sort("last_visit", -1)
         
-        patients = []
-        async for patient in cursor:
-            patient_data = PatientInDB.from_mongo(patient)
-            patients.append(PatientResponse(**patient_data.model_dump()))
+        patients = await cursor.to_list(length=limit)
         
-        return patients
+        return trusted_response(PatientResponse, patients)
         
     except Exception as e:
         raise HTTPException(
@@ -868,8 +896,8 @@ async def get_medical_records_analytics(
 ):
     """Get analytics about medical records for a clinic"""
     from datetime import timedelta
-    patients_collection = await get_collection("patients")
-    documents_collection = await get_collection("documents")
+    patients_collection = await get_analytics_collection("patients")
+    documents_collection = await get_analytics_collection("documents")
     
     try:
         # Get patient statistics
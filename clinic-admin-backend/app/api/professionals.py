@@ -2,12 +2,18 @@ from typing import List, Optional
 from datetime import datetime
 from fastapi import APIRouter, HTTPException, status, Depends, Query
 from bson import ObjectId
-from ..core.database import get_collection
-from ..auth.dependencies import get_current_admin, get_admin_or_moderator, get_current_admin_hybrid, get_admin_or_moderator_hybrid
+from ..core.database import get_collection, get_analytics_collection
+from ..core import patient_access, plan_limits
+from ..auth.dependencies import (
+    get_current_admin, get_admin_or_moderator, get_current_admin_hybrid, get_admin_or_moderator_hybrid,
+    get_super_admin_hybrid, get_current_professional, require_patient_access
+)
 from ..models.admin import AdminInDB
+from ..models.patient import PatientResponse
 from ..models.professional import (
     ProfessionalCreate, ProfessionalUpdate, ProfessionalResponse, ProfessionalInDB
 )
+from ..models.trusted import trusted_response
 
 router = APIRouter(prefix="/professionals", tags=["Professionals Management"])
 
@@ -44,13 +50,9 @@ async def list_professionals(
     
     # Get professionals
     cursor = professionals_collection.find(filter_dict).skip(skip).limit(limit).sort("created_at", -1)
-    professionals = []
-    
-    async for professional in cursor:
-        professional_data = ProfessionalInDB.from_mongo(professional)
-        professionals.append(ProfessionalResponse(**professional_data.model_dump()))
+    professionals = await cursor.to_list(length=limit)
     
-    return professionals
+    return trusted_response(ProfessionalResponse, professionals)
 
 
 @router.get("/{professional_id}", response_model=ProfessionalResponse)
@@ -72,8 +74,7 @@ async def get_professional(professional_id: str, current_admin: AdminInDB = Depe
             detail="Professional not found"
         )
     
-    professional_data = ProfessionalInDB.from_mongo(professional)
-    return ProfessionalResponse(**professional_data.model_dump())
+    return trusted_response(ProfessionalResponse, professional)
 
 
 @router.get("/clinic/{clinic_id}", response_model=List[ProfessionalResponse])
@@ -95,13 +96,9 @@ async def get_professionals_by_clinic(
         filter_dict["speciality"] = {"$regex": speciality, "$options": "i"}
     
     cursor = professionals_collection.find(filter_dict).skip(skip).limit(limit).sort("first_name", 1)
-    professionals = []
-    
-    async for professional in cursor:
-        professional_data = ProfessionalInDB.from_mongo(professional)
-        professionals.append(ProfessionalResponse(**professional_data.model_dump()))
+    professionals = await cursor.to_list(length=limit)
     
-    return professionals
+    return trusted_response(ProfessionalResponse, professionals)
 
 
 @router.post("/", response_model=ProfessionalResponse, status_code=status.HTTP_201_CREATED)
@@ -118,19 +115,6 @@ async def create_professional(professional: ProfessionalCreate, current_admin: A
             detail="Clinic not found"
         )
     
-    # Check clinic's professional limit
-    current_professionals = await professionals_collection.count_documents({
-        "clinic_id": professional.clinic_id,
-        "status_professional": {"$ne": "inactive"}
-    })
-    
-    max_professionals = clinic.get("max_professionals", 5)
-    if current_professionals >= max_professionals:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Clinic has reached maximum number of professionals ({max_professionals})"
-        )
-    
     # Check if email already exists in the same clinic
     existing = await professionals_collection.find_one({
         "clinic_id": professional.clinic_id,
@@ -167,7 +151,22 @@ async def create_professional(professional: ProfessionalCreate, current_admin: A
     professional_data["created_at"] = datetime.utcnow()
     professional_data["updated_at"] = datetime.utcnow()
     
-    result = await professionals_collection.insert_one(professional_data)
+    # Take a seat on the clinic's plan (atomic, cannot overshoot under concurrency)
+    seat_taken = professional_data.get("status_professional") != "inactive"
+    if seat_taken:
+        admitted, max_professionals = await plan_limits.admit(professional.clinic_id, "professionals")
+        if not admitted:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Clinic has reached maximum number of professionals ({max_professionals})"
+            )
+    
+    try:
+        result = await professionals_collection.insert_one(professional_data)
+    except Exception:
+        if seat_taken:
+            await plan_limits.release(professional.clinic_id, "professionals")
+        raise
     professional_data["_id"] = str(result.inserted_id)  # Convert ObjectId to string
     
     professional_db = ProfessionalInDB.from_mongo(professional_data)
@@ -277,15 +276,33 @@ async def toggle_professional_status(
             detail="Professional not found"
         )
     
+    # Reactivation needs a free seat on the plan
+    reactivating = professional.get("status_professional") == "inactive" and status_professional != "inactive"
+    if reactivating:
+        admitted, max_professionals = await plan_limits.admit(professional["clinic_id"], "professionals")
+        if not admitted:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Clinic has reached maximum number of professionals ({max_professionals})"
+            )
+    
     # Update status
-    await professionals_collection.update_one(
+    previous = await professionals_collection.find_one_and_update(
         {"_id": ObjectId(professional_id)},
         {"$set": {
             "status_professional": status_professional,
             "updated_at": datetime.utcnow()
-        }}
+        }},
+        projection={"status_professional": 1}
     )
     
+    # Settle seats against the status actually replaced: give back the seat
+    # freed by a deactivation, or ours if a concurrent change made it unneeded
+    was_seated = previous is not None and previous.get("status_professional") != "inactive"
+    is_seated = previous is not None and status_professional != "inactive"
+    if int(is_seated) - int(was_seated) < int(reactivating):
+        await plan_limits.release(professional["clinic_id"], "professionals")
+    
     return {"message": f"Professional status updated to {status_professional}"}
 
 
@@ -308,24 +325,89 @@ async def delete_professional(professional_id: str, current_admin: AdminInDB = D
         )
     
     # Soft delete
-    await professionals_collection.update_one(
+    previous = await professionals_collection.find_one_and_update(
         {"_id": ObjectId(professional_id)},
         {"$set": {
             "status_professional": "inactive",
             "updated_at": datetime.utcnow()
-        }}
+        }},
+        projection={"status_professional": 1}
     )
     
+    # Free the plan seat (only on the active -> inactive transition)
+    if previous and previous.get("status_professional") != "inactive":
+        await plan_limits.release(professional["clinic_id"], "professionals")
+    
     return {"message": "Professional deactivated successfully"}
 
 
+@router.get("/me/patients", response_model=List[PatientResponse])
+async def list_my_visible_patients(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=100),
+    current_professional: ProfessionalInDB = Depends(get_current_professional)
+):
+    """List patients shared with the current professional (from the access index), archived ones excluded"""
+    patient_ids = await patient_access.list_visible_patient_ids(current_professional.id, skip, limit)
+    object_ids = [ObjectId(patient_id) for patient_id in patient_ids if ObjectId.is_valid(patient_id)]
+    if not object_ids:
+        return []
+    
+    patients_collection = await get_collection("patients")
+    patients_by_id = {
+        str(patient["_id"]): patient
+        async for patient in patients_collection.find(
+            {"_id": {"$in": object_ids}, "status_patient": {"$ne": "archived"}}
+        )
+    }
+    
+    # Keep the index order (most recently shared first)
+    return trusted_response(PatientResponse, [
+        patients_by_id[patient_id]
+        for patient_id in patient_ids if patient_id in patients_by_id
+    ])
+
+
+@router.get("/me/patients/{patient_id}", response_model=PatientResponse)
+async def get_my_visible_patient(
+    patient_id: str,
+    current_professional: ProfessionalInDB = Depends(require_patient_access)
+):
+    """Get a patient shared with the current professional"""
+    if not ObjectId.is_valid(patient_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid patient ID format"
+        )
+    
+    patients_collection = await get_collection("patients")
+    # Archived patients keep their grants (restored with them) but are hidden
+    patient = await patients_collection.find_one(
+        {"_id": ObjectId(patient_id), "status_patient": {"$ne": "archived"}}
+    )
+    
+    if not patient:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Patient not found"
+        )
+    
+    return trusted_response(PatientResponse, patient)
+
+
+@router.post("/access-index/rebuild")
+async def rebuild_patient_access_index(current_admin: AdminInDB = Depends(get_super_admin_hybrid)):
+    """Rebuild the patient access index from patient records and shares (super admin)"""
+    return await patient_access.rebuild_access_index()
+
+
 @router.get("/clinic/{clinic_id}/stats")
 async def get_clinic_professionals_stats(
     clinic_id: str,
     current_admin: AdminInDB = Depends(get_admin_or_moderator_hybrid)
 ):
     """Get professionals statistics for a clinic"""
-    professionals_collection = await get_collection("professionals")
+    professionals_collection = await get_analytics_collection("professionals")
     
     # Get counts by status
     pipeline = [
@@ -1,7 +1,9 @@
 from typing import Optional
 from fastapi import Depends, HTTPException, status, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials, APIKeyHeader
+from bson import ObjectId
 from ..core.database import get_collection
+from ..core import patient_access
 from ..models.admin import AdminInDB
 from ..models.clinic import ClinicInDB
 from ..models.professional import ProfessionalInDB
@@ -115,6 +117,24 @@ async def get_current_professional(current_user: dict = Depends(get_current_user
     return ProfessionalInDB(**professional)
 
 
+async def _require_shared_patient(professional: ProfessionalInDB, patient_id: str) -> ProfessionalInDB:
+    """Membership check against the patient access index (one indexed lookup)"""
+    if not await patient_access.has_access(professional.id, patient_id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied: Patient has not been shared with this professional"
+        )
+    return professional
+
+
+async def require_patient_access(
+    patient_id: str,
+    current_professional: ProfessionalInDB = Depends(get_current_professional)
+) -> ProfessionalInDB:
+    """Ensure a patient has been shared with the current professional"""
+    return await _require_shared_patient(current_professional, patient_id)
+
+
 async def get_admin_or_clinic(current_user: dict = Depends(get_current_user)) -> dict:
     """Require admin or clinic access"""
     if current_user.get("type") not in ["admin", "clinic"]:
@@ -267,4 +287,32 @@ async def get_super_admin_hybrid(current_admin: AdminInDB = Depends(get_current_
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Super admin access required"
         )
-    return current_admin
\ No newline at end of file
+    return current_admin
+
+
+# Patient reads shared by admins and professionals
+
+async def get_patient_reader(patient_id: str, user: dict = Depends(get_user_or_api_key)):
+    """Admin or moderator (Bearer token OR X-API-Key), or a professional the patient is shared with"""
+    if user.get("type") == "professional":
+        return await _require_shared_patient(await get_current_professional(user), patient_id)
+    return await get_admin_or_moderator_hybrid(await get_current_admin_hybrid(user))
+
+
+async def get_document_reader(document_id: str, user: dict = Depends(get_user_or_api_key)):
+    """Like get_patient_reader, for the patient a document belongs to"""
+    if user.get("type") != "professional":
+        return await get_admin_or_moderator_hybrid(await get_current_admin_hybrid(user))
+    
+    professional = await get_current_professional(user)
+    document = None
+    if ObjectId.is_valid(document_id):
+        documents_collection = await get_collection("documents")
+        document = await documents_collection.find_one({"_id": ObjectId(document_id)}, {"patient_id": 1})
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document not found"
+        )
+    return await _require_shared_patient(professional, document["patient_id"])
+
@@ -0,0 +1,303 @@
+# HTTP response compression (zstd / brotli / gzip)
+#
+# CompressionMiddleware picks an encoding from the request's Accept-Encoding
+# (q-values honored, ties broken by COMPRESSION_ENCODINGS order) among the
+# codecs available: gzip always, brotli and zstd when the optional
+# ``brotli`` / ``zstandard`` packages are installed.
+#
+# A response is compressed only when it is worth it and safe to:
+#   - textual content type (JSON, text, JS, XML, SVG...), not already encoded
+#   - at least COMPRESSION_MINIMUM_SIZE bytes
+#   - not a range response (Range request, Accept-Ranges / Content-Range) -
+#     byte offsets refer to the identity body, so document downloads, zips
+#     and images are left alone
+#   - no "Cache-Control: no-transform"
+#
+# Single-message bodies are compressed in one go (in a worker thread when
+# large, so the event loop keeps serving). Streaming responses (StreamingResponse
+# exports) are compressed incrementally: each chunk is flushed as it is
+# produced, so the client receives data as soon as the handler yields it.
+
+from typing import Dict, List, Optional, Tuple
+import logging
+import zlib
+
+import anyio
+
+from . import metrics
+from .config import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Bodies larger than this are compressed off the event loop
+OFFLOAD_THRESHOLD = 256 * 1024
+
+COMPRESSIBLE_TYPES = frozenset({
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "application/x-ndjson",
+    "application/graphql-response+json",
+    "image/svg+xml"
+})
+
+
+class _GzipEncoder:
+    def __init__(self):
+        level = min(max(settings.compression_gzip_level, 1), 9)
+        # wbits 31 = gzip container
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def process(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliEncoder:
+    def __init__(self):
+        quality = min(max(settings.compression_brotli_quality, 0), 11)
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def process(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class _ZstdEncoder:
+    def __init__(self):
+        level = min(max(settings.compression_zstd_level, 1), 19)
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def process(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+ENCODERS = {"gzip": _GzipEncoder}
+if brotli is not None:
+    ENCODERS["br"] = _BrotliEncoder
+if zstandard is not None:
+    ENCODERS["zstd"] = _ZstdEncoder
+
+
+def available_encodings() -> List[str]:
+    """Configured encodings this process can produce, in preference order"""
+    configured = [name.strip().lower() for name in settings.compression_encodings.split(",")]
+    return [name for name in configured if name in ENCODERS]
+
+
+def parse_accept_encoding(accept_encoding: str) -> Dict[str, float]:
+    """Accept-Encoding as {coding: q-value} (lowercase codings, "*" included)"""
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name] = weight
+    return weights
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Choose a content coding for an Accept-Encoding header
+
+    Args:
+        accept_encoding: Header value, e.g. ``gzip, deflate, br;q=0.9``
+
+    Returns:
+        The acceptable encoding with the highest q-value (server preference
+        on ties), or None to send the body as-is
+    """
+    weights = parse_accept_encoding(accept_encoding)
+    best, best_weight = None, 0.0
+    for name in available_encodings():
+        weight = weights.get(name, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = name, weight
+    return best
+
+
+def is_compressible(content_type: str) -> bool:
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    return (
+        media_type.startswith("text/")
+        or media_type in COMPRESSIBLE_TYPES
+        or media_type.endswith(("+json", "+xml"))
+    )
+
+
+class _CompressionResponder:
+    """Send wrapper for one response; decides once headers and the first body chunk are known"""
+
+    def __init__(self, send, encoding: str):
+        self.send = send
+        self.encoding = encoding
+        self.start_message: Optional[dict] = None
+        self.encoder = None
+        self.passthrough = False
+        self.original_size = 0
+        self.compressed_size = 0
+
+    def _header_decision(self, headers: List[Tuple[bytes, bytes]]) -> Tuple[bool, bool]:
+        """(compressible content type, still a candidate for compression)"""
+        values = {name.lower(): value.decode("latin-1") for name, value in headers}
+        compressible = is_compressible(values.get(b"content-type", ""))
+        if not compressible or self.start_message["status"] in (204, 206, 304) or self.start_message["status"] < 200:
+            return compressible, False
+        if b"content-encoding" in values or b"content-range" in values:
+            return compressible, False
+        if values.get(b"accept-ranges", "none").lower() != "none":
+            return compressible, False
+        if "no-transform" in values.get(b"cache-control", "").lower():
+            return compressible, False
+        length = values.get(b"content-length")
+        if length is not None and length.isdigit() and int(length) < settings.compression_minimum_size:
+            return compressible, False
+        return compressible, True
+
+    def _encoded_headers(self, content_length: Optional[int]) -> List[Tuple[bytes, bytes]]:
+        headers = []
+        for name, value in self.start_message.get("headers", []):
+            lowered = name.lower()
+            if lowered == b"content-length" or lowered == b"vary":
+                continue
+            if lowered == b"etag" and not value.startswith(b"W/"):
+                # Same resource, different bytes: the validator becomes weak
+                value = b"W/" + value
+            headers.append((name, value))
+        headers.append((b"content-encoding", self.encoding.encode("latin-1")))
+        headers.append((b"vary", self._vary()))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode("latin-1")))
+        return headers
+
+    def _vary(self) -> bytes:
+        for name, value in self.start_message.get("headers", []):
+            if name.lower() == b"vary":
+                if b"accept-encoding" in value.lower() or value.strip() == b"*":
+                    return value
+                return value + b", Accept-Encoding"
+        return b"Accept-Encoding"
+
+    async def _send_identity(self, message: dict, vary: bool) -> None:
+        self.passthrough = True
+        start = self.start_message
+        if vary:
+            headers = [(name, value) for name, value in start.get("headers", []) if name.lower() != b"vary"]
+            headers.append((b"vary", self._vary()))
+            start = {**start, "headers": headers}
+        await self.send(start)
+        await self.send(message)
+
+    async def __call__(self, message: dict) -> None:
+        if self.passthrough:
+            await self.send(message)
+            return
+
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            return
+
+        if self.encoder is None:
+            # First message after the headers: decide
+            if message["type"] != "http.response.body":
+                # zero-copy and other extensions are sent untouched
+                await self._send_identity(message, vary=False)
+                return
+            compressible, candidate = self._header_decision(self.start_message.get("headers", []))
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if not candidate or (not more_body and len(body) < settings.compression_minimum_size):
+                await self._send_identity(message, vary=compressible)
+                return
+
+            self.encoder = ENCODERS[self.encoding]()
+            if not more_body:
+                await self._send_whole(body)
+                return
+
+            await self.send({**self.start_message, "headers": self._encoded_headers(None)})
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        self.original_size += len(body)
+        chunk = self.encoder.process(body)
+        chunk += self.encoder.flush() if more_body else self.encoder.finish()
+        self.compressed_size += len(chunk)
+        if chunk or not more_body:
+            await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+        if not more_body:
+            metrics.count_compressed_response(self.encoding, self.original_size, self.compressed_size)
+
+    async def _send_whole(self, body: bytes) -> None:
+        def compress() -> bytes:
+            return self.encoder.process(body) + self.encoder.finish()
+
+        if len(body) > OFFLOAD_THRESHOLD:
+            compressed = await anyio.to_thread.run_sync(compress)
+        else:
+            compressed = compress()
+        await self.send({**self.start_message, "headers": self._encoded_headers(len(compressed))})
+        await self.send({"type": "http.response.body", "body": compressed})
+        metrics.count_compressed_response(self.encoding, len(body), len(compressed))
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses per Accept-Encoding"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"range":
+                # Ranges address the identity body
+                accept_encoding = ""
+                break
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+
+        encoding = negotiate_encoding(accept_encoding) if accept_encoding else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        await self.app(scope, receive, _CompressionResponder(send, encoding))
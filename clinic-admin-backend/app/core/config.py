@@ -4,10 +4,61 @@ from pydantic import Field
 
 
 class Settings(BaseSettings):
+    # Logging (LOG_FORMAT json|text; LOG_LEVELS "module=LEVEL,..."; DEBUG
+    # records are kept with probability LOG_DEBUG_SAMPLE_RATE)
+    log_level: str = Field(default="INFO", env="LOG_LEVEL")
+    log_format: str = Field(default="json", env="LOG_FORMAT")
+    log_levels: str = Field(default="", env="LOG_LEVELS")
+    log_debug_sample_rate: float = Field(default=1.0, env="LOG_DEBUG_SAMPLE_RATE")
+    
     # Database
     mongodb_url: str = Field(default="mongodb://192.168.1.23:60516", env="MONGODB_URL")
     database_name: str = Field(default="clinica-dashboard", env="DATABASE_NAME")
     
+    # MongoDB connection pool (0 = driver default / no limit)
+    mongodb_max_pool_size: int = Field(default=100, env="MONGODB_MAX_POOL_SIZE")
+    mongodb_min_pool_size: int = Field(default=0, env="MONGODB_MIN_POOL_SIZE")
+    mongodb_max_idle_time_ms: int = Field(default=0, env="MONGODB_MAX_IDLE_TIME_MS")
+    mongodb_server_selection_timeout_ms: int = Field(default=30000, env="MONGODB_SERVER_SELECTION_TIMEOUT_MS")
+    mongodb_socket_timeout_ms: int = Field(default=0, env="MONGODB_SOCKET_TIMEOUT_MS")
+    # Wire compression, in order of preference; libraries that are not
+    # installed (zstandard, python-snappy) are skipped by the driver
+    mongodb_compressors: str = Field(default="zstd,snappy", env="MONGODB_COMPRESSORS")
+    
+    # Read preference for analytics/report queries, and how stale (seconds,
+    # -1 = unbounded, otherwise >= 90) a secondary may be to serve them
+    mongodb_analytics_read_preference: str = Field(default="secondaryPreferred", env="MONGODB_ANALYTICS_READ_PREFERENCE")
+    mongodb_analytics_max_staleness_seconds: int = Field(default=-1, env="MONGODB_ANALYTICS_MAX_STALENESS_SECONDS")
+    
+    # Per-request MongoDB command instrumentation (0 disables a budget)
+    db_instrumentation_enabled: bool = Field(default=True, env="DB_INSTRUMENTATION_ENABLED")
+    db_query_budget_per_request: int = Field(default=25, env="DB_QUERY_BUDGET_PER_REQUEST")
+    db_time_budget_ms: int = Field(default=500, env="DB_TIME_BUDGET_MS")
+    
+    # Prometheus /metrics (needs prometheus_client; multi-worker deployments
+    # also set PROMETHEUS_MULTIPROC_DIR)
+    metrics_enabled: bool = Field(default=True, env="METRICS_ENABLED")
+    
+    # Request profiling (X-Profile header from super admins, or a random sample)
+    profiling_enabled: bool = Field(default=False, env="PROFILING_ENABLED")
+    profiling_sample_rate: float = Field(default=0.0, env="PROFILING_SAMPLE_RATE")
+    profiling_interval_ms: int = Field(default=5, env="PROFILING_INTERVAL_MS")
+    profiling_max_profiles: int = Field(default=50, env="PROFILING_MAX_PROFILES")
+    
+    # Event loop lag watchdog (logs the blocking stack past the threshold)
+    loop_monitor_enabled: bool = Field(default=True, env="LOOP_MONITOR_ENABLED")
+    loop_monitor_interval_ms: int = Field(default=100, env="LOOP_MONITOR_INTERVAL_MS")
+    loop_lag_threshold_ms: int = Field(default=250, env="LOOP_LAG_THRESHOLD_MS")
+    
+    # Response compression (encodings in preference order; br and zstd need
+    # the optional brotli / zstandard packages)
+    compression_enabled: bool = Field(default=True, env="COMPRESSION_ENABLED")
+    compression_encodings: str = Field(default="zstd,br,gzip", env="COMPRESSION_ENCODINGS")
+    compression_minimum_size: int = Field(default=1024, env="COMPRESSION_MINIMUM_SIZE")
+    compression_gzip_level: int = Field(default=6, env="COMPRESSION_GZIP_LEVEL")
+    compression_brotli_quality: int = Field(default=4, env="COMPRESSION_BROTLI_QUALITY")
+    compression_zstd_level: int = Field(default=3, env="COMPRESSION_ZSTD_LEVEL")
+    
     # Security
     secret_key: str = Field(default="clinic-dashboard-default-secret-change-me", env="SECRET_KEY")
     algorithm: str = Field(default="HS256", env="ALGORITHM")
@@ -35,6 +86,45 @@ class Settings(BaseSettings):
         """Convert comma-separated CORS origins to list"""
         return [origin.strip() for origin in self.cors_origins.split(",")]
     
+    # Document storage backend: "minio" or "local"
+    storage_backend: str = Field(default="minio", env="STORAGE_BACKEND")
+    minio_endpoint: str = Field(default="pampaservers.com:60522", env="MINIO_ENDPOINT")
+    minio_access_key: str = Field(default="pampa", env="MINIO_ACCESS_KEY")
+    minio_secret_key: str = Field(default="servermuA!", env="MINIO_SECRET_KEY")
+    minio_secure: bool = Field(default=False, env="MINIO_SECURE")
+    
+    # Readiness probe of the storage backend (seconds)
+    storage_probe_interval_seconds: float = Field(default=15.0, env="STORAGE_PROBE_INTERVAL_SECONDS")
+    storage_probe_timeout_seconds: float = Field(default=5.0, env="STORAGE_PROBE_TIMEOUT_SECONDS")
+    
+    # Document downloads: stream MinIO objects through the API instead of
+    # redirecting to presigned URLs (clients without access to storage)
+    storage_proxy_downloads: bool = Field(default=False, env="STORAGE_PROXY_DOWNLOADS")
+    
+    # Local disk read-through cache for proxied MinIO objects
+    document_cache_enabled: bool = Field(default=False, env="DOCUMENT_CACHE_ENABLED")
+    document_cache_dir: str = Field(default="cache/documents", env="DOCUMENT_CACHE_DIR")
+    document_cache_max_mb: int = Field(default=1024, env="DOCUMENT_CACHE_MAX_MB")
+    
+    # Object storage resilience: deadlines (seconds), retries with
+    # exponential backoff, optional hedged reads and the circuit breaker
+    storage_read_timeout_seconds: float = Field(default=10.0, env="STORAGE_READ_TIMEOUT_SECONDS")
+    storage_write_timeout_seconds: float = Field(default=120.0, env="STORAGE_WRITE_TIMEOUT_SECONDS")
+    storage_retry_attempts: int = Field(default=3, env="STORAGE_RETRY_ATTEMPTS")
+    storage_retry_base_delay_seconds: float = Field(default=0.2, env="STORAGE_RETRY_BASE_DELAY_SECONDS")
+    storage_hedged_reads: bool = Field(default=False, env="STORAGE_HEDGED_READS")
+    storage_hedge_percentile: float = Field(default=95.0, env="STORAGE_HEDGE_PERCENTILE")
+    storage_breaker_failure_threshold: int = Field(default=5, env="STORAGE_BREAKER_FAILURE_THRESHOLD")
+    storage_breaker_reset_seconds: float = Field(default=30.0, env="STORAGE_BREAKER_RESET_SECONDS")
+    
+    # Plan limits: recount professionals/patients per clinic (0 = disabled)
+    plan_usage_reconcile_interval_minutes: int = Field(default=60, env="PLAN_USAGE_RECONCILE_INTERVAL_MINUTES")
+    
+    # Document previews
+    preview_workers: int = Field(default=2, env="PREVIEW_WORKERS")
+    preview_max_dimension: int = Field(default=320, env="PREVIEW_MAX_DIMENSION")
+    preview_queue_size: int = Field(default=1000, env="PREVIEW_QUEUE_SIZE")
+    
     # Admin UI
     admin_ui_port: int = Field(default=8501, env="ADMIN_UI_PORT")
     admin_ui_host: str = Field(default="0.0.0.0", env="ADMIN_UI_HOST")
@@ -1,5 +1,13 @@
+import logging
+
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
 from .config import settings
+from . import metrics
+from .db_instrumentation import command_listener
+
+logger = logging.getLogger(__name__)
+
 
 class DatabaseManager:
     client: AsyncIOMotorClient = None
@@ -8,17 +16,37 @@ class DatabaseManager:
 database_manager = DatabaseManager()
 
 
+def _client_options() -> dict:
+    """Pool, timeout and compression options from settings (0 = driver default)"""
+    options = {
+        "maxPoolSize": settings.mongodb_max_pool_size,
+        "minPoolSize": settings.mongodb_min_pool_size,
+        "serverSelectionTimeoutMS": settings.mongodb_server_selection_timeout_ms,
+        "appname": "clinic-admin-backend"
+    }
+    if settings.mongodb_max_idle_time_ms:
+        options["maxIdleTimeMS"] = settings.mongodb_max_idle_time_ms
+    if settings.mongodb_socket_timeout_ms:
+        options["socketTimeoutMS"] = settings.mongodb_socket_timeout_ms
+    compressors = [c.strip() for c in settings.mongodb_compressors.split(",") if c.strip()]
+    if compressors:
+        options["compressors"] = compressors
+    if settings.db_instrumentation_enabled or metrics.enabled:
+        options["event_listeners"] = [command_listener]
+    return options
+
+
 async def connect_to_mongo():
     """Create database connection"""
-    database_manager.client = AsyncIOMotorClient(settings.mongodb_url)
+    database_manager.client = AsyncIOMotorClient(settings.mongodb_url, **_client_options())
     database_manager.database = database_manager.client[settings.database_name]
     
     # Test connection
     try:
         await database_manager.client.admin.command('ping')
-        print(f"Connected to MongoDB: {settings.database_name}")
+        logger.info(f"✅ Connected to MongoDB: {settings.database_name}")
     except Exception as e:
-        print(f"Error connecting to MongoDB: {e}")
+        logger.error(f"❌ Error connecting to MongoDB: {e}")
         raise
 
 
@@ -26,7 +54,7 @@ async def close_mongo_connection():
     """Close database connection"""
     if database_manager.client:
         database_manager.client.close()
-        print("Disconnected from MongoDB")
+        logger.info("Disconnected from MongoDB")
 
 
 async def get_database() -> AsyncIOMotorDatabase:
@@ -38,4 +66,23 @@ async def get_database() -> AsyncIOMotorDatabase:
 async def get_collection(collection_name: str):
     """Get collection instance"""
     db = await get_database()
-    return db[collection_name]
\ No newline at end of file
+    return db[collection_name]
+
+
+async def get_analytics_collection(collection_name: str):
+    """
+    Get collection instance for analytics/report reads
+    
+    Reads use settings.mongodb_analytics_read_preference (secondaryPreferred
+    by default), so heavy aggregations are served by secondaries when the
+    deployment has them instead of competing with writes on the primary.
+    Results may lag the primary by the replication delay.
+    """
+    db = await get_database()
+    max_staleness = settings.mongodb_analytics_max_staleness_seconds
+    read_preference = make_read_preference(
+        read_pref_mode_from_name(settings.mongodb_analytics_read_preference),
+        None,
+        max_staleness
+    )
+    return db.get_collection(collection_name, read_preference=read_preference)
\ No newline at end of file
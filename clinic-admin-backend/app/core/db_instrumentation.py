@@ -0,0 +1,232 @@
+# MongoDB command instrumentation
+#
+# A pymongo CommandListener registered on the Motor client sees every
+# command sent to the server. Motor runs pymongo in executor threads with a
+# copy of the caller's context, so the RequestDbStats placed in a contextvar
+# by DbInstrumentationMiddleware is visible from the listener and each
+# command is attributed to the HTTP request that issued it. Commands issued
+# outside a request (startup, background jobs) are aggregated under
+# BACKGROUND_ROUTE.
+#
+# At the end of each request the totals are folded into per-route aggregates
+# (keyed by method and route template) and the request is logged when it
+# exceeds the query-count or DB-time budget, together with its most repeated
+# commands - the usual signature of an N+1 loop.
+
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+import logging
+import threading
+
+from pymongo import monitoring
+
+from . import metrics
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_ROUTE = "background"
+
+# Commands that carry no application data (handshakes, auth, session upkeep)
+IGNORED_COMMANDS = frozenset({
+    "hello", "ismaster", "isMaster", "ping", "saslStart", "saslContinue",
+    "authenticate", "getnonce", "endSessions", "buildinfo", "buildInfo"
+})
+
+
+class RequestDbStats:
+    """Database work done on behalf of one request"""
+
+    __slots__ = ("queries", "duration_ms", "documents", "failures", "commands", "_lock")
+
+    def __init__(self):
+        self.queries = 0
+        self.duration_ms = 0.0
+        self.documents = 0
+        self.failures = 0
+        # (command, collection) -> [count, duration_ms]
+        self.commands: Dict[Tuple[str, str], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, command: str, collection: str, duration_ms: float, documents: int, failed: bool) -> None:
+        # Listener callbacks run on executor threads
+        with self._lock:
+            self.queries += 1
+            self.duration_ms += duration_ms
+            self.documents += documents
+            if failed:
+                self.failures += 1
+            entry = self.commands.setdefault((command, collection), [0, 0.0])
+            entry[0] += 1
+            entry[1] += duration_ms
+
+    def top_commands(self, limit: int = 5) -> List[Dict]:
+        with self._lock:
+            ranked = sorted(self.commands.items(), key=lambda item: (item[1][0], item[1][1]), reverse=True)
+        return [
+            {"command": command, "collection": collection, "count": count, "duration_ms": round(duration, 2)}
+            for (command, collection), (count, duration) in ranked[:limit]
+        ]
+
+
+_current_request: ContextVar[Optional[RequestDbStats]] = ContextVar("db_request_stats", default=None)
+
+
+def current_request_stats() -> Optional[RequestDbStats]:
+    """Stats of the request being served in this context, if any"""
+    return _current_request.get()
+
+
+def _documents_in_reply(reply: Dict) -> int:
+    """Number of documents returned or affected by a command reply"""
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        batch = cursor.get("firstBatch", cursor.get("nextBatch"))
+        return len(batch) if isinstance(batch, list) else 0
+    if isinstance(reply.get("value"), dict):
+        # findAndModify
+        return 1
+    n = reply.get("n")
+    return n if isinstance(n, int) else 0
+
+
+class _RouteAggregate:
+    __slots__ = ("requests", "queries", "duration_ms", "documents", "max_queries", "max_duration_ms", "over_budget")
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.duration_ms = 0.0
+        self.documents = 0
+        self.max_queries = 0
+        self.max_duration_ms = 0.0
+        self.over_budget = 0
+
+    def add(self, stats: RequestDbStats, over_budget: bool) -> None:
+        self.requests += 1
+        self.queries += stats.queries
+        self.duration_ms += stats.duration_ms
+        self.documents += stats.documents
+        self.max_queries = max(self.max_queries, stats.queries)
+        self.max_duration_ms = max(self.max_duration_ms, stats.duration_ms)
+        if over_budget:
+            self.over_budget += 1
+
+    def to_dict(self) -> Dict:
+        requests = self.requests or 1
+        return {
+            "requests": self.requests,
+            "queries": self.queries,
+            "avg_queries": round(self.queries / requests, 2),
+            "max_queries": self.max_queries,
+            "db_time_ms": round(self.duration_ms, 2),
+            "avg_db_time_ms": round(self.duration_ms / requests, 2),
+            "max_db_time_ms": round(self.max_duration_ms, 2),
+            "documents": self.documents,
+            "over_budget": self.over_budget
+        }
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Attributes each command to the current request and to per-route totals"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (connection_id, request_id) -> (command, collection)
+        self._in_flight: Dict[Tuple, Tuple[str, str]] = {}
+        self._routes: Dict[str, _RouteAggregate] = {}
+        self._background = RequestDbStats()
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        with self._lock:
+            self._in_flight[(event.connection_id, event.request_id)] = (
+                event.command_name,
+                collection if isinstance(collection, str) else ""
+            )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finish(event, _documents_in_reply(event.reply), failed=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finish(event, 0, failed=True)
+
+    def _finish(self, event, documents: int, failed: bool) -> None:
+        with self._lock:
+            started = self._in_flight.pop((event.connection_id, event.request_id), None)
+        if started is None:
+            return
+        command, collection = started
+        stats = _current_request.get() or self._background
+        stats.record(command, collection, event.duration_micros / 1000, documents, failed)
+        metrics.observe_mongo_command(command, collection, event.duration_micros / 1_000_000, documents, failed)
+
+    def finish_request(self, route: str, stats: RequestDbStats) -> None:
+        """Fold a finished request into its route and enforce the budgets"""
+        over_budget = (
+            (settings.db_query_budget_per_request > 0 and stats.queries > settings.db_query_budget_per_request)
+            or (settings.db_time_budget_ms > 0 and stats.duration_ms > settings.db_time_budget_ms)
+        )
+        with self._lock:
+            aggregate = self._routes.get(route)
+            if aggregate is None:
+                aggregate = self._routes[route] = _RouteAggregate()
+            aggregate.add(stats, over_budget)
+        if over_budget:
+            logger.warning(
+                f"🐢 {route} exceeded DB budget: {stats.queries} queries, "
+                f"{stats.duration_ms:.1f} ms, top commands {stats.top_commands(3)}"
+            )
+
+    def get_stats(self) -> Dict:
+        """Per-route aggregates, busiest routes first"""
+        with self._lock:
+            routes = {route: aggregate.to_dict() for route, aggregate in self._routes.items()}
+            in_flight = len(self._in_flight)
+        background = self._background
+        return {
+            "budgets": {
+                "queries_per_request": settings.db_query_budget_per_request,
+                "db_time_ms": settings.db_time_budget_ms
+            },
+            "routes": dict(sorted(routes.items(), key=lambda item: item[1]["db_time_ms"], reverse=True)),
+            "background": {
+                "queries": background.queries,
+                "db_time_ms": round(background.duration_ms, 2),
+                "documents": background.documents,
+                "top_commands": background.top_commands()
+            },
+            "in_flight_commands": in_flight
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._routes.clear()
+            self._background = RequestDbStats()
+
+
+command_listener = MongoCommandListener()
+
+
+class DbInstrumentationMiddleware:
+    """ASGI middleware giving each HTTP request its own RequestDbStats"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.db_instrumentation_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestDbStats()
+        token = _current_request.set(stats)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_request.reset(token)
+            command_listener.finish_request(f"{scope['method']} {metrics.route_template(scope)}", stats)
@@ -0,0 +1,248 @@
+# Content-addressed blob registry for medical documents
+#
+# Every stored file is a blob identified by (clinic_id, backend, sha256) in
+# the document_blobs collection; documents records point at the blob through
+# blob_id and share its object. ref_count tracks how many documents use a
+# blob, so re-uploading identical content only takes a reference. The
+# storage backend ("local" / "minio") is part of the key: content stored on
+# one backend is never reused by an upload to the other.
+#
+# Object names embed the blob _id (blobs/sha256/ab/<sha256>/<blob_id>): when
+# the last reference goes away the blob record is deleted conditionally on
+# ref_count == 0 before its object is removed, and a concurrent upload of the
+# same content creates a new blob record with a different object name, so it
+# can never lose its data to that removal.
+#
+# A migration stores the blob it acquired on the document (migration_blob_id)
+# before uploading, so a retry reuses that reference instead of taking a new
+# one; reconciliation counts those references like blob_id ones.
+
+from datetime import datetime, timedelta
+from typing import BinaryIO, Dict, Optional, Tuple
+import hashlib
+import logging
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from .database import get_collection
+
+logger = logging.getLogger(__name__)
+
+BLOBS_COLLECTION = "document_blobs"
+
+HASH_CHUNK_SIZE = 1024 * 1024
+RECONCILE_GRACE_PERIOD = timedelta(hours=1)
+
+
+def hash_stream(file_data: BinaryIO) -> Tuple[str, int]:
+    """
+    Compute SHA-256 and size of a seekable stream in fixed-size chunks
+
+    The stream is rewound afterwards so it can be uploaded. Blocking - run
+    it in a worker thread.
+
+    Args:
+        file_data: Seekable binary stream
+
+    Returns:
+        Tuple of (hex digest, size in bytes)
+    """
+    digest = hashlib.sha256()
+    size = 0
+    file_data.seek(0)
+    while True:
+        chunk = file_data.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        size += len(chunk)
+    file_data.seek(0)
+    return digest.hexdigest(), size
+
+
+def blob_object_name(sha256: str, blob_id: ObjectId) -> str:
+    """Object name of a blob generation"""
+    return f"blobs/sha256/{sha256[:2]}/{sha256}/{blob_id}"
+
+
+async def acquire_blob(
+    clinic_id: str,
+    backend: str,
+    sha256: str,
+    size: int,
+    content_type: str
+) -> Tuple[Dict, bool]:
+    """
+    Take a reference on the blob for this content, creating it if needed
+
+    Args:
+        clinic_id: Clinic identifier
+        backend: Storage backend the object lives on ("local" or "minio")
+        sha256: Content hash
+        size: Content size in bytes
+        content_type: MIME type of the first upload
+
+    Returns:
+        Tuple of (blob document, needs_upload). needs_upload is True until
+        some uploader has stored the object and marked the blob ready.
+    """
+    blobs_collection = await get_collection(BLOBS_COLLECTION)
+    blob_id = ObjectId()
+    now = datetime.utcnow()
+
+    update = {
+        "$inc": {"ref_count": 1},
+        "$set": {"last_referenced_at": now},
+        "$setOnInsert": {
+            "_id": blob_id,
+            "clinic_id": clinic_id,
+            "backend": backend,
+            "sha256": sha256,
+            "size": size,
+            "content_type": content_type,
+            "object_name": blob_object_name(sha256, blob_id),
+            "state": "pending",
+            "created_at": now
+        }
+    }
+
+    try:
+        blob = await blobs_collection.find_one_and_update(
+            {"clinic_id": clinic_id, "backend": backend, "sha256": sha256},
+            update,
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Lost the insert race - reference the blob the other upload created
+        del update["$setOnInsert"]
+        blob = await blobs_collection.find_one_and_update(
+            {"clinic_id": clinic_id, "backend": backend, "sha256": sha256},
+            update,
+            return_document=ReturnDocument.AFTER
+        )
+
+    return blob, blob["state"] != "ready"
+
+
+async def reuse_blob(clinic_id: str, backend: str, blob_id, sha256: str) -> Optional[Dict]:
+    """
+    Blob a caller already holds a reference on, if it still stores this content
+
+    Args:
+        clinic_id: Clinic identifier
+        backend: Storage backend the upload targets
+        blob_id: Blob referenced by an earlier attempt (ObjectId or its string form)
+        sha256: Hash of the content being uploaded now
+
+    Returns:
+        The blob document, or None when it is gone, holds other content or
+        lives on another backend
+    """
+    blobs_collection = await get_collection(BLOBS_COLLECTION)
+    blob_oid = ObjectId(blob_id) if isinstance(blob_id, str) else blob_id
+
+    return await blobs_collection.find_one_and_update(
+        {"_id": blob_oid, "clinic_id": clinic_id, "backend": backend, "sha256": sha256},
+        {"$set": {"last_referenced_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def mark_blob_ready(blob_id: ObjectId, etag: Optional[str]) -> None:
+    """Record that the blob's object is stored"""
+    blobs_collection = await get_collection(BLOBS_COLLECTION)
+    await blobs_collection.update_one(
+        {"_id": blob_id},
+        {"$set": {"state": "ready", "etag": etag, "stored_at": datetime.utcnow()}}
+    )
+
+
+async def release_blob(blob_id) -> Optional[Dict]:
+    """
+    Drop a reference on a blob
+
+    Args:
+        blob_id: Blob identifier (ObjectId or its string form)
+
+    Returns:
+        The blob document if this was the last reference and the record was
+        removed - the caller must then delete its object - otherwise None
+    """
+    blobs_collection = await get_collection(BLOBS_COLLECTION)
+    blob_oid = ObjectId(blob_id) if isinstance(blob_id, str) else blob_id
+
+    blob = await blobs_collection.find_one_and_update(
+        {"_id": blob_oid},
+        {"$inc": {"ref_count": -1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not blob or blob["ref_count"] > 0:
+        return None
+
+    # Only delete if nobody re-referenced the blob in the meantime
+    result = await blobs_collection.delete_one({"_id": blob_oid, "ref_count": {"$lte": 0}})
+    return blob if result.deleted_count else None
+
+
+async def reconcile_blob_references(clinic_id: str) -> Dict[str, any]:
+    """
+    Recompute ref_count of a clinic's blobs from the documents collection
+
+    Corrects references leaked by crashes between taking a reference and
+    writing the documents record. Blobs referenced recently are skipped, as
+    their documents record may not be written yet.
+
+    Args:
+        clinic_id: Clinic identifier
+
+    Returns:
+        Counts of blobs checked and corrected, plus the removed blob records
+        left without references (their objects must be deleted by the caller)
+    """
+    documents_collection = await get_collection("documents")
+    blobs_collection = await get_collection(BLOBS_COLLECTION)
+
+    references = {}
+    # Migrations hold their reference under migration_blob_id until they finish
+    for field in ("blob_id", "migration_blob_id"):
+        async for row in documents_collection.aggregate([
+            {"$match": {"clinic_id": clinic_id, field: {"$exists": True}}},
+            {"$group": {"_id": f"${field}", "count": {"$sum": 1}}}
+        ]):
+            references[str(row["_id"])] = references.get(str(row["_id"]), 0) + row["count"]
+
+    checked = corrected = 0
+    orphaned_blobs = []
+    settled_before = datetime.utcnow() - RECONCILE_GRACE_PERIOD
+    async for blob in blobs_collection.find(
+        {"clinic_id": clinic_id, "last_referenced_at": {"$lt": settled_before}},
+        {"ref_count": 1, "object_name": 1, "preview_object_name": 1}
+    ):
+        checked += 1
+        expected = references.get(str(blob["_id"]), 0)
+        if blob["ref_count"] == expected:
+            continue
+
+        # Conditional on the observed value so concurrent references are kept
+        if expected == 0:
+            result = await blobs_collection.delete_one(
+                {"_id": blob["_id"], "ref_count": blob["ref_count"]}
+            )
+            if result.deleted_count:
+                orphaned_blobs.append(blob)
+                corrected += 1
+        else:
+            result = await blobs_collection.update_one(
+                {"_id": blob["_id"], "ref_count": blob["ref_count"]},
+                {"$set": {"ref_count": expected}}
+            )
+            corrected += result.modified_count
+
+    logger.info(
+        f"📊 Reconciled blob references for clinic {clinic_id}: "
+        f"{checked} checked, {corrected} corrected, {len(orphaned_blobs)} orphaned"
+    )
+    return {"checked": checked, "corrected": corrected, "orphaned_blobs": orphaned_blobs}
@@ -0,0 +1,157 @@
+# Streaming ZIP bundles of a patient's documents
+#
+# The archive is produced on the fly: zipfile writes into an in-memory sink
+# that is drained after every chunk, so nothing is spooled to disk and
+# memory stays bounded regardless of how many documents are bundled.
+# A small window of documents is fetched concurrently from storage, each
+# into its own bounded chunk queue, while entries are written strictly in
+# cursor order.
+
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Set
+import asyncio
+import logging
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_CHUNK_SIZE = 256 * 1024
+PREFETCH_WINDOW = 4
+CHUNKS_PER_DOCUMENT = 4
+
+_END_OF_DOCUMENT = object()
+
+
+class _ZipSink:
+    """Unseekable write target collecting zipfile output until drained"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _entry_name(document: Dict, used_names: Set[str]) -> str:
+    """Unique, path-safe archive name: <document_type>/<date>_<file_name>"""
+    file_name = (document.get("file_name") or str(document["_id"])).replace("\\", "_").replace("/", "_")
+    if file_name in ("", ".", ".."):
+        file_name = str(document["_id"])
+    created_at = document.get("created_at")
+    prefix = created_at.strftime("%Y%m%d") + "_" if isinstance(created_at, datetime) else ""
+    name = f"{document.get('document_type', 'other')}/{prefix}{file_name}"
+
+    candidate = name
+    counter = 1
+    while candidate in used_names:
+        stem, dot, extension = name.rpartition(".")
+        candidate = f"{stem}_{counter}.{extension}" if dot else f"{name}_{counter}"
+        counter += 1
+    used_names.add(candidate)
+    return candidate
+
+
+async def _prefetch(storage_service, document: Dict, chunks: asyncio.Queue) -> None:
+    """Fetch one document into its bounded chunk queue"""
+    try:
+        async for chunk in storage_service.iter_document_content(document, BUNDLE_CHUNK_SIZE):
+            await chunks.put(chunk)
+        await chunks.put(_END_OF_DOCUMENT)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        await chunks.put(e)
+
+
+async def stream_documents_zip(storage_service, documents_cursor) -> AsyncIterator[bytes]:
+    """
+    Stream a ZIP archive of the given documents
+
+    Documents that cannot be read before their entry starts are skipped and
+    listed in a MISSING_FILES.txt entry at the end of the archive.
+
+    Args:
+        storage_service: MedicalDocumentStorageService to read content from
+        documents_cursor: Async iterator over documents records, in entry order
+
+    Yields:
+        ZIP archive bytes
+    """
+    window: asyncio.Queue = asyncio.Queue(maxsize=PREFETCH_WINDOW)
+    fetch_tasks: Set[asyncio.Task] = set()
+
+    async def schedule():
+        # Blocks on the bounded window, so at most PREFETCH_WINDOW fetches run ahead
+        try:
+            async for document in documents_cursor:
+                chunks: asyncio.Queue = asyncio.Queue(maxsize=CHUNKS_PER_DOCUMENT)
+                task = asyncio.create_task(_prefetch(storage_service, document, chunks))
+                fetch_tasks.add(task)
+                task.add_done_callback(fetch_tasks.discard)
+                await window.put((document, chunks))
+        except Exception as e:
+            # Cursor failed (Mongo error, cursor timeout) - handed to the consumer to raise
+            await window.put(e)
+        else:
+            await window.put(None)
+
+    scheduler = asyncio.create_task(schedule())
+    sink = _ZipSink()
+    used_names: Set[str] = set()
+    missing: List[str] = []
+
+    try:
+        with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            while True:
+                item = await window.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                document, chunks = item
+
+                first_chunk = await chunks.get()
+                if isinstance(first_chunk, Exception):
+                    logger.warning(f"⚠️ Skipping document {document['_id']} in bundle: {str(first_chunk)}")
+                    missing.append(f"{document.get('file_name', document['_id'])}: {str(first_chunk)}")
+                    continue
+
+                entry = zipfile.ZipInfo(_entry_name(document, used_names))
+                created_at = document.get("created_at")
+                if isinstance(created_at, datetime) and created_at.year >= 1980:
+                    entry.date_time = created_at.timetuple()[:6]
+                entry.compress_type = zipfile.ZIP_STORED
+                entry.file_size = document.get("file_size") or 0
+
+                # force_zip64 keeps the header valid even if the recorded size is stale
+                with archive.open(entry, mode="w", force_zip64=entry.file_size > 2 ** 30) as entry_file:
+                    chunk = first_chunk
+                    while chunk is not _END_OF_DOCUMENT:
+                        if isinstance(chunk, Exception):
+                            # Entry already partially sent - the archive cannot be completed
+                            raise chunk
+                        entry_file.write(chunk)
+                        yield sink.drain()
+                        chunk = await chunks.get()
+
+                yield sink.drain()
+
+            if missing:
+                archive.writestr("MISSING_FILES.txt", "\n".join(missing) + "\n")
+
+        # Central directory is written on close
+        yield sink.drain()
+
+    finally:
+        scheduler.cancel()
+        for task in list(fetch_tasks):
+            task.cancel()
@@ -0,0 +1,241 @@
+# Local disk read-through cache for MinIO objects
+#
+# Used whenever the backend streams object bytes itself (proxied downloads,
+# ZIP bundles). Entries are whole objects stored under
+# <cache_dir>/<ab>/<key>-<etag>; the etag in the file name is compared with
+# the etag the caller expects (from the documents record, or a stat call),
+# so an overwritten object is never served from a stale entry. An in-memory
+# OrderedDict keeps LRU order and the total size under the configured cap.
+
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import uuid
+
+import aiofiles
+import aiofiles.os
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+CACHE_CHUNK_SIZE = 256 * 1024
+
+FetchFactory = Callable[[int, Optional[int]], AsyncIterator[bytes]]
+
+
+def _safe_etag(etag: str) -> str:
+    """ETag reduced to characters safe in a file name"""
+    return re.sub(r"[^A-Za-z0-9]", "", etag.strip('"'))[:64]
+
+
+class DocumentCache:
+    """Size-capped LRU cache of object contents on local disk"""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # key -> (etag, size, path), least recently used first
+        self._entries: "OrderedDict[str, Tuple[str, int, str]]" = OrderedDict()
+        self._total_bytes = 0
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        self._metrics = {
+            "hits": 0,
+            "misses": 0,
+            "stale": 0,
+            "fills": 0,
+            "evictions": 0,
+            "bytes_from_cache": 0,
+            "bytes_from_storage": 0
+        }
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        self._metrics[counter] += amount
+        if counter.startswith("bytes_from_"):
+            metrics.count_cache_bytes("documents", counter[len("bytes_from_"):], amount)
+        else:
+            metrics.count_cache_event("documents", counter, amount)
+
+    @staticmethod
+    def _key(clinic_id: str, object_name: str) -> str:
+        return hashlib.sha256(f"{clinic_id}/{object_name}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str, etag: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}-{_safe_etag(etag)}")
+
+    def _scan(self) -> Dict[str, Tuple[str, int, str, float]]:
+        """Index entries left on disk by a previous process (blocking)"""
+        found = {}
+        if not os.path.isdir(self.cache_dir):
+            return found
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                key, dash, etag = entry.name.partition("-")
+                if not dash or entry.name.startswith(".") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                found[key] = (etag, stat.st_size, entry.path, stat.st_atime)
+        return found
+
+    async def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if self._loaded:
+                return
+            found = await asyncio.to_thread(self._scan)
+            for key, (etag, size, path, _) in sorted(found.items(), key=lambda item: item[1][3]):
+                self._entries[key] = (etag, size, path)
+                self._total_bytes += size
+            self._loaded = True
+            await self._evict()
+            logger.info(f"🗄️ Document cache loaded: {len(self._entries)} entries, {self._total_bytes} bytes")
+
+    async def _evict(self) -> None:
+        """Drop least recently used entries until under the size cap"""
+        while self._total_bytes > self.max_bytes and self._entries:
+            _, (_, size, path) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self._count("evictions")
+            try:
+                await aiofiles.os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    async def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._total_bytes -= entry[1]
+            try:
+                await aiofiles.os.remove(entry[2])
+            except FileNotFoundError:
+                pass
+
+    async def _commit(self, key: str, etag: str, temp_path: str, size: int) -> None:
+        path = self._path(key, etag)
+        await aiofiles.os.replace(temp_path, path)
+        previous = self._entries.pop(key, None)
+        if previous:
+            self._total_bytes -= previous[1]
+            if previous[2] != path:
+                try:
+                    await aiofiles.os.remove(previous[2])
+                except FileNotFoundError:
+                    pass
+        self._entries[key] = (etag, size, path)
+        self._total_bytes += size
+        self._count("fills")
+        await self._evict()
+
+    async def iter_object(
+        self,
+        clinic_id: str,
+        object_name: str,
+        fetch: FetchFactory,
+        expected_etag: Optional[str] = None,
+        resolve_etag: Optional[Callable[[], Awaitable[str]]] = None,
+        offset: int = 0,
+        length: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Stream an object (or a byte range) through the cache
+
+        Args:
+            clinic_id: Clinic identifier
+            object_name: Object path in MinIO
+            fetch: Callable(offset, length) streaming the object from storage
+            expected_etag: Current etag of the object, when known
+            resolve_etag: Async callable returning the current etag (stat),
+                used when expected_etag is not known
+            offset: First byte to return
+            length: Number of bytes to return (None = to the end)
+
+        Yields:
+            Content chunks
+        """
+        await self._ensure_loaded()
+        key = self._key(clinic_id, object_name)
+
+        etag = expected_etag
+        if etag is None and resolve_etag is not None:
+            etag = await resolve_etag()
+        etag = _safe_etag(etag) if etag else None
+
+        entry = self._entries.get(key)
+        if entry and etag and entry[0] == etag:
+            self._entries.move_to_end(key)
+            self._count("hits")
+            try:
+                async for chunk in self._read_entry(entry[2], offset, length):
+                    yield chunk
+                return
+            except FileNotFoundError:
+                # Removed behind our back - fall through to storage
+                await self._drop(key)
+        elif entry:
+            self._count("stale")
+            await self._drop(key)
+
+        self._count("misses")
+        if not etag or offset or length is not None:
+            # Partial reads and unvalidated objects are passed through
+            async for chunk in fetch(offset, length):
+                self._count("bytes_from_storage", len(chunk))
+                yield chunk
+            return
+
+        # Full read: tee the object into the cache while streaming it out
+        await aiofiles.os.makedirs(os.path.join(self.cache_dir, key[:2]), exist_ok=True)
+        temp_path = os.path.join(self.cache_dir, key[:2], f".{key}.{uuid.uuid4().hex}.tmp")
+        size = 0
+        committed = False
+        try:
+            async with aiofiles.open(temp_path, "wb") as cache_file:
+                async for chunk in fetch(0, None):
+                    await cache_file.write(chunk)
+                    size += len(chunk)
+                    self._count("bytes_from_storage", len(chunk))
+                    yield chunk
+            if size <= self.max_bytes:
+                await self._commit(key, etag, temp_path, size)
+                committed = True
+        finally:
+            if not committed:
+                try:
+                    await aiofiles.os.remove(temp_path)
+                except FileNotFoundError:
+                    pass
+
+    async def _read_entry(self, path: str, offset: int, length: Optional[int]) -> AsyncIterator[bytes]:
+        async with aiofiles.open(path, "rb") as cache_file:
+            if offset:
+                await cache_file.seek(offset)
+            remaining = length
+            while remaining is None or remaining > 0:
+                read_size = CACHE_CHUNK_SIZE if remaining is None else min(CACHE_CHUNK_SIZE, remaining)
+                chunk = await cache_file.read(read_size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                self._count("bytes_from_cache", len(chunk))
+                yield chunk
+
+    def get_stats(self) -> Dict[str, any]:
+        """Hit/miss counters and occupancy"""
+        lookups = self._metrics["hits"] + self._metrics["misses"]
+        return {
+            **self._metrics,
+            "hit_ratio": round(self._metrics["hits"] / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries),
+            "size_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "cache_dir": self.cache_dir
+        }
@@ -0,0 +1,299 @@
+# Thumbnail generation for image and PDF documents
+#
+# Previews are derived per blob (identical content shares one preview) by a
+# pool of background workers, never on the request path: uploads only
+# enqueue the blob id. Rendering runs in a thread pool, and the JPEG is
+# stored next to the original under the previews/ prefix. Progress is kept
+# on the document_blobs record (preview_state), so blobs whose jobs were
+# dropped (full queue, restart) are picked up again by the startup sweep.
+#
+# Pillow renders images; PyMuPDF additionally renders the first page of
+# PDFs. Both are optional - without them blobs are marked unsupported.
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Iterable, Optional, Set
+import asyncio
+import io
+import logging
+
+from bson import ObjectId
+
+from .config import settings
+from .database import get_collection
+from .document_blobs import BLOBS_COLLECTION
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+    ImageOps = None
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:  # pragma: no cover - optional dependency
+    fitz = None
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_PREFIX = "previews/"
+PREVIEW_CONTENT_TYPE = "image/jpeg"
+PREVIEW_JPEG_QUALITY = 80
+RENDER_LEASE = timedelta(minutes=10)
+
+_queue: Optional[asyncio.Queue] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_workers = []
+
+
+def preview_object_name(blob_object_name: str) -> str:
+    """Object name of a blob's preview, mirroring the original's key"""
+    return f"{PREVIEW_PREFIX}{blob_object_name}.jpg"
+
+
+def render_thumbnail(data: bytes, content_type: str, max_dimension: int) -> Optional[bytes]:
+    """
+    Render a JPEG thumbnail of an image or of a PDF's first page
+
+    Blocking and CPU bound - run it in the preview executor.
+
+    Args:
+        data: Original file content
+        content_type: MIME type recorded at upload
+        max_dimension: Longest side of the thumbnail in pixels
+
+    Returns:
+        JPEG bytes, or None if the content cannot be previewed
+    """
+    if Image is None:
+        return None
+
+    if content_type == "application/pdf" or data[:5] == b"%PDF-":
+        if fitz is None:
+            return None
+        with fitz.open(stream=data, filetype="pdf") as pdf:
+            if pdf.page_count == 0:
+                return None
+            page = pdf.load_page(0)
+            zoom = max_dimension / max(page.rect.width, page.rect.height)
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+    else:
+        try:
+            image = Image.open(io.BytesIO(data))
+        except Exception:
+            # Not an image format Pillow knows (e.g. .docx)
+            return None
+        # Let the JPEG decoder downscale while decoding
+        image.draft("RGB", (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(image)
+
+    image.thumbnail((max_dimension, max_dimension))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=PREVIEW_JPEG_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+def enqueue_preview(storage_service, clinic_id: str, blob_id) -> None:
+    """
+    Schedule preview generation for a blob without waiting for it
+
+    Args:
+        storage_service: MedicalDocumentStorageService holding the blob
+        clinic_id: Clinic identifier
+        blob_id: Blob identifier
+    """
+    if _queue is None:
+        # Workers not running (scripts, tests) - the startup sweep catches up
+        return
+    try:
+        _queue.put_nowait((storage_service, clinic_id, blob_id))
+    except asyncio.QueueFull:
+        logger.warning(f"⚠️ Preview queue full, deferring blob {blob_id}")
+
+
+async def start_preview_workers(storage_service) -> None:
+    """Start the worker pool and re-enqueue blobs still waiting for a preview"""
+    global _queue, _executor, _workers
+    if _workers:
+        return
+
+    worker_count = max(1, settings.preview_workers)
+    _queue = asyncio.Queue(maxsize=settings.preview_queue_size)
+    _executor = ThreadPoolExecutor(max_workers=worker_count, thread_name_prefix="preview")
+    _workers = [asyncio.create_task(_worker()) for _ in range(worker_count)]
+
+    if Image is None:
+        logger.warning("⚠️ Pillow not installed - document previews disabled")
+    elif fitz is None:
+        logger.warning("⚠️ PyMuPDF not installed - PDF previews disabled")
+
+    _workers.append(asyncio.create_task(_resume_pending_previews(storage_service)))
+    logger.info(f"🖼️ Started {worker_count} preview workers")
+
+
+async def stop_preview_workers() -> None:
+    """Stop the worker pool; unfinished blobs are resumed on next startup"""
+    global _queue, _executor, _workers
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    if _executor:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _queue, _executor, _workers = None, None, []
+
+
+async def get_ready_previews(blob_ids: Iterable[str]) -> Set[str]:
+    """
+    Blob ids (as strings) that have a preview available
+
+    Args:
+        blob_ids: Blob ids of the documents being listed
+
+    Returns:
+        Subset of blob_ids whose preview is ready
+    """
+    object_ids = [ObjectId(blob_id) for blob_id in set(blob_ids) if blob_id and ObjectId.is_valid(blob_id)]
+    if not object_ids:
+        return set()
+
+    blobs_collection = await get_collection(BLOBS_COLLECTION)
+    cursor = blobs_collection.find(
+        {"_id": {"$in": object_ids}, "preview_state": "ready"},
+        {"_id": 1}
+    )
+    return {str(blob["_id"]) async for blob in cursor}
+
+
+async def get_preview_location(storage_service, clinic_id: str, blob_id: str) -> Optional[str]:
+    """Storage location of a blob's preview, or None if not rendered"""
+    if not blob_id or not ObjectId.is_valid(blob_id):
+        return None
+    blobs_collection = await get_collection(BLOBS_COLLECTION)
+    blob = await blobs_collection.find_one(
+        {"_id": ObjectId(blob_id), "preview_state": "ready"},
+        {"preview_object_name": 1}
+    )
+    if not blob:
+        return None
+    return storage_service.provider.blob_location(clinic_id, blob["preview_object_name"])
+
+
+async def _resume_pending_previews(storage_service) -> None:
+    """Enqueue blobs without a finished preview (also backfills older blobs)"""
+    try:
+        blobs_collection = await get_collection(BLOBS_COLLECTION)
+        stale_claim = datetime.utcnow() - RENDER_LEASE
+        cursor = blobs_collection.find(
+            {
+                "state": "ready",
+                "$or": [
+                    {"preview_state": {"$exists": False}},
+                    {"preview_state": "pending"},
+                    {"preview_state": "rendering", "preview_claimed_at": {"$lt": stale_claim}}
+                ]
+            },
+            {"clinic_id": 1}
+        )
+        async for blob in cursor:
+            # Wait for room instead of dropping: this is the catch-up path
+            await _queue.put((storage_service, blob["clinic_id"], blob["_id"]))
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Could not resume pending previews: {str(e)}")
+
+
+async def _worker() -> None:
+    """Consume preview jobs until cancelled"""
+    while True:
+        storage_service, clinic_id, blob_id = await _queue.get()
+        try:
+            await _generate_preview(storage_service, clinic_id, blob_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Preview generation failed for blob {blob_id}: {str(e)}")
+
+
+async def _generate_preview(storage_service, clinic_id: str, blob_id) -> None:
+    """Claim a blob, render its thumbnail and store it under previews/"""
+    blobs_collection = await get_collection(BLOBS_COLLECTION)
+    blob_oid = ObjectId(blob_id) if isinstance(blob_id, str) else blob_id
+    now = datetime.utcnow()
+
+    blob = await blobs_collection.find_one_and_update(
+        {
+            "_id": blob_oid,
+            "state": "ready",
+            "$or": [
+                {"preview_state": {"$exists": False}},
+                {"preview_state": "pending"},
+                {"preview_state": "rendering", "preview_claimed_at": {"$lt": now - RENDER_LEASE}}
+            ]
+        },
+        {"$set": {"preview_state": "rendering", "preview_claimed_at": now}}
+    )
+    if not blob:
+        # Already rendered, being rendered, or blob removed
+        return
+
+    try:
+        original = await storage_service.provider.read_blob(
+            clinic_id, storage_service.provider.blob_location(clinic_id, blob["object_name"])
+        )
+        loop = asyncio.get_running_loop()
+        thumbnail = await loop.run_in_executor(
+            _executor,
+            render_thumbnail,
+            original,
+            blob.get("content_type", ""),
+            settings.preview_max_dimension
+        )
+        if thumbnail is None:
+            await blobs_collection.update_one(
+                {"_id": blob_oid},
+                {"$set": {"preview_state": "unsupported"}, "$unset": {"preview_claimed_at": ""}}
+            )
+            return
+
+        object_name = preview_object_name(blob["object_name"])
+        await storage_service.provider.upload_blob(
+            clinic_id=clinic_id,
+            object_name=object_name,
+            file_data=io.BytesIO(thumbnail),
+            file_size=len(thumbnail),
+            content_type=PREVIEW_CONTENT_TYPE
+        )
+        result = await blobs_collection.update_one(
+            {"_id": blob_oid},
+            {
+                "$set": {
+                    "preview_state": "ready",
+                    "preview_object_name": object_name,
+                    "preview_size": len(thumbnail),
+                    "preview_generated_at": datetime.utcnow()
+                },
+                "$unset": {"preview_claimed_at": ""}
+            }
+        )
+        if not result.matched_count:
+            # Last reference went away while rendering
+            await storage_service.delete_medical_document(
+                clinic_id, storage_service.provider.blob_location(clinic_id, object_name)
+            )
+            return
+        logger.info(f"🖼️ Generated preview for blob {blob_oid}")
+
+    except Exception as e:
+        await blobs_collection.update_one(
+            {"_id": blob_oid},
+            {
+                "$set": {"preview_state": "failed", "preview_error": str(e)},
+                "$unset": {"preview_claimed_at": ""}
+            }
+        )
+        raise
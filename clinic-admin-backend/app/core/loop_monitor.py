@@ -0,0 +1,149 @@
+# Event loop lag watchdog
+#
+# A heartbeat coroutine sleeps LOOP_MONITOR_INTERVAL_MS at a time and
+# measures how late it wakes up - that delay is the event loop lag, exported
+# as a metric and summarized in /health. Lag only becomes visible once the
+# loop is free again, so a watchdog thread watches the heartbeat too: when
+# no beat has landed for LOOP_LAG_THRESHOLD_MS it captures the loop thread's
+# stack while the blocking call is still running, and logs it with the task
+# and the route of the request being served (tracked by
+# LoopMonitorMiddleware). One report is logged per stall.
+
+from typing import Dict, Optional
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from . import metrics
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Frames included in a stall report (innermost last)
+STACK_LIMIT = 40
+
+
+class LoopMonitor:
+    """Heartbeat task plus watchdog thread for one event loop"""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._last_beat = time.monotonic()
+        self._stall_reported = False
+        # task -> ASGI scope of the request it is serving
+        self._task_scopes: Dict[asyncio.Task, dict] = {}
+        self._stats = {"last_lag_ms": 0.0, "max_lag_ms": 0.0, "stalls": 0}
+
+    @property
+    def interval(self) -> float:
+        return max(settings.loop_monitor_interval_ms, 10) / 1000
+
+    @property
+    def threshold(self) -> float:
+        return max(settings.loop_lag_threshold_ms, 1) / 1000
+
+    def start(self) -> None:
+        """Start monitoring the running loop"""
+        if not settings.loop_monitor_enabled or self._heartbeat:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat = asyncio.create_task(self._beat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._heartbeat:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+        if self._watchdog:
+            await asyncio.to_thread(self._watchdog.join, 1)
+            self._watchdog = None
+
+    async def _beat(self) -> None:
+        interval = self.interval
+        while True:
+            scheduled = time.monotonic()
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            lag = max(now - scheduled - interval, 0.0)
+            self._last_beat = now
+            self._stall_reported = False
+            self._stats["last_lag_ms"] = round(lag * 1000, 2)
+            self._stats["max_lag_ms"] = max(self._stats["max_lag_ms"], self._stats["last_lag_ms"])
+            metrics.observe_loop_lag(lag)
+
+    def _watch(self) -> None:
+        # Blocked once the next beat is overdue by more than the threshold
+        check_every = min(self.threshold / 2, self.interval)
+        while not self._stopped.wait(check_every):
+            blocked_for = time.monotonic() - self._last_beat - self.interval
+            if blocked_for >= self.threshold and not self._stall_reported:
+                self._stall_reported = True
+                self._stats["stalls"] += 1
+                metrics.count_loop_stall()
+                self._report_stall(blocked_for)
+
+    def _report_stall(self, blocked_for: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = "".join(traceback.format_stack(frame, limit=STACK_LIMIT))
+        del frame
+
+        task = getattr(asyncio.tasks, "_current_tasks", {}).get(self._loop)
+        scope = self._task_scopes.get(task) if task is not None else None
+        route = f"{scope['method']} {metrics.route_template(scope)} ({scope['path']})" if scope else "no request"
+        task_name = task.get_name() if task is not None else "no task (callback)"
+        logger.warning(
+            f"🧱 Event loop blocked for {blocked_for * 1000:.0f}+ ms in {task_name}, route {route}\n{stack}"
+        )
+
+    def track(self, scope: dict) -> Optional[asyncio.Task]:
+        task = asyncio.current_task()
+        if task is not None:
+            self._task_scopes[task] = scope
+        return task
+
+    def untrack(self, task: Optional[asyncio.Task]) -> None:
+        if task is not None:
+            self._task_scopes.pop(task, None)
+
+    def get_stats(self) -> Dict[str, any]:
+        """Last/maximum lag and number of stalls since startup"""
+        return {
+            "enabled": self._heartbeat is not None,
+            **self._stats,
+            "threshold_ms": settings.loop_lag_threshold_ms
+        }
+
+
+loop_monitor = LoopMonitor()
+
+
+class LoopMonitorMiddleware:
+    """ASGI middleware recording which request each task is serving"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        task = loop_monitor.track(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            loop_monitor.untrack(task)
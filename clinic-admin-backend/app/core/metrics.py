@@ -0,0 +1,223 @@
+# Prometheus metrics
+#
+# Exposition for /metrics. prometheus_client is optional: without it (or with
+# METRICS_ENABLED=False) every recording helper below is a no-op and /metrics
+# answers 503, so instrumented code never has to check.
+#
+# Multi-worker deployments (gunicorn/uvicorn --workers) must point
+# PROMETHEUS_MULTIPROC_DIR at an empty directory shared by the workers
+# before they start. Values are then written to per-process files and
+# /metrics aggregates all workers whichever one serves the scrape; gauges
+# use the "livesum" mode so exited workers drop out.
+#
+# Labels are bounded: routes are templates (or "unmatched"), Mongo
+# collections and storage operations are fixed sets.
+
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+import logging
+import os
+import time
+
+from .config import settings
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+
+UNMATCHED_ROUTE = "unmatched"
+
+enabled = prometheus_client is not None and settings.metrics_enabled
+
+if enabled:
+    HTTP_REQUEST_DURATION = prometheus_client.Histogram(
+        "http_request_duration_seconds",
+        "HTTP request latency by route template, method and status",
+        ["route", "method", "status"]
+    )
+    HTTP_REQUESTS_IN_PROGRESS = prometheus_client.Gauge(
+        "http_requests_in_progress",
+        "HTTP requests being served",
+        ["method"],
+        multiprocess_mode="livesum"
+    )
+    MONGODB_COMMAND_DURATION = prometheus_client.Histogram(
+        "mongodb_command_duration_seconds",
+        "MongoDB command latency by command, collection and outcome",
+        ["command", "collection", "outcome"],
+        buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+    )
+    MONGODB_DOCUMENTS = prometheus_client.Counter(
+        "mongodb_documents_returned",
+        "Documents returned or affected by MongoDB commands",
+        ["command", "collection"]
+    )
+    STORAGE_OPERATION_DURATION = prometheus_client.Histogram(
+        "storage_operation_duration_seconds",
+        "Object storage latency by operation and outcome, retries included",
+        ["backend", "operation", "outcome"],
+        buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 120.0)
+    )
+    STORAGE_BYTES = prometheus_client.Counter(
+        "storage_bytes",
+        "Bytes sent to (upload) or received from (download) object storage",
+        ["backend", "direction"]
+    )
+    PASSWORD_HASH_DURATION = prometheus_client.Histogram(
+        "password_hash_duration_seconds",
+        "bcrypt hash/verify latency",
+        ["operation"],
+        buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0)
+    )
+    PASSWORD_HASH_IN_PROGRESS = prometheus_client.Gauge(
+        "password_hash_in_progress",
+        "bcrypt operations waiting or running",
+        multiprocess_mode="livesum"
+    )
+    CACHE_EVENTS = prometheus_client.Counter(
+        "cache_events",
+        "Cache lookups and maintenance (hits, misses, stale, fills, evictions)",
+        ["cache", "event"]
+    )
+    CACHE_BYTES = prometheus_client.Counter(
+        "cache_bytes_served",
+        "Bytes served through a cache, by where they came from",
+        ["cache", "source"]
+    )
+    EVENT_LOOP_LAG = prometheus_client.Histogram(
+        "event_loop_lag_seconds",
+        "Delay between a scheduled event loop wakeup and the actual one",
+        buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+    )
+    EVENT_LOOP_STALLS = prometheus_client.Counter(
+        "event_loop_stalls",
+        "Times the event loop was blocked longer than the lag threshold"
+    )
+    COMPRESSION_BYTES = prometheus_client.Counter(
+        "http_response_compression_bytes",
+        "Bytes of compressed responses before and after encoding",
+        ["encoding", "stage"]
+    )
+
+
+def route_template(scope) -> str:
+    """Method-less route template of a served request (path parameters unexpanded)"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+def observe_mongo_command(command: str, collection: str, seconds: float, documents: int, failed: bool) -> None:
+    if not enabled:
+        return
+    MONGODB_COMMAND_DURATION.labels(command, collection, "error" if failed else "ok").observe(seconds)
+    if documents:
+        MONGODB_DOCUMENTS.labels(command, collection).inc(documents)
+
+
+def observe_storage_operation(backend: str, operation: str, seconds: float, outcome: str) -> None:
+    if enabled:
+        STORAGE_OPERATION_DURATION.labels(backend, operation, outcome).observe(seconds)
+
+
+def count_storage_bytes(backend: str, direction: str, size: int) -> None:
+    if enabled and size:
+        STORAGE_BYTES.labels(backend, direction).inc(size)
+
+
+def count_cache_event(cache: str, event: str, amount: int = 1) -> None:
+    if enabled:
+        CACHE_EVENTS.labels(cache, event).inc(amount)
+
+
+def count_cache_bytes(cache: str, source: str, size: int) -> None:
+    if enabled and size:
+        CACHE_BYTES.labels(cache, source).inc(size)
+
+
+def observe_loop_lag(seconds: float) -> None:
+    if enabled:
+        EVENT_LOOP_LAG.observe(seconds)
+
+
+def count_loop_stall() -> None:
+    if enabled:
+        EVENT_LOOP_STALLS.inc()
+
+
+def count_compressed_response(encoding: str, original: int, compressed: int) -> None:
+    if enabled:
+        COMPRESSION_BYTES.labels(encoding, "original").inc(original)
+        COMPRESSION_BYTES.labels(encoding, "compressed").inc(compressed)
+
+
+@contextmanager
+def track_password_hashing(operation: str) -> Iterator[None]:
+    """Time a bcrypt call and count it as in progress meanwhile"""
+    if not enabled:
+        yield
+        return
+    PASSWORD_HASH_IN_PROGRESS.inc()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        PASSWORD_HASH_DURATION.labels(operation).observe(time.perf_counter() - started)
+        PASSWORD_HASH_IN_PROGRESS.dec()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording HTTP latency and in-flight requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_holder = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+            await send(message)
+
+        in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_progress.dec()
+            HTTP_REQUEST_DURATION.labels(route_template(scope), method, str(status_holder["status"])).observe(
+                time.perf_counter() - started
+            )
+
+
+def render_latest() -> Tuple[Optional[bytes], str]:
+    """
+    Current metrics in the Prometheus text format
+
+    Returns:
+        Tuple of (payload, content type); payload is None when metrics are disabled
+    """
+    if not enabled:
+        return None, "text/plain"
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def mark_process_dead() -> None:
+    """Remove this worker's live gauges from the multiprocess directory"""
+    if enabled and os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,173 @@
+# Access-control index: which patients each professional can see
+#
+# Sharing is recorded in two places - patients.shared_with (PATCH
+# /patients/{id}/share) and the patient_shares collection (document
+# sharing endpoints). Both write through to patient_access, one document per
+# (professional_id, patient_id) under a unique index. Each grant keeps the
+# sources that justify it in a sub-document (source key -> permissions), so
+# revoking one share only removes access once no other source remains.
+#
+# Membership checks are covered queries on the unique index; listing a
+# professional's patients walks the (professional_id, granted_at) index.
+
+from datetime import datetime
+from typing import Dict, List, Optional
+import logging
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from .database import get_collection
+
+logger = logging.getLogger(__name__)
+
+ACCESS_COLLECTION = "patient_access"
+
+PATIENT_RECORD_SOURCE = "patient_record"
+
+# Grants upserted per bulk_write round trip by rebuild_access_index
+REBUILD_BATCH_SIZE = 1000
+
+
+def share_source(shared_by) -> str:
+    """Source key of a patient_shares record created by the given professional"""
+    return f"share_{shared_by}"
+
+
+async def grant_access(
+    professional_id,
+    patient_id,
+    clinic_id: Optional[str],
+    source: str,
+    permissions: str = "read"
+) -> None:
+    """
+    Record that a professional can see a patient
+
+    Args:
+        professional_id: Professional receiving access (ObjectId or str)
+        patient_id: Patient identifier (ObjectId or str)
+        clinic_id: Clinic of the patient
+        source: Source key (PATIENT_RECORD_SOURCE or share_source(...))
+        permissions: "read" or "write"
+    """
+    access_collection = await get_collection(ACCESS_COLLECTION)
+    now = datetime.utcnow()
+    await access_collection.update_one(
+        {"professional_id": str(professional_id), "patient_id": str(patient_id)},
+        {
+            "$set": {f"sources.{source}": permissions, "clinic_id": clinic_id, "updated_at": now},
+            "$setOnInsert": {"granted_at": now}
+        },
+        upsert=True
+    )
+
+
+async def revoke_access(professional_id, patient_id, source: str) -> bool:
+    """
+    Remove one source of access; the grant is deleted when none is left
+
+    Returns:
+        True if the professional no longer has access to the patient
+    """
+    access_collection = await get_collection(ACCESS_COLLECTION)
+    key = {"professional_id": str(professional_id), "patient_id": str(patient_id)}
+    await access_collection.update_one(
+        key,
+        {"$unset": {f"sources.{source}": ""}, "$set": {"updated_at": datetime.utcnow()}}
+    )
+    # Conditional on the sources being empty so a concurrent grant survives
+    result = await access_collection.delete_one({**key, "sources": {}})
+    return bool(result.deleted_count)
+
+
+async def has_access(professional_id, patient_id) -> bool:
+    """Membership check answered from the unique index alone"""
+    access_collection = await get_collection(ACCESS_COLLECTION)
+    grant = await access_collection.find_one(
+        {"professional_id": str(professional_id), "patient_id": str(patient_id)},
+        {"_id": 0, "professional_id": 1, "patient_id": 1}
+    )
+    return grant is not None
+
+
+async def list_visible_patient_ids(professional_id, skip: int = 0, limit: int = 50) -> List[str]:
+    """Patient ids visible to a professional, most recently granted first"""
+    access_collection = await get_collection(ACCESS_COLLECTION)
+    cursor = access_collection.find(
+        {"professional_id": str(professional_id)},
+        {"_id": 0, "patient_id": 1}
+    ).sort("granted_at", -1).skip(skip).limit(limit)
+    return [grant["patient_id"] async for grant in cursor]
+
+
+async def rebuild_access_index() -> Dict[str, int]:
+    """
+    Rebuild patient_access from patients.shared_with and patient_shares
+
+    Used to backfill the index for data shared before it existed, and to
+    repair drift. Each grant's sources are replaced with the ones found,
+    and grants without any remaining source are removed.
+
+    Returns:
+        Counts of grants written and stale grants removed
+    """
+    patients_collection = await get_collection("patients")
+    shares_collection = await get_collection("patient_shares")
+    access_collection = await get_collection(ACCESS_COLLECTION)
+    started_at = datetime.utcnow()
+
+    # (professional_id, patient_id) -> {"clinic_id", "sources"}
+    expected: Dict[tuple, Dict] = {}
+
+    async for patient in patients_collection.find(
+        {"shared_with.0": {"$exists": True}},
+        {"clinic_id": 1, "shared_with.professional_id": 1}
+    ):
+        for record in patient.get("shared_with", []):
+            if record.get("professional_id"):
+                grant = expected.setdefault(
+                    (str(record["professional_id"]), str(patient["_id"])),
+                    {"clinic_id": patient.get("clinic_id"), "sources": {}}
+                )
+                grant["sources"][PATIENT_RECORD_SOURCE] = "read"
+
+    async for share in shares_collection.find({}, {"patient_id": 1, "shared_by": 1, "shared_with": 1, "permissions": 1}):
+        grant = expected.setdefault(
+            (str(share["shared_with"]), str(share["patient_id"])),
+            {"clinic_id": None, "sources": {}}
+        )
+        grant["sources"][share_source(share["shared_by"])] = share.get("permissions", "read")
+
+    # Clinic of patients only reachable through patient_shares, in one query
+    missing_clinic = {ObjectId(patient_id) for (_, patient_id), grant in expected.items()
+                      if grant["clinic_id"] is None and ObjectId.is_valid(patient_id)}
+    clinics = {
+        str(patient["_id"]): patient.get("clinic_id")
+        async for patient in patients_collection.find({"_id": {"$in": list(missing_clinic)}}, {"clinic_id": 1})
+    } if missing_clinic else {}
+
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {"professional_id": professional_id, "patient_id": patient_id},
+            {
+                "$set": {
+                    "sources": grant["sources"],
+                    "clinic_id": grant["clinic_id"] or clinics.get(patient_id),
+                    "updated_at": now
+                },
+                "$setOnInsert": {"granted_at": now}
+            },
+            upsert=True
+        )
+        for (professional_id, patient_id), grant in expected.items()
+    ]
+    for start in range(0, len(operations), REBUILD_BATCH_SIZE):
+        await access_collection.bulk_write(operations[start:start + REBUILD_BATCH_SIZE], ordered=False)
+
+    # Grants not refreshed by this run have no source left
+    result = await access_collection.delete_many({"updated_at": {"$lt": started_at}})
+
+    logger.info(f"🔐 Rebuilt patient access index: {len(expected)} grants, {result.deleted_count} stale grants removed")
+    return {"grants": len(expected), "removed": result.deleted_count}
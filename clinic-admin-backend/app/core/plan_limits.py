@@ -0,0 +1,248 @@
+# Plan limits for professionals and patients
+#
+# Each clinic document carries usage counters (professionals_count,
+# patients_count) that are the single source of truth for admission:
+# a seat is taken with one conditional $inc that only matches while the
+# counter is below the plan limit stored on the same document, so
+# concurrent creations cannot overshoot max_professionals / max_patients.
+# Seats are given back when a professional is deactivated or a patient
+# archived. A clinic without a counter yet (created before counters
+# existed) has it seeded from a count of its records on first admission.
+# A periodic job recounts the real documents to correct drift (crashes
+# between admission and insert, data written by scripts); a lease in
+# job_leases makes one worker process run it per interval.
+#
+# Professionals occupy a seat unless inactive; patients unless archived.
+# The professional limit is max_professionals, which plan changes maintain,
+# falling back to max_professionals_allowed (set once at clinic creation).
+# Before counters, the admin dashboard read max_professionals_allowed first
+# and would keep a clinic at its creation-time limit after an upgrade.
+
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+import asyncio
+import logging
+import os
+import socket
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from .config import settings
+from .database import get_collection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PROFESSIONALS = 5
+DEFAULT_MAX_PATIENTS = 100
+
+# kind -> (counter field, limit expression, collection, filter of seat-holding documents)
+_LIMITS = {
+    "professionals": (
+        "professionals_count",
+        {"$ifNull": ["$max_professionals", {"$ifNull": ["$max_professionals_allowed", DEFAULT_MAX_PROFESSIONALS]}]},
+        "professionals",
+        {"status_professional": {"$ne": "inactive"}}
+    ),
+    "patients": (
+        "patients_count",
+        {"$ifNull": ["$max_patients", DEFAULT_MAX_PATIENTS]},
+        "patients",
+        {"status_patient": {"$ne": "archived"}}
+    )
+}
+
+LEASES_COLLECTION = "job_leases"
+RECONCILE_LEASE_ID = "plan_usage_reconcile"
+
+_reconcile_task: Optional[asyncio.Task] = None
+_lease_holder = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _clinic_filter(clinic_id: str) -> Dict:
+    """Match a clinic by its clinic_id or by its _id string"""
+    if ObjectId.is_valid(clinic_id):
+        return {"$or": [{"_id": ObjectId(clinic_id)}, {"clinic_id": clinic_id}]}
+    return {"clinic_id": clinic_id}
+
+
+async def admit(clinic_id: str, kind: str) -> Tuple[bool, Optional[int]]:
+    """
+    Take a seat for a new professional or patient if the plan allows it
+
+    Args:
+        clinic_id: Clinic identifier (clinic_id or _id string)
+        kind: "professionals" or "patients"
+
+    Returns:
+        Tuple of (accepted, limit). limit is None if the clinic does not exist.
+    """
+    counter, limit_expr, _, _ = _LIMITS[kind]
+    clinics_collection = await get_collection("clinics")
+
+    async def take_seat() -> Optional[Dict]:
+        return await clinics_collection.find_one_and_update(
+            {
+                **_clinic_filter(clinic_id),
+                counter: {"$exists": True},
+                "$expr": {"$lt": [f"${counter}", limit_expr]}
+            },
+            {"$inc": {counter: 1}, "$set": {"updated_at": datetime.utcnow()}},
+            projection={counter: 1},
+            return_document=ReturnDocument.AFTER
+        )
+
+    clinic = await take_seat()
+    if not clinic and await _seed_counter(clinic_id, kind):
+        clinic = await take_seat()
+    if clinic:
+        return True, None
+
+    # Rejected - report the limit that was hit
+    clinic = await clinics_collection.find_one(
+        _clinic_filter(clinic_id),
+        {"max_professionals": 1, "max_professionals_allowed": 1, "max_patients": 1}
+    )
+    if not clinic:
+        return False, None
+    if kind == "professionals":
+        limit = clinic.get("max_professionals") or clinic.get("max_professionals_allowed") or DEFAULT_MAX_PROFESSIONALS
+    else:
+        limit = clinic.get("max_patients") or DEFAULT_MAX_PATIENTS
+    return False, limit
+
+
+async def _seed_counter(clinic_id: str, kind: str) -> bool:
+    """
+    Initialize a missing seat counter from a count of the clinic's records
+
+    Args:
+        clinic_id: Clinic identifier (clinic_id or _id string)
+        kind: "professionals" or "patients"
+
+    Returns:
+        True if the clinic had no counter (now seeded, here or concurrently)
+    """
+    counter, _, collection_name, seat_filter = _LIMITS[kind]
+    clinics_collection = await get_collection("clinics")
+    clinic = await clinics_collection.find_one(
+        {**_clinic_filter(clinic_id), counter: {"$exists": False}},
+        {"clinic_id": 1}
+    )
+    if not clinic:
+        return False
+
+    clinic_keys = [key for key in (clinic.get("clinic_id"), str(clinic["_id"])) if key]
+    collection = await get_collection(collection_name)
+    count = await collection.count_documents({"clinic_id": {"$in": clinic_keys}, **seat_filter})
+
+    # Only sets a counter that is still missing; a concurrent seed wins
+    await clinics_collection.update_one(
+        {"_id": clinic["_id"], counter: {"$exists": False}},
+        {"$set": {counter: count}}
+    )
+    return True
+
+
+async def release(clinic_id: str, kind: str) -> None:
+    """Give a seat back (failed creation, deactivation, archive)"""
+    counter = _LIMITS[kind][0]
+    clinics_collection = await get_collection("clinics")
+    await clinics_collection.update_one(
+        {**_clinic_filter(clinic_id), counter: {"$gt": 0}},
+        {"$inc": {counter: -1}, "$set": {"updated_at": datetime.utcnow()}}
+    )
+
+
+async def reconcile_clinic_usage(clinic: Dict) -> Dict[str, int]:
+    """
+    Recount a clinic's seat-holding professionals and patients
+
+    The write is conditional on the counters read with the clinic, so an
+    admission that lands while counting is not overwritten - the clinic is
+    simply picked up again by the next run.
+
+    Args:
+        clinic: Clinic document (needs _id, clinic_id and the counters)
+
+    Returns:
+        Recounted values
+    """
+    # Records reference the clinic by clinic_id, or by _id string in older data
+    clinic_keys = [key for key in (clinic.get("clinic_id"), str(clinic["_id"])) if key]
+    observed = {}
+    counters = {}
+    for counter, _, collection_name, seat_filter in _LIMITS.values():
+        observed[counter] = clinic.get(counter)
+        collection = await get_collection(collection_name)
+        counters[counter] = await collection.count_documents({"clinic_id": {"$in": clinic_keys}, **seat_filter})
+
+    clinics_collection = await get_collection("clinics")
+    await clinics_collection.update_one(
+        {"_id": clinic["_id"], **observed},
+        {"$set": {**counters, "usage_reconciled_at": datetime.utcnow()}}
+    )
+    return counters
+
+
+async def reconcile_all_clinics() -> int:
+    """Reconcile every clinic's counters, returning how many were corrected"""
+    clinics_collection = await get_collection("clinics")
+    corrected = 0
+    async for clinic in clinics_collection.find({}, {"clinic_id": 1, "professionals_count": 1, "patients_count": 1}):
+        try:
+            counters = await reconcile_clinic_usage(clinic)
+        except Exception as e:
+            logger.error(f"❌ Plan usage reconciliation failed for clinic {clinic.get('clinic_id')}: {str(e)}")
+            continue
+        if any(clinic.get(field) != value for field, value in counters.items()):
+            corrected += 1
+            logger.warning(f"⚠️ Corrected plan usage counters for clinic {clinic.get('clinic_id')}: {counters}")
+    return corrected
+
+
+async def _acquire_reconcile_lease(interval: timedelta) -> bool:
+    """Hold the reconciliation lease for one interval; False while another worker holds it"""
+    leases_collection = await get_collection(LEASES_COLLECTION)
+    now = datetime.utcnow()
+    try:
+        await leases_collection.update_one(
+            {"_id": RECONCILE_LEASE_ID, "$or": [{"expires_at": {"$lte": now}}, {"holder": _lease_holder}]},
+            {"$set": {"holder": _lease_holder, "expires_at": now + interval, "acquired_at": now}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The lease exists, is unexpired and belongs to another worker
+        return False
+    return True
+
+
+async def _reconcile_periodically() -> None:
+    interval = settings.plan_usage_reconcile_interval_minutes * 60
+    while True:
+        try:
+            if await _acquire_reconcile_lease(timedelta(seconds=interval)):
+                corrected = await reconcile_all_clinics()
+                logger.info(f"📊 Plan usage reconciled ({corrected} clinics corrected)")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Plan usage reconciliation failed: {str(e)}")
+        await asyncio.sleep(interval)
+
+
+def start_reconciliation() -> None:
+    """Run the reconciliation job now and then every configured interval (one worker per interval)"""
+    global _reconcile_task
+    if settings.plan_usage_reconcile_interval_minutes <= 0 or _reconcile_task:
+        return
+    _reconcile_task = asyncio.create_task(_reconcile_periodically())
+
+
+async def stop_reconciliation() -> None:
+    global _reconcile_task
+    if _reconcile_task:
+        _reconcile_task.cancel()
+        await asyncio.gather(_reconcile_task, return_exceptions=True)
+        _reconcile_task = None
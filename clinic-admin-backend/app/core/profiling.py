@@ -0,0 +1,254 @@
+# On-demand request profiling
+#
+# A request is profiled when a super admin sends the X-Profile header, or
+# when it falls in the random sample (PROFILING_SAMPLE_RATE). While at least
+# one profiled request is in flight, a sampler thread wakes every
+# PROFILING_INTERVAL_MS and records where each profiled request is:
+#   - running on the event loop: the loop thread's Python stack, from the
+#     request's outermost coroutine down to the executing function
+#   - suspended: its chain of awaiting coroutines, ending in an
+#     "[awaiting ...]" frame (I/O, executor threads, locks)
+# so the result is a wall-clock profile of that request only, even with
+# other requests interleaved on the same loop.
+#
+# Finished profiles keep the sampled stacks plus the request's MongoDB
+# breakdown and are held in memory (last PROFILING_MAX_PROFILES). Stacks are
+# served in collapsed format ("frame;frame;frame count"), which flamegraph.pl,
+# speedscope and inferno read directly.
+#
+# With PROFILING_ENABLED=False the middleware is not installed at all.
+
+from collections import Counter, deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+import asyncio
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+from fastapi import HTTPException
+
+from ..auth.security import verify_token
+from .config import settings
+from .db_instrumentation import current_request_stats
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+
+# Stack depth kept per sample
+MAX_STACK_DEPTH = 128
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    marker = f"{os.sep}site-packages{os.sep}"
+    if marker in filename:
+        filename = filename.split(marker, 1)[1]
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def _coroutine_stack(coro) -> List[str]:
+    """Await chain of a suspended coroutine, outermost first"""
+    stack = []
+    while coro is not None and len(stack) < MAX_STACK_DEPTH:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        stack.append(_frame_label(frame.f_code))
+        awaited = getattr(coro, "cr_await", None)
+        if awaited is None:
+            awaited = getattr(coro, "gi_yieldfrom", None)
+        if awaited is None or not (hasattr(awaited, "cr_frame") or hasattr(awaited, "gi_frame") or hasattr(awaited, "ag_frame")):
+            # FutureIter is the awaitable behind every asyncio Future
+            awaited_name = type(awaited).__name__.replace("FutureIter", "Future") if awaited is not None else "event loop"
+            stack.append(f"[awaiting {awaited_name}]")
+            break
+        coro = awaited
+    return stack
+
+
+def _running_stack(frame, root_frame) -> List[str]:
+    """Thread stack from the request's root coroutine frame down, outermost first"""
+    frames = []
+    while frame is not None and len(frames) < MAX_STACK_DEPTH:
+        frames.append(frame)
+        if frame is root_frame:
+            break
+        frame = frame.f_back
+    frames.reverse()
+    return [_frame_label(f.f_code) for f in frames]
+
+
+class _ActiveProfile:
+    __slots__ = ("profile_id", "task", "loop", "thread_id", "stacks", "samples", "started", "started_at")
+
+    def __init__(self, task: asyncio.Task, loop: asyncio.AbstractEventLoop):
+        self.profile_id = uuid.uuid4().hex[:12]
+        self.task = task
+        self.loop = loop
+        self.thread_id = threading.get_ident()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started = time.perf_counter()
+        self.started_at = datetime.utcnow()
+
+    def sample(self, frames: Dict[int, object]) -> None:
+        coro = self.task.get_coro()
+        current_tasks = getattr(asyncio.tasks, "_current_tasks", {})
+        if current_tasks.get(self.loop) is self.task:
+            stack = _running_stack(frames.get(self.thread_id), getattr(coro, "cr_frame", None))
+        else:
+            stack = _coroutine_stack(coro)
+        if stack:
+            self.stacks[";".join(stack)] += 1
+            self.samples += 1
+
+
+class RequestProfiler:
+    """Sampler thread plus the ring of finished profiles"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active: Dict[str, _ActiveProfile] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._profiles: Deque[Dict] = deque(maxlen=max(1, settings.profiling_max_profiles))
+
+    def start(self) -> Optional[_ActiveProfile]:
+        task = asyncio.current_task()
+        if task is None:
+            return None
+        profile = _ActiveProfile(task, asyncio.get_running_loop())
+        with self._lock:
+            self._active[profile.profile_id] = profile
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+        return profile
+
+    def _run(self) -> None:
+        interval = max(settings.profiling_interval_ms, 1) / 1000
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                frames = sys._current_frames()
+                for profile in self._active.values():
+                    try:
+                        profile.sample(frames)
+                    except Exception:
+                        # Frames change underneath the sampler; drop the sample
+                        pass
+                del frames
+            time.sleep(interval)
+
+    def finish(self, profile: _ActiveProfile, scope, status_code: int) -> None:
+        with self._lock:
+            self._active.pop(profile.profile_id, None)
+        stats = current_request_stats()
+        db = None
+        if stats is not None:
+            db = {
+                "queries": stats.queries,
+                "db_time_ms": round(stats.duration_ms, 2),
+                "documents": stats.documents,
+                "commands": stats.top_commands(limit=len(stats.commands))
+            }
+        self._profiles.append({
+            "id": profile.profile_id,
+            "method": scope["method"],
+            "route": metrics.route_template(scope),
+            "path": scope["path"],
+            "status": status_code,
+            "started_at": profile.started_at.isoformat(),
+            "duration_ms": round((time.perf_counter() - profile.started) * 1000, 2),
+            "samples": profile.samples,
+            "interval_ms": settings.profiling_interval_ms,
+            "db": db,
+            "stacks": dict(profile.stacks)
+        })
+
+    def list_profiles(self) -> List[Dict]:
+        """Summaries of the stored profiles, newest first"""
+        return [
+            {key: value for key, value in profile.items() if key != "stacks"}
+            for profile in reversed(self._profiles)
+        ]
+
+    def get_profile(self, profile_id: str) -> Optional[Dict]:
+        for profile in self._profiles:
+            if profile["id"] == profile_id:
+                return profile
+        return None
+
+    @staticmethod
+    def collapsed_stacks(profile: Dict) -> str:
+        """Profile in collapsed-stack (flamegraph) format"""
+        lines = [f"{stack} {count}" for stack, count in sorted(profile["stacks"].items(), key=lambda item: -item[1])]
+        return "\n".join(lines) + "\n"
+
+
+request_profiler = RequestProfiler()
+
+
+def _is_super_admin(scope) -> bool:
+    """X-Profile is only honored with a super admin bearer token"""
+    authorization = dict(scope["headers"]).get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        payload = verify_token(token)
+    except HTTPException:
+        return False
+    return payload.get("type") == "admin" and payload.get("role") == "super_admin"
+
+
+class ProfilingMiddleware:
+    """ASGI middleware deciding which requests are profiled"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def _should_profile(self, scope) -> bool:
+        if settings.profiling_sample_rate > 0 and random.random() < settings.profiling_sample_rate:
+            return True
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return value not in (b"", b"0") and _is_super_admin(scope)
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = request_profiler.start()
+        if profile is None:
+            await self.app(scope, receive, send)
+            return
+
+        status_holder = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+                message = {
+                    **message,
+                    "headers": [*message.get("headers", []), (PROFILE_ID_HEADER, profile.profile_id.encode())]
+                }
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_profiler.finish(profile, scope, status_holder["status"])
@@ -0,0 +1,185 @@
+# Static serving for the unified admin SPA
+#
+# SpaAssets indexes the build directory once at startup (size, validators,
+# content type and precompressed siblings of every file) so a request is a
+# dict lookup - no filesystem checks on the hot path. index.html is held in
+# memory and answers every client-side route (SPA fallback).
+#
+# Caching:
+#   - files under assets/ carry a content hash in their name (Vite output)
+#     and are served "immutable" for a year
+#   - index.html and other top-level files are revalidated on each use
+#     (no-cache) and answered with 304 when the ETag / Last-Modified matches
+#
+# When the build ships ``file.br`` / ``file.gz`` next to ``file``, the
+# variant the client accepts is sent as-is with Content-Encoding set, so
+# CompressionMiddleware leaves it alone.
+
+from dataclasses import dataclass, field
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Mapping, Optional
+import logging
+import mimetypes
+import os
+
+from starlette.responses import FileResponse, Response
+
+from .compression import parse_accept_encoding
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.html"
+HASHED_PREFIX = "assets/"
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Precompressed sibling suffix -> content coding, in preference order
+PRECOMPRESSED = {".br": "br", ".gz": "gzip"}
+
+
+@dataclass
+class _Variant:
+    path: str
+    size: int
+    etag: str
+    stat_result: os.stat_result
+
+
+@dataclass
+class _Asset:
+    media_type: str
+    cache_control: str
+    last_modified: str
+    mtime: int
+    # content coding ("identity", "br", "gzip") -> file
+    variants: Dict[str, _Variant] = field(default_factory=dict)
+
+
+def _etag(stat_result: os.stat_result, coding: str) -> str:
+    suffix = "" if coding == "identity" else f"-{coding}"
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}{suffix}"'
+
+
+class SpaAssets:
+    """In-memory index of a built single-page app"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._assets: Dict[str, _Asset] = {}
+        self._index_body: Optional[bytes] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._index_body is not None
+
+    def load(self) -> None:
+        """Index the build directory (call again after a redeploy of the files)"""
+        assets: Dict[str, _Asset] = {}
+        siblings = []
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                relative = os.path.relpath(path, self.root).replace(os.sep, "/")
+                base, extension = os.path.splitext(relative)
+                if extension in PRECOMPRESSED:
+                    siblings.append((base, PRECOMPRESSED[extension], path))
+                    continue
+                stat_result = os.stat(path)
+                assets[relative] = _Asset(
+                    media_type=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+                    cache_control=IMMUTABLE_CACHE_CONTROL if relative.startswith(HASHED_PREFIX) else REVALIDATE_CACHE_CONTROL,
+                    last_modified=formatdate(stat_result.st_mtime, usegmt=True),
+                    mtime=int(stat_result.st_mtime),
+                    variants={"identity": _Variant(path, stat_result.st_size, _etag(stat_result, "identity"), stat_result)}
+                )
+
+        for base, coding, path in siblings:
+            if base in assets:
+                stat_result = os.stat(path)
+                assets[base].variants[coding] = _Variant(path, stat_result.st_size, _etag(stat_result, coding), stat_result)
+
+        if INDEX_FILE not in assets:
+            raise FileNotFoundError(f"{self.root}/{INDEX_FILE} not found")
+        with open(assets[INDEX_FILE].variants["identity"].path, "rb") as index_file:
+            self._index_body = index_file.read()
+        self._assets = assets
+
+        precompressed = sum(1 for asset in assets.values() if len(asset.variants) > 1)
+        logger.info(f"📦 Indexed {len(assets)} admin frontend files from {self.root} ({precompressed} precompressed)")
+
+    def _choose_variant(self, asset: _Asset, accept_encoding: str) -> str:
+        if len(asset.variants) == 1 or not accept_encoding:
+            return "identity"
+        weights = parse_accept_encoding(accept_encoding)
+        for coding in PRECOMPRESSED.values():
+            if coding in asset.variants and weights.get(coding, weights.get("*", 0.0)) > 0:
+                return coding
+        return "identity"
+
+    @staticmethod
+    def _not_modified(request_headers: Mapping[str, str], etag: str, mtime: int) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            if if_none_match.strip() == "*":
+                return True
+            # Weak comparison, as If-None-Match requires
+            candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+            return etag in candidates
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def respond(self, path: str, request_headers: Mapping[str, str], method: str = "GET") -> Optional[Response]:
+        """
+        Response for a path inside the build
+
+        Args:
+            path: Path relative to the build root ("" for the app itself)
+            request_headers: Incoming request headers
+            method: Request method (HEAD gets headers only)
+
+        Returns:
+            The file, index.html for client-side routes, or None when a
+            hashed asset does not exist (a stale bundle reference must 404,
+            not receive HTML)
+        """
+        path = path.lstrip("/")
+        asset = self._assets.get(path)
+        if asset is None:
+            if path.startswith(HASHED_PREFIX):
+                return None
+            path = INDEX_FILE
+            asset = self._assets[INDEX_FILE]
+
+        coding = self._choose_variant(asset, request_headers.get("accept-encoding", ""))
+        variant = asset.variants[coding]
+        headers = {
+            "Cache-Control": asset.cache_control,
+            "ETag": variant.etag,
+            "Last-Modified": asset.last_modified
+        }
+        if len(asset.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+
+        if self._not_modified(request_headers, variant.etag, asset.mtime):
+            return Response(status_code=304, headers=headers)
+
+        if path == INDEX_FILE and coding == "identity":
+            body = b"" if method == "HEAD" else self._index_body
+            headers["Content-Length"] = str(len(self._index_body))
+            return Response(body, headers=headers, media_type=asset.media_type)
+
+        return FileResponse(
+            variant.path,
+            headers=headers,
+            media_type=asset.media_type,
+            stat_result=variant.stat_result,
+            method=method
+        )
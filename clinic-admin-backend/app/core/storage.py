@@ -1,7 +1,9 @@
 # MinIO Storage Client for Medical Records System
 import os
 import uuid
-from typing import BinaryIO, Optional, List, Dict
+import asyncio
+from urllib.parse import quote
+from typing import AsyncIterator, BinaryIO, Optional, List, Dict
 from datetime import datetime, timedelta
 from minio import Minio
 from minio.error import S3Error, InvalidResponseError
@@ -9,6 +11,8 @@ from minio.commonconfig import REPLACE, CopySource
 import io
 import logging
 
+from .config import settings
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -24,33 +28,30 @@ class MinIOStorageClient:
     """
     
     def __init__(self):
-        """Initialize MinIO client with production credentials"""
+        """Initialize MinIO client from settings (no network I/O)"""
         try:
             self.client = Minio(
-                "pampaservers.com:60522",
-                access_key="pampa",
-                secret_key="servermuA!",
-                secure=False  # Using HTTP for internal network
+                settings.minio_endpoint,
+                access_key=settings.minio_access_key,
+                secret_key=settings.minio_secret_key,
+                secure=settings.minio_secure
             )
             
-            # Test connection
-            if self._test_connection():
-                logger.info("✅ MinIO connection established successfully")
-            else:
-                logger.error("❌ MinIO connection test failed")
-                
+            # Buckets already verified/created by this process
+            self._known_buckets = set()
+            
         except Exception as e:
             logger.error(f"❌ Failed to initialize MinIO client: {str(e)}")
             raise
     
-    def _test_connection(self) -> bool:
-        """Test MinIO connection by listing buckets"""
-        try:
-            self.client.list_buckets()
-            return True
-        except Exception as e:
-            logger.error(f"MinIO connection test failed: {str(e)}")
-            return False
+    def check_connection(self) -> None:
+        """
+        Test MinIO connection by listing buckets (blocking)
+        
+        Raises:
+            Exception: If MinIO cannot be reached or rejects the credentials
+        """
+        self.client.list_buckets()
     
     def _get_bucket_name(self, clinic_id: str) -> str:
         """Generate bucket name for clinic with safe naming"""
@@ -59,11 +60,14 @@ class MinIOStorageClient:
         return f"clinic-{safe_clinic_id}"
     
     def _ensure_bucket_exists(self, bucket_name: str) -> bool:
-        """Create bucket if it doesn't exist"""
+        """Create bucket if it doesn't exist (checked once per process)"""
+        if bucket_name in self._known_buckets:
+            return True
         try:
             if not self.client.bucket_exists(bucket_name):
                 self.client.make_bucket(bucket_name)
                 logger.info(f"✅ Created bucket: {bucket_name}")
+            self._known_buckets.add(bucket_name)
             return True
         except S3Error as e:
             logger.error(f"❌ Failed to create bucket {bucket_name}: {str(e)}")
@@ -88,19 +92,25 @@ class MinIOStorageClient:
         filename: str, 
         file_size: int,
         content_type: str = "application/octet-stream",
-        metadata: Optional[Dict[str, str]] = None
+        metadata: Optional[Dict[str, str]] = None,
+        document_id: Optional[str] = None
     ) -> Dict[str, str]:
         """
         Upload medical document to MinIO
         
+        The blocking SDK call runs in a worker thread, and file_data is
+        streamed by the SDK in parts rather than read up front.
+        
         Args:
             clinic_id: Clinic identifier
             patient_id: Patient identifier
-            file_data: File binary data
+            file_data: File binary data (any readable binary stream)
             filename: Original filename
             file_size: File size in bytes
             content_type: MIME type
             metadata: Additional metadata
+            document_id: Stable document identifier; re-uploading with the
+                same id overwrites the same object (idempotent retries)
             
         Returns:
             Dict with upload information
@@ -109,11 +119,11 @@ class MinIOStorageClient:
             bucket_name = self._get_bucket_name(clinic_id)
             
             # Ensure bucket exists
-            if not self._ensure_bucket_exists(bucket_name):
+            if not await asyncio.to_thread(self._ensure_bucket_exists, bucket_name):
                 raise Exception(f"Could not create/access bucket: {bucket_name}")
             
             # Generate unique object name
-            document_id = str(uuid.uuid4())
+            document_id = document_id or str(uuid.uuid4())
             object_name = self._generate_object_name(patient_id, filename, document_id)
             
             # Prepare metadata
@@ -129,7 +139,8 @@ class MinIOStorageClient:
                 upload_metadata.update(metadata)
             
             # Upload file
-            result = self.client.put_object(
+            result = await asyncio.to_thread(
+                self.client.put_object,
                 bucket_name=bucket_name,
                 object_name=object_name,
                 data=file_data,
@@ -153,11 +164,65 @@ class MinIOStorageClient:
             logger.error(f"❌ Failed to upload document: {str(e)}")
             raise
     
+    async def upload_blob(
+        self,
+        clinic_id: str,
+        object_name: str,
+        file_data: BinaryIO,
+        file_size: int,
+        content_type: str = "application/octet-stream",
+        metadata: Optional[Dict[str, str]] = None
+    ) -> Dict[str, str]:
+        """
+        Upload content-addressed blob under a caller-provided object name
+        
+        Args:
+            clinic_id: Clinic identifier
+            object_name: Object path in MinIO (derived from the content hash)
+            file_data: File binary data (any readable binary stream)
+            file_size: File size in bytes
+            content_type: MIME type
+            metadata: Additional metadata
+            
+        Returns:
+            Dict with upload information
+        """
+        try:
+            bucket_name = self._get_bucket_name(clinic_id)
+            
+            if not await asyncio.to_thread(self._ensure_bucket_exists, bucket_name):
+                raise Exception(f"Could not create/access bucket: {bucket_name}")
+            
+            result = await asyncio.to_thread(
+                self.client.put_object,
+                bucket_name=bucket_name,
+                object_name=object_name,
+                data=file_data,
+                length=file_size,
+                content_type=content_type,
+                metadata=metadata or {}
+            )
+            
+            logger.info(f"✅ Uploaded blob: {bucket_name}/{object_name}")
+            
+            return {
+                "bucket_name": bucket_name,
+                "object_name": object_name,
+                "file_size": file_size,
+                "etag": result.etag,
+                "upload_date": datetime.utcnow().isoformat()
+            }
+            
+        except Exception as e:
+            logger.error(f"❌ Failed to upload blob: {str(e)}")
+            raise
+    
     async def get_presigned_download_url(
         self, 
         clinic_id: str, 
         object_name: str, 
-        expires: timedelta = timedelta(hours=1)
+        expires: timedelta = timedelta(hours=1),
+        filename: Optional[str] = None
     ) -> str:
         """
         Generate secure download URL for medical document
@@ -166,6 +231,7 @@ class MinIOStorageClient:
             clinic_id: Clinic identifier
             object_name: Object path in MinIO
             expires: URL expiration time
+            filename: Download filename (blob object names carry no filename)
             
         Returns:
             Presigned URL for download
@@ -173,10 +239,18 @@ class MinIOStorageClient:
         try:
             bucket_name = self._get_bucket_name(clinic_id)
             
-            url = self.client.presigned_get_object(
+            response_headers = None
+            if filename:
+                response_headers = {
+                    "response-content-disposition": f"attachment; filename*=UTF-8''{quote(filename)}"
+                }
+            
+            url = await asyncio.to_thread(
+                self.client.presigned_get_object,
                 bucket_name=bucket_name,
                 object_name=object_name,
-                expires=expires
+                expires=expires,
+                response_headers=response_headers
             )
             
             logger.info(f"Generated download URL for: {bucket_name}/{object_name}")
@@ -186,6 +260,70 @@ class MinIOStorageClient:
             logger.error(f"❌ Failed to generate download URL: {str(e)}")
             raise
     
+    async def download_object(self, clinic_id: str, object_name: str) -> bytes:
+        """
+        Read a whole object into memory (documents are capped at 10MB)
+        
+        Args:
+            clinic_id: Clinic identifier
+            object_name: Object path in MinIO
+            
+        Returns:
+            Object content
+        """
+        bucket_name = self._get_bucket_name(clinic_id)
+        
+        def _read() -> bytes:
+            response = self.client.get_object(bucket_name, object_name)
+            try:
+                return response.read()
+            finally:
+                response.close()
+                response.release_conn()
+        
+        return await asyncio.to_thread(_read)
+    
+    async def get_object_etag(self, clinic_id: str, object_name: str) -> str:
+        """Current ETag of an object (HEAD request, no content transfer)"""
+        bucket_name = self._get_bucket_name(clinic_id)
+        stat = await asyncio.to_thread(self.client.stat_object, bucket_name, object_name)
+        return stat.etag
+    
+    async def iter_object(
+        self,
+        clinic_id: str,
+        object_name: str,
+        chunk_size: int = 256 * 1024,
+        offset: int = 0,
+        length: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Stream an object (or a byte range of it) in chunks without buffering it whole
+        
+        Args:
+            clinic_id: Clinic identifier
+            object_name: Object path in MinIO
+            chunk_size: Bytes per chunk
+            offset: First byte to read
+            length: Number of bytes to read (None = to the end)
+            
+        Yields:
+            Object content chunks
+        """
+        bucket_name = self._get_bucket_name(clinic_id)
+        response = await asyncio.to_thread(
+            self.client.get_object, bucket_name, object_name, offset, length or 0
+        )
+        try:
+            while True:
+                chunk = await asyncio.to_thread(response.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            response.close()
+            response.release_conn()
+    
     async def delete_medical_document(self, clinic_id: str, object_name: str) -> bool:
         """
         Delete medical document from MinIO
@@ -200,62 +338,110 @@ class MinIOStorageClient:
         try:
             bucket_name = self._get_bucket_name(clinic_id)
             
-            self.client.remove_object(bucket_name, object_name)
+            await asyncio.to_thread(self.client.remove_object, bucket_name, object_name)
             logger.info(f"✅ Deleted document: {bucket_name}/{object_name}")
             
             return True
             
         except Exception as e:
             logger.error(f"❌ Failed to delete document: {str(e)}")
-            return False
+            raise
+    
+    @staticmethod
+    def _extract_user_metadata(metadata) -> Dict[str, str]:
+        """Normalize user metadata returned by listings or stat calls.
+
+        MinIO returns user metadata as ``X-Amz-Meta-Document-Id`` style keys
+        (and ``stat_object`` returns all response headers), so keys are
+        lowercased and stripped of the ``x-amz-meta-`` prefix.
+        """
+        user_metadata = {}
+        for key, value in (metadata or {}).items():
+            key = key.lower()
+            if key.startswith("x-amz-meta-"):
+                user_metadata[key[len("x-amz-meta-"):]] = value
+        return user_metadata
     
     async def list_patient_documents(
         self, 
         clinic_id: str, 
-        patient_id: str
+        patient_id: str,
+        limit: Optional[int] = None,
+        start_after: Optional[str] = None
     ) -> List[Dict[str, str]]:
         """
-        List all documents for a patient
+        List documents for a patient
+        
+        User metadata is requested in the listing call itself (MinIO
+        extension), so no per-object ``stat_object`` round trip is needed.
+        Objects are only stat'ed individually when the server did not
+        return metadata (plain S3 backends).
         
         Args:
             clinic_id: Clinic identifier
             patient_id: Patient identifier
+            limit: Maximum number of documents to return (None = all)
+            start_after: Object name to continue listing after (pagination)
             
         Returns:
             List of document information
         """
         try:
-            bucket_name = self._get_bucket_name(clinic_id)
-            prefix = f"patients/{patient_id}/documents/"
+            documents = await asyncio.to_thread(
+                self._list_patient_documents_sync, clinic_id, patient_id, limit, start_after
+            )
+            logger.info(f"📋 Listed {len(documents)} documents for patient {patient_id}")
+            return documents
             
-            documents = []
-            objects = self.client.list_objects(bucket_name, prefix=prefix, recursive=True)
+        except Exception as e:
+            logger.error(f"❌ Failed to list patient documents: {str(e)}")
+            raise
+    
+    def _list_patient_documents_sync(
+        self,
+        clinic_id: str,
+        patient_id: str,
+        limit: Optional[int],
+        start_after: Optional[str]
+    ) -> List[Dict[str, str]]:
+        """Blocking listing loop, run in a worker thread"""
+        bucket_name = self._get_bucket_name(clinic_id)
+        prefix = f"patients/{patient_id}/documents/"
+        
+        documents = []
+        objects = self.client.list_objects(
+            bucket_name,
+            prefix=prefix,
+            recursive=True,
+            start_after=start_after,
+            include_user_meta=True
+        )
+        
+        for obj in objects:
+            if limit is not None and len(documents) >= limit:
+                break
             
-            for obj in objects:
-                # Get object metadata
+            metadata = self._extract_user_metadata(obj.metadata)
+            if not metadata:
+                # Server ignored include_user_meta - fall back to stat
                 try:
                     stat = self.client.stat_object(bucket_name, obj.object_name)
-                    metadata = stat.metadata or {}
-                    
-                    documents.append({
-                        "object_name": obj.object_name,
-                        "size": obj.size,
-                        "last_modified": obj.last_modified.isoformat() if obj.last_modified else None,
-                        "etag": obj.etag,
-                        "document_id": metadata.get("document-id", ""),
-                        "original_filename": metadata.get("original-filename", ""),
-                        "upload_date": metadata.get("upload-date", "")
-                    })
+                    metadata = self._extract_user_metadata(stat.metadata)
                 except Exception as e:
                     logger.warning(f"Could not get metadata for {obj.object_name}: {str(e)}")
                     continue
             
-            logger.info(f"📋 Listed {len(documents)} documents for patient {patient_id}")
-            return documents
-            
-        except Exception as e:
-            logger.error(f"❌ Failed to list patient documents: {str(e)}")
-            return []
+            documents.append({
+                "object_name": obj.object_name,
+                "size": obj.size,
+                "last_modified": obj.last_modified.isoformat() if obj.last_modified else None,
+                "etag": obj.etag,
+                "document_id": metadata.get("document-id", ""),
+                "original_filename": metadata.get("original-filename", ""),
+                "upload_date": metadata.get("upload-date", "")
+            })
+        
+        return documents
     
     async def get_clinic_storage_stats(self, clinic_id: str) -> Dict[str, any]:
         """
@@ -268,38 +454,7 @@ class MinIOStorageClient:
             Storage statistics
         """
         try:
-            bucket_name = self._get_bucket_name(clinic_id)
-            
-            if not self.client.bucket_exists(bucket_name):
-                return {
-                    "total_objects": 0,
-                    "total_size": 0,
-                    "patients_with_documents": 0
-                }
-            
-            total_size = 0
-            total_objects = 0
-            patients = set()
-            
-            objects = self.client.list_objects(bucket_name, recursive=True)
-            
-            for obj in objects:
-                total_objects += 1
-                total_size += obj.size
-                
-                # Extract patient_id from object path
-                if obj.object_name.startswith("patients/"):
-                    parts = obj.object_name.split("/")
-                    if len(parts) >= 2:
-                        patients.add(parts[1])
-            
-            return {
-                "total_objects": total_objects,
-                "total_size": total_size,
-                "total_size_mb": round(total_size / (1024 * 1024), 2),
-                "patients_with_documents": len(patients),
-                "bucket_name": bucket_name
-            }
+            return await asyncio.to_thread(self._get_clinic_storage_stats_sync, clinic_id)
             
         except Exception as e:
             logger.error(f"❌ Failed to get storage stats: {str(e)}")
@@ -310,6 +465,41 @@ class MinIOStorageClient:
                 "error": str(e)
             }
 
+    def _get_clinic_storage_stats_sync(self, clinic_id: str) -> Dict[str, any]:
+        """Blocking full-bucket walk, run in a worker thread"""
+        bucket_name = self._get_bucket_name(clinic_id)
+        
+        if not self.client.bucket_exists(bucket_name):
+            return {
+                "total_objects": 0,
+                "total_size": 0,
+                "patients_with_documents": 0
+            }
+        
+        total_size = 0
+        total_objects = 0
+        patients = set()
+        
+        objects = self.client.list_objects(bucket_name, recursive=True)
+        
+        for obj in objects:
+            total_objects += 1
+            total_size += obj.size
+            
+            # Extract patient_id from object path
+            if obj.object_name.startswith("patients/"):
+                parts = obj.object_name.split("/")
+                if len(parts) >= 2:
+                    patients.add(parts[1])
+        
+        return {
+            "total_objects": total_objects,
+            "total_size": total_size,
+            "total_size_mb": round(total_size / (1024 * 1024), 2),
+            "patients_with_documents": len(patients),
+            "bucket_name": bucket_name
+        }
+
 # Singleton instance
 _minio_client = None
 
@@ -0,0 +1,459 @@
+# Background migration of local documents to MinIO
+#
+# A migration job is a row in storage_migration_jobs plus a per-document
+# checkpoint stored on each document (migration_status, migration_attempts,
+# migration_error). Documents are claimed one at a time with an atomic
+# find_one_and_update, so a job can be interrupted (restart, crash) and a new
+# job picks up exactly where the old one stopped. Claims carry a lease: an
+# in_progress document whose lease expired is considered abandoned and is
+# claimed again.
+#
+# One active job per clinic is enforced by a unique partial index on
+# (clinic_id) over jobs flagged ``active``; superseding a dead job releases
+# the documents it had claimed.
+#
+# Uploads go through the content-addressed blob store, so re-uploading after a
+# crash stores no second copy. The blob reference is recorded on the document
+# (migration_blob_id) before the object is uploaded and reused by every retry;
+# a document that finally fails gives it back. A migrated document drops its
+# reference on the local blob, whose file is deleted with the last reference.
+
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+import asyncio
+import logging
+import uuid
+
+import aiofiles.os
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from .database import get_collection
+from .storage_service import MedicalDocumentStorageService
+from . import storage_usage
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = "storage_migration_jobs"
+
+DEFAULT_CONCURRENCY = 4
+MAX_CONCURRENCY = 16
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 2
+CLAIM_LEASE = timedelta(minutes=10)
+HEARTBEAT_INTERVAL_SECONDS = 10
+HEARTBEAT_STALE_AFTER = timedelta(minutes=2)
+
+# Strong references to running job tasks (asyncio only keeps weak ones)
+_running_jobs: Dict[str, asyncio.Task] = {}
+
+
+class MigrationAlreadyRunning(Exception):
+    """Raised when a clinic already has an active migration job"""
+
+    def __init__(self, job_id: str):
+        super().__init__(f"Migration job {job_id} is already running")
+        self.job_id = job_id
+
+
+def _local_documents_filter(clinic_id: str) -> Dict:
+    """Documents of a clinic still stored on the local filesystem"""
+    return {
+        "clinic_id": clinic_id,
+        "$or": [
+            {"storage_type": "local"},
+            {"storage_type": {"$exists": False}}
+        ]
+    }
+
+
+class _ClaimLost(Exception):
+    """The document's lease expired and another worker claimed it"""
+
+
+def _claim_filter(doc: Dict) -> Dict:
+    """Matches the document only while this worker's claim on it stands"""
+    return {
+        "_id": doc["_id"],
+        "migration_job_id": doc["migration_job_id"],
+        "migration_claimed_at": doc["migration_claimed_at"]
+    }
+
+
+def _claimable_filter(now: datetime) -> Dict:
+    """Checkpoint states a worker may claim"""
+    return {"$or": [
+        {"migration_status": {"$exists": False}},
+        {"migration_status": "pending"},
+        {"migration_status": "in_progress", "migration_claimed_at": {"$lt": now - CLAIM_LEASE}}
+    ]}
+
+
+async def start_migration_job(
+    clinic_id: str,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    retry_failed: bool = False,
+    started_by: Optional[str] = None
+) -> Dict[str, any]:
+    """
+    Create a migration job for a clinic and run it in the background
+
+    Args:
+        clinic_id: Clinic identifier
+        concurrency: Number of parallel uploads
+        retry_failed: Reset documents that exhausted their attempts in a
+            previous job so they are migrated again
+        started_by: Username of the admin starting the job
+
+    Returns:
+        The created job document
+
+    Raises:
+        MigrationAlreadyRunning: If the clinic has a live job
+    """
+    jobs_collection = await get_collection(JOBS_COLLECTION)
+    now = datetime.utcnow()
+
+    active_job = await jobs_collection.find_one(
+        {"clinic_id": clinic_id, "status": {"$in": ["queued", "running"]}},
+        {"_id": 0}
+    )
+    if active_job:
+        if active_job.get("heartbeat_at") and active_job["heartbeat_at"] > now - HEARTBEAT_STALE_AFTER:
+            raise MigrationAlreadyRunning(active_job["job_id"])
+        # The process running it died - its checkpoints are resumed by the new job
+        await jobs_collection.update_one(
+            {"job_id": active_job["job_id"]},
+            {"$set": {"status": "interrupted", "finished_at": now}, "$unset": {"active": ""}}
+        )
+        # Its claims would otherwise stay leased for CLAIM_LEASE and be skipped
+        documents_collection = await get_collection("documents")
+        released = await documents_collection.update_many(
+            {"migration_job_id": active_job["job_id"], "migration_status": "in_progress"},
+            {"$set": {"migration_status": "pending"}, "$unset": {"migration_claimed_at": ""}}
+        )
+        logger.warning(
+            f"⚠️ Migration job {active_job['job_id']} was interrupted, resuming in a new job "
+            f"({released.modified_count} claimed documents released)"
+        )
+
+    job = {
+        "job_id": str(uuid.uuid4()),
+        "clinic_id": clinic_id,
+        "status": "queued",
+        "concurrency": max(1, min(concurrency, MAX_CONCURRENCY)),
+        "retry_failed": retry_failed,
+        "total": 0,
+        "migrated": 0,
+        "failed": 0,
+        "skipped": 0,
+        "bytes_migrated": 0,
+        "last_error": None,
+        "started_by": started_by,
+        "created_at": now,
+        "started_at": None,
+        "finished_at": None,
+        "heartbeat_at": now,
+        "active": True
+    }
+    try:
+        await jobs_collection.insert_one(dict(job))
+    except DuplicateKeyError:
+        # A concurrent request took the clinic's job slot first
+        winner = await jobs_collection.find_one({"clinic_id": clinic_id, "active": True}, {"job_id": 1})
+        raise MigrationAlreadyRunning(winner["job_id"] if winner else "unknown")
+
+    task = asyncio.create_task(_run_migration_job(job["job_id"], clinic_id, job["concurrency"], retry_failed))
+    _running_jobs[job["job_id"]] = task
+    task.add_done_callback(lambda _: _running_jobs.pop(job["job_id"], None))
+
+    logger.info(f"🚚 Started migration job {job['job_id']} for clinic {clinic_id}")
+    return job
+
+
+async def get_migration_job(job_id: str) -> Optional[Dict[str, any]]:
+    """
+    Get a migration job with progress and throughput figures
+
+    Args:
+        job_id: Job identifier
+
+    Returns:
+        Job status, or None if the job does not exist
+    """
+    jobs_collection = await get_collection(JOBS_COLLECTION)
+    job = await jobs_collection.find_one({"job_id": job_id}, {"_id": 0})
+    if not job:
+        return None
+
+    processed = job["migrated"] + job["failed"] + job.get("skipped", 0)
+    elapsed = 0.0
+    if job.get("started_at"):
+        end = job.get("finished_at") or datetime.utcnow()
+        elapsed = max((end - job["started_at"]).total_seconds(), 0.0)
+
+    docs_per_second = job["migrated"] / elapsed if elapsed else 0.0
+    remaining = max(job["total"] - processed, 0)
+
+    job["progress_percent"] = round(processed / job["total"] * 100, 1) if job["total"] else 100.0
+    job["remaining"] = remaining
+    job["elapsed_seconds"] = round(elapsed, 1)
+    job["documents_per_second"] = round(docs_per_second, 2)
+    job["bytes_per_second"] = round(job["bytes_migrated"] / elapsed, 1) if elapsed else 0.0
+    job["eta_seconds"] = (
+        round(remaining / docs_per_second, 1)
+        if docs_per_second and job["status"] == "running" else None
+    )
+    return job
+
+
+async def _run_migration_job(job_id: str, clinic_id: str, concurrency: int, retry_failed: bool) -> None:
+    """Producer/worker pool driving one migration job"""
+    jobs_collection = await get_collection(JOBS_COLLECTION)
+    documents_collection = await get_collection("documents")
+    heartbeat_task = None
+
+    try:
+        storage_service = MedicalDocumentStorageService(use_minio=True)
+
+        if retry_failed:
+            await documents_collection.update_many(
+                {**_local_documents_filter(clinic_id), "migration_status": "failed"},
+                {"$set": {"migration_status": "pending", "migration_attempts": 0}}
+            )
+
+        candidates = {**_local_documents_filter(clinic_id), "migration_status": {"$ne": "failed"}}
+        total = await documents_collection.count_documents(candidates)
+        await jobs_collection.update_one(
+            {"job_id": job_id},
+            {"$set": {"status": "running", "total": total, "started_at": datetime.utcnow()}}
+        )
+        heartbeat_task = asyncio.create_task(_heartbeat(job_id))
+
+        # Bounded queue keeps the cursor at most a few batches ahead of workers
+        queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+        async def produce():
+            async for doc in documents_collection.find(candidates, {"_id": 1}).batch_size(100):
+                await queue.put(doc["_id"])
+            for _ in range(concurrency):
+                await queue.put(None)
+
+        async def work():
+            while True:
+                document_oid = await queue.get()
+                if document_oid is None:
+                    return
+                try:
+                    if await _migrate_document(job_id, clinic_id, document_oid, storage_service) == "skipped":
+                        await jobs_collection.update_one({"job_id": job_id}, {"$inc": {"skipped": 1}})
+                except Exception as e:
+                    # Checkpoint writes failed; the lease lets a later job reclaim it
+                    logger.error(f"❌ Could not migrate document {document_oid}: {str(e)}")
+
+        await asyncio.gather(produce(), *(work() for _ in range(concurrency)))
+
+        job = await jobs_collection.find_one({"job_id": job_id}, {"failed": 1, "migrated": 1, "skipped": 1, "total": 1})
+        if job["skipped"] or job["migrated"] + job["failed"] < job["total"]:
+            # Documents still local (claimed elsewhere, out of attempts): start another job
+            final_status = "incomplete"
+        elif job["failed"]:
+            final_status = "completed_with_errors"
+        else:
+            final_status = "completed"
+        await jobs_collection.update_one(
+            {"job_id": job_id},
+            {"$set": {"status": final_status, "finished_at": datetime.utcnow()}, "$unset": {"active": ""}}
+        )
+        logger.info(
+            f"✅ Migration job {job_id} finished ({final_status}): {job['migrated']} migrated, "
+            f"{job['failed']} failed, {job['skipped']} skipped"
+        )
+
+    except Exception as e:
+        logger.error(f"❌ Migration job {job_id} failed: {str(e)}")
+        await jobs_collection.update_one(
+            {"job_id": job_id},
+            {
+                "$set": {"status": "failed", "last_error": str(e), "finished_at": datetime.utcnow()},
+                "$unset": {"active": ""}
+            }
+        )
+    finally:
+        if heartbeat_task:
+            heartbeat_task.cancel()
+
+
+async def _heartbeat(job_id: str) -> None:
+    """Periodically mark the job as alive so stale jobs can be detected"""
+    jobs_collection = await get_collection(JOBS_COLLECTION)
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL_SECONDS)
+        await jobs_collection.update_one(
+            {"job_id": job_id},
+            {"$set": {"heartbeat_at": datetime.utcnow()}}
+        )
+
+
+async def _migrate_document(
+    job_id: str,
+    clinic_id: str,
+    document_oid,
+    storage_service: MedicalDocumentStorageService
+) -> str:
+    """
+    Claim one document and move it to MinIO, retrying transient failures
+
+    Returns:
+        "migrated", "failed", "skipped" (still local but could not be
+        claimed) or "gone" (no longer a local document)
+    """
+    documents_collection = await get_collection("documents")
+    jobs_collection = await get_collection(JOBS_COLLECTION)
+
+    last_error = None
+    for attempt in range(MAX_ATTEMPTS):
+        now = datetime.utcnow()
+        doc = await documents_collection.find_one_and_update(
+            {
+                "_id": document_oid,
+                "migration_attempts": {"$not": {"$gte": MAX_ATTEMPTS}},
+                "$and": [_local_documents_filter(clinic_id), _claimable_filter(now)]
+            },
+            {
+                "$set": {
+                    "migration_status": "in_progress",
+                    "migration_job_id": job_id,
+                    "migration_claimed_at": now
+                },
+                "$inc": {"migration_attempts": 1}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if not doc:
+            # Claimed by another worker or out of attempts - unless it left local storage meanwhile
+            still_local = await documents_collection.count_documents(
+                {"_id": document_oid, **_local_documents_filter(clinic_id)}, limit=1
+            )
+            return "skipped" if still_local else "gone"
+
+        file_path = doc.get("file_path")
+        if not file_path or not await aiofiles.os.path.exists(file_path):
+            last_error = f"File not found: {file_path}"
+            break
+
+        try:
+            uploaded_size = await _upload_local_file(doc, file_path, storage_service)
+        except _ClaimLost:
+            # The worker holding the claim now finishes the document
+            return "skipped"
+        except Exception as e:
+            last_error = str(e)
+            logger.warning(
+                f"⚠️ Migration attempt {doc['migration_attempts']} failed for {doc['_id']}: {last_error}"
+            )
+            if doc["migration_attempts"] >= MAX_ATTEMPTS:
+                break
+            await documents_collection.update_one(
+                {"_id": document_oid, "migration_job_id": job_id},
+                {"$set": {"migration_status": "pending", "migration_error": last_error}}
+            )
+            await asyncio.sleep(RETRY_BACKOFF_SECONDS * (2 ** attempt))
+            continue
+
+        await jobs_collection.update_one(
+            {"job_id": job_id},
+            {"$inc": {"migrated": 1, "bytes_migrated": uploaded_size}}
+        )
+        return "migrated"
+
+    failed_doc = await documents_collection.find_one_and_update(
+        {"_id": document_oid, "migration_job_id": job_id},
+        {"$set": {"migration_status": "failed", "migration_error": last_error}, "$unset": {"migration_blob_id": ""}},
+        projection={"migration_blob_id": 1}
+    )
+    if failed_doc and failed_doc.get("migration_blob_id"):
+        await storage_service.release_document_blob(clinic_id, failed_doc["migration_blob_id"])
+    await jobs_collection.update_one(
+        {"job_id": job_id},
+        {"$inc": {"failed": 1}, "$set": {"last_error": last_error}}
+    )
+    return "failed"
+
+
+async def _upload_local_file(
+    doc: Dict,
+    file_path: str,
+    storage_service: MedicalDocumentStorageService
+) -> int:
+    """Stream a local file to MinIO, checkpoint the document, then drop the local copy"""
+    documents_collection = await get_collection("documents")
+    file_size = (await aiofiles.os.stat(file_path)).st_size
+    clinic_id = doc["clinic_id"]
+
+    async def record_blob(blob_id: str) -> None:
+        # Checkpoint the reference so a retry after a crash reuses it
+        result = await documents_collection.update_one(
+            _claim_filter(doc),
+            {"$set": {"migration_blob_id": blob_id}}
+        )
+        if not result.matched_count:
+            raise _ClaimLost()
+
+    # The open file is streamed in parts by the SDK (in a worker thread) instead of read into memory
+    file_data = await asyncio.to_thread(open, file_path, "rb")
+    try:
+        upload_result = await storage_service.upload_medical_document(
+            clinic_id=clinic_id,
+            patient_id=doc["patient_id"],
+            file_data=file_data,
+            filename=doc["file_name"],
+            file_size=file_size,
+            document_type=doc.get("document_type", "medical_record"),
+            description=doc.get("description"),
+            content_type=doc.get("file_type", "application/octet-stream"),
+            document_id=str(doc["_id"]),
+            blob_id=doc.get("migration_blob_id"),
+            on_blob_acquired=record_blob
+        )
+    finally:
+        await asyncio.to_thread(file_data.close)
+
+    if upload_result.get("storage_type") != "minio":
+        # Never repoint the record (or drop the local copy) unless the object is in MinIO
+        raise RuntimeError(f"Upload was stored on {upload_result.get('storage_type')} storage, not MinIO")
+
+    result = await documents_collection.update_one(
+        _claim_filter(doc),
+        {
+            "$set": {
+                "storage_type": "minio",
+                "bucket_name": upload_result.get("bucket_name"),
+                "object_name": upload_result.get("object_name"),
+                "document_id": upload_result.get("document_id"),
+                "etag": upload_result.get("etag"),
+                "blob_id": upload_result.get("blob_id"),
+                "sha256": upload_result.get("sha256"),
+                "file_size": file_size,
+                "migrated_at": datetime.utcnow(),
+                "migration_status": "done"
+            },
+            "$unset": {"migration_error": "", "migration_claimed_at": "", "migration_blob_id": ""}
+        }
+    )
+    if not result.matched_count:
+        # Lease expired mid-upload: the new claimant reuses migration_blob_id, the local copy stays
+        raise _ClaimLost()
+    await storage_usage.record_document_resized(clinic_id, doc.get("file_size", 0), file_size)
+
+    # Local copy is only removed once the record points at MinIO
+    if doc.get("blob_id"):
+        # Deduplicated local blob: other documents may share the file, it goes with the last reference
+        await storage_service.release_document_blob(clinic_id, doc["blob_id"])
+    else:
+        try:
+            await aiofiles.os.remove(file_path)
+        except OSError as e:
+            logger.warning(f"⚠️ Could not remove migrated local file {file_path}: {str(e)}")
+
+    return file_size
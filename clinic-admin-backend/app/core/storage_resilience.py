@@ -0,0 +1,422 @@
+# Deadlines, retries, hedged reads and a circuit breaker for object storage
+#
+# ResilientStorageProvider wraps a StorageProvider (MinIO in practice) so a
+# slow or failing storage backend cannot pin request handlers:
+#   - every call runs under a per-operation deadline
+#   - idempotent operations are retried with exponential backoff and jitter
+#   - reads optionally send a hedged second request once the first one is
+#     slower than a recent latency percentile; the first answer wins
+#   - a circuit breaker opens after consecutive failures and rejects calls
+#     immediately until a half-open probe succeeds
+#
+# SDK calls run in worker threads: a deadline releases the caller but cannot
+# interrupt the thread. Uploads are therefore never retried after a timeout,
+# since the abandoned attempt may still be reading the stream.
+
+from collections import deque
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Deque, Dict, List, Optional
+import asyncio
+import logging
+import random
+import time
+
+from minio.error import S3Error
+
+from . import metrics
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Storage answered, but the object/bucket does not exist - not an outage
+NOT_FOUND_CODES = {"NoSuchKey", "NoSuchBucket", "NoSuchObject", "NoSuchUpload"}
+
+LATENCY_WINDOW = 200
+MIN_HEDGE_SAMPLES = 20
+MIN_HEDGE_DELAY = 0.05
+MAX_RETRY_DELAY = 2.0
+
+
+class StorageUnavailableError(Exception):
+    """Object storage cannot serve the request right now"""
+
+
+class StorageTimeoutError(StorageUnavailableError):
+    """A storage call exceeded its deadline"""
+
+
+class CircuitOpenError(StorageUnavailableError):
+    """Call rejected without reaching storage because the circuit is open"""
+
+
+def _is_not_found(error: Exception) -> bool:
+    if isinstance(error, FileNotFoundError):
+        return True
+    return isinstance(error, S3Error) and error.code in NOT_FOUND_CODES
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+
+    closed: calls pass through. open: calls fail fast until reset_timeout
+    has elapsed. half_open: a single probe call is let through; its outcome
+    closes or re-opens the circuit.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.times_opened = 0
+        self.rejected_calls = 0
+        self._probe_in_flight = False
+
+    def before_call(self) -> None:
+        """Admit a call or raise CircuitOpenError"""
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected_calls += 1
+                raise CircuitOpenError(f"{self.name} circuit open: {self.last_error}")
+            self.state = "half_open"
+            logger.info(f"🔌 {self.name} circuit half-open, probing storage")
+
+        if self.state == "half_open":
+            if self._probe_in_flight:
+                self.rejected_calls += 1
+                raise CircuitOpenError(f"{self.name} circuit half-open, probe in flight")
+            self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        self._probe_in_flight = False
+        self.consecutive_failures = 0
+        if self.state != "closed":
+            logger.info(f"✅ {self.name} circuit closed")
+        self.state = "closed"
+
+    def record_failure(self, error: Exception) -> None:
+        self._probe_in_flight = False
+        self.consecutive_failures += 1
+        self.last_error = f"{type(error).__name__}: {error}"
+        if self.state == "half_open" or (
+            self.state == "closed" and self.consecutive_failures >= self.failure_threshold
+        ):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+            logger.error(f"🚨 {self.name} circuit opened after {self.consecutive_failures} failures: {self.last_error}")
+
+    def release(self) -> None:
+        """Call abandoned (cancelled) without an outcome"""
+        self._probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, any]:
+        retry_in = None
+        if self.state == "open":
+            retry_in = max(0.0, round(self.reset_timeout - (time.monotonic() - self.opened_at), 1))
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "rejected_calls": self.rejected_calls,
+            "retry_in_seconds": retry_in,
+            "last_error": self.last_error
+        }
+
+
+class _LatencyWindow:
+    """Rolling window of successful call durations"""
+
+    def __init__(self):
+        self._samples: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        if len(self._samples) < MIN_HEDGE_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+        return ordered[index]
+
+
+class ResilientStorageProvider:
+    """
+    StorageProvider decorator adding deadlines, retries, hedging and a breaker
+
+    Exposes the wrapped provider's interface; attributes it does not
+    override (e.g. ``client``) are passed through to the wrapped provider.
+    """
+
+    def __init__(self, provider, name: str = "storage"):
+        self.provider = provider
+        self.name = name
+        self.breaker = CircuitBreaker(
+            name,
+            settings.storage_breaker_failure_threshold,
+            settings.storage_breaker_reset_seconds
+        )
+        self._latency: Dict[str, _LatencyWindow] = {}
+        self._counters = {"calls": 0, "retries": 0, "hedged": 0, "hedge_wins": 0, "timeouts": 0}
+
+    def __getattr__(self, name):
+        return getattr(self.provider, name)
+
+    def blob_location(self, clinic_id: str, object_name: str) -> str:
+        return self.provider.blob_location(clinic_id, object_name)
+
+    # -- policy ----------------------------------------------------------
+
+    @staticmethod
+    def _deadline(operation: str) -> float:
+        if operation.startswith("upload"):
+            return settings.storage_write_timeout_seconds
+        return settings.storage_read_timeout_seconds
+
+    def _hedge_delay(self, operation: str) -> Optional[float]:
+        if not settings.storage_hedged_reads:
+            return None
+        window = self._latency.get(operation)
+        threshold = window.percentile(settings.storage_hedge_percentile) if window else None
+        return max(threshold, MIN_HEDGE_DELAY) if threshold is not None else None
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        delay = min(MAX_RETRY_DELAY, settings.storage_retry_base_delay_seconds * 2 ** (attempt - 1))
+        # Full jitter so retrying workers do not stampede a recovering server
+        return random.uniform(0, delay)
+
+    async def _attempt(self, operation: str, call: Callable[[], Awaitable]):
+        """One call under the breaker and the operation deadline"""
+        self.breaker.before_call()
+        self._counters["calls"] += 1
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(call(), self._deadline(operation))
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except asyncio.TimeoutError:
+            self._counters["timeouts"] += 1
+            error = StorageTimeoutError(f"{operation} exceeded {self._deadline(operation)}s deadline")
+            self.breaker.record_failure(error)
+            raise error
+        except Exception as e:
+            if _is_not_found(e):
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure(e)
+            raise
+        self.breaker.record_success()
+        self._latency.setdefault(operation, _LatencyWindow()).add(time.monotonic() - started)
+        return result
+
+    async def _hedged(self, operation: str, call: Callable[[], Awaitable]):
+        """Send a second request if the first is slower than the hedge percentile"""
+        delay = self._hedge_delay(operation)
+        if delay is None:
+            return await self._attempt(operation, call)
+
+        primary = asyncio.ensure_future(self._attempt(operation, call))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+
+            self._counters["hedged"] += 1
+            pending.add(asyncio.ensure_future(self._attempt(operation, call)))
+            last_error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._counters["hedge_wins"] += 1
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _call(
+        self,
+        operation: str,
+        call: Callable[[], Awaitable],
+        idempotent: bool = True,
+        hedge: bool = False,
+        retry_on_timeout: bool = True
+    ):
+        started = time.perf_counter()
+        try:
+            result = await self._call_with_retries(operation, call, idempotent, hedge, retry_on_timeout)
+        except CircuitOpenError:
+            metrics.observe_storage_operation(self.name, operation, time.perf_counter() - started, "rejected")
+            raise
+        except Exception as e:
+            outcome = "not_found" if _is_not_found(e) else "error"
+            metrics.observe_storage_operation(self.name, operation, time.perf_counter() - started, outcome)
+            raise
+        metrics.observe_storage_operation(self.name, operation, time.perf_counter() - started, "ok")
+        return result
+
+    async def _call_with_retries(
+        self,
+        operation: str,
+        call: Callable[[], Awaitable],
+        idempotent: bool,
+        hedge: bool,
+        retry_on_timeout: bool
+    ):
+        attempts = settings.storage_retry_attempts if idempotent else 1
+        for attempt in range(1, max(1, attempts) + 1):
+            try:
+                if hedge:
+                    return await self._hedged(operation, call)
+                return await self._attempt(operation, call)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                if _is_not_found(e):
+                    raise
+                retryable = retry_on_timeout or not isinstance(e, StorageTimeoutError)
+                if attempt >= attempts or not retryable:
+                    if isinstance(e, StorageUnavailableError):
+                        raise
+                    raise StorageUnavailableError(f"{operation} failed: {e}") from e
+                self._counters["retries"] += 1
+                logger.warning(f"⚠️ Storage {operation} failed (attempt {attempt}/{attempts}), retrying: {str(e)}")
+                await asyncio.sleep(self._backoff(attempt))
+
+    # -- StorageProvider interface ---------------------------------------
+
+    async def upload_document(self, *args, **kwargs) -> Dict[str, str]:
+        # Object names may be generated per call - never retried
+        return await self._call("upload_document", lambda: self.provider.upload_document(*args, **kwargs), idempotent=False)
+
+    async def upload_blob(
+        self,
+        clinic_id: str,
+        object_name: str,
+        file_data: BinaryIO,
+        file_size: int,
+        content_type: str = "application/octet-stream",
+        metadata: Optional[Dict[str, str]] = None
+    ) -> Dict[str, str]:
+        # Same object name and content on every attempt: retryable while the
+        # stream can be rewound
+        seekable = hasattr(file_data, "seekable") and file_data.seekable()
+        start = file_data.tell() if seekable else None
+
+        async def upload():
+            if start is not None:
+                file_data.seek(start)
+            return await self.provider.upload_blob(
+                clinic_id, object_name, file_data, file_size, content_type, metadata
+            )
+
+        result = await self._call("upload_blob", upload, idempotent=seekable, retry_on_timeout=False)
+        metrics.count_storage_bytes(self.name, "upload", file_size)
+        return result
+
+    async def read_blob(self, clinic_id: str, object_name: str) -> bytes:
+        data = await self._call(
+            "read_blob", lambda: self.provider.read_blob(clinic_id, object_name), hedge=True
+        )
+        metrics.count_storage_bytes(self.name, "download", len(data))
+        return data
+
+    async def get_object_etag(self, clinic_id: str, object_name: str) -> str:
+        return await self._call(
+            "stat", lambda: self.provider.get_object_etag(clinic_id, object_name), hedge=True
+        )
+
+    async def get_download_url(self, clinic_id: str, object_name: str, filename: Optional[str] = None) -> str:
+        return await self._call(
+            "get_download_url", lambda: self.provider.get_download_url(clinic_id, object_name, filename=filename)
+        )
+
+    async def delete_document(self, clinic_id: str, object_name: str) -> bool:
+        return await self._call("delete", lambda: self.provider.delete_document(clinic_id, object_name))
+
+    async def list_patient_documents(
+        self,
+        clinic_id: str,
+        patient_id: str,
+        limit: Optional[int] = None,
+        start_after: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        return await self._call(
+            "list",
+            lambda: self.provider.list_patient_documents(clinic_id, patient_id, limit=limit, start_after=start_after),
+            hedge=True
+        )
+
+    async def iter_blob(
+        self,
+        clinic_id: str,
+        object_name: str,
+        chunk_size: int = 256 * 1024,
+        offset: int = 0,
+        length: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Stream an object; retried until the first chunk arrives
+
+        Once bytes have been sent to the client the stream cannot be
+        restarted, so later chunks only get the per-chunk deadline.
+        """
+        holder = {}
+
+        async def open_stream():
+            stream = self.provider.iter_blob(clinic_id, object_name, chunk_size, offset, length)
+            try:
+                holder["first"] = await stream.__anext__()
+            except StopAsyncIteration:
+                holder["first"] = None
+            except BaseException:
+                await stream.aclose()
+                raise
+            return stream
+
+        stream = await self._call("iter_blob", open_stream)
+        if holder["first"] is None:
+            return
+
+        deadline = self._deadline("iter_blob")
+        try:
+            metrics.count_storage_bytes(self.name, "download", len(holder["first"]))
+            yield holder["first"]
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), deadline)
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    self._counters["timeouts"] += 1
+                    error = StorageTimeoutError(f"iter_blob stalled for {deadline}s")
+                    self.breaker.record_failure(error)
+                    raise error
+                metrics.count_storage_bytes(self.name, "download", len(chunk))
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    def get_health(self) -> Dict[str, any]:
+        """Breaker state, call counters and recent latency percentiles"""
+        latency = {}
+        for operation, window in self._latency.items():
+            p50, p95 = window.percentile(50), window.percentile(95)
+            if p50 is not None:
+                latency[operation] = {"p50_ms": round(p50 * 1000, 1), "p95_ms": round(p95 * 1000, 1)}
+        return {
+            "circuit": self.breaker.snapshot(),
+            **self._counters,
+            "hedging_enabled": settings.storage_hedged_reads,
+            "latency": latency
+        }
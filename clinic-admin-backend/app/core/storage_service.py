@@ -4,17 +4,29 @@
 import os
 import uuid
 import shutil
+import hashlib
+import inspect
 from abc import ABC, abstractmethod
-from typing import BinaryIO, Optional, Dict, List, Union
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Optional, Dict, List, Union
 from datetime import datetime
 from pathlib import Path
 import io
+import asyncio
 import logging
 
+import aiofiles
+import aiofiles.os
+
 from .storage import get_minio_client
+from . import document_blobs, document_previews
+from .config import settings
+from .document_cache import DocumentCache
+from .storage_resilience import ResilientStorageProvider
 
 logger = logging.getLogger(__name__)
 
+STREAM_CHUNK_SIZE = 256 * 1024
+
 class StorageProvider(ABC):
     """Abstract base class for storage providers"""
     
@@ -27,13 +39,52 @@ class StorageProvider(ABC):
         filename: str, 
         file_size: int,
         content_type: str = "application/octet-stream",
-        metadata: Optional[Dict[str, str]] = None
+        metadata: Optional[Dict[str, str]] = None,
+        document_id: Optional[str] = None
     ) -> Dict[str, str]:
         """Upload a medical document"""
         pass
     
     @abstractmethod
-    async def get_download_url(self, clinic_id: str, file_path: str) -> str:
+    async def upload_blob(
+        self,
+        clinic_id: str,
+        object_name: str,
+        file_data: BinaryIO,
+        file_size: int,
+        content_type: str = "application/octet-stream",
+        metadata: Optional[Dict[str, str]] = None
+    ) -> Dict[str, str]:
+        """Upload a content-addressed blob under the given object name"""
+        pass
+    
+    def blob_location(self, clinic_id: str, object_name: str) -> str:
+        """Path a blob is stored at, as used by download/delete"""
+        return object_name
+    
+    async def check_connection(self) -> None:
+        """Raise if the backing storage cannot be reached (readiness probe)"""
+        return None
+    
+    @abstractmethod
+    async def read_blob(self, clinic_id: str, file_path: str) -> bytes:
+        """Read a stored object's content"""
+        pass
+    
+    @abstractmethod
+    def iter_blob(
+        self,
+        clinic_id: str,
+        file_path: str,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+        offset: int = 0,
+        length: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """Stream a stored object's content (or a byte range of it) in chunks"""
+        pass
+    
+    @abstractmethod
+    async def get_download_url(self, clinic_id: str, file_path: str, filename: Optional[str] = None) -> str:
         """Get download URL for a document"""
         pass
     
@@ -43,17 +94,70 @@ class StorageProvider(ABC):
         pass
     
     @abstractmethod
-    async def list_patient_documents(self, clinic_id: str, patient_id: str) -> List[Dict[str, str]]:
-        """List all documents for a patient"""
+    async def list_patient_documents(
+        self,
+        clinic_id: str,
+        patient_id: str,
+        limit: Optional[int] = None,
+        start_after: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """List documents for a patient, optionally paginated"""
         pass
 
 class LocalStorageProvider(StorageProvider):
-    """Local filesystem storage provider (legacy)"""
+    """
+    Local filesystem storage provider (legacy / offline installs)
+    
+    All file I/O goes through aiofiles so the event loop never blocks.
+    Files are written to a temporary sibling and renamed into place, so a
+    crash never leaves a truncated file under a final name. Directories are
+    sharded by a hashed two-level prefix (ab/cd/) to keep every directory
+    small even with hundreds of thousands of documents.
+    """
     
     def __init__(self, upload_dir: str = "uploads"):
         self.upload_dir = Path(upload_dir)
         self.upload_dir.mkdir(exist_ok=True)
     
+    @staticmethod
+    def _shard(key: str) -> Path:
+        """Two-level directory prefix derived from a hash of key"""
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return Path(digest[:2]) / digest[2:4]
+    
+    def _patient_dir(self, patient_id: str) -> Path:
+        return self.upload_dir / "patients" / self._shard(patient_id) / patient_id
+    
+    async def _read_chunk(self, file_data, size: int) -> bytes:
+        """Read from sync streams in a worker thread, or await async ones (UploadFile)"""
+        if inspect.iscoroutinefunction(file_data.read):
+            return await file_data.read(size)
+        return await asyncio.to_thread(file_data.read, size)
+    
+    async def _write_atomic(self, file_path: Path, file_data) -> int:
+        """Stream file_data to a temp file, fsync it and rename it to file_path"""
+        await aiofiles.os.makedirs(file_path.parent, exist_ok=True)
+        temp_path = file_path.with_name(f".{file_path.name}.{uuid.uuid4().hex}.tmp")
+        written = 0
+        try:
+            async with aiofiles.open(temp_path, "wb") as buffer:
+                while True:
+                    chunk = await self._read_chunk(file_data, STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    await buffer.write(chunk)
+                    written += len(chunk)
+                await buffer.flush()
+                await asyncio.to_thread(os.fsync, buffer.fileno())
+            await aiofiles.os.replace(temp_path, file_path)
+        except BaseException:
+            try:
+                await aiofiles.os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        return written
+    
     async def upload_document(
         self, 
         clinic_id: str,
@@ -62,29 +166,22 @@ class LocalStorageProvider(StorageProvider):
         filename: str, 
         file_size: int,
         content_type: str = "application/octet-stream",
-        metadata: Optional[Dict[str, str]] = None
+        metadata: Optional[Dict[str, str]] = None,
+        document_id: Optional[str] = None
     ) -> Dict[str, str]:
         """Upload document to local filesystem"""
         try:
-            # Create directory structure
-            patient_dir = self.upload_dir / "patients" / patient_id
-            patient_dir.mkdir(parents=True, exist_ok=True)
-            
-            # Generate unique filename
+            # Generate unique filename in the patient's shard
             file_extension = Path(filename).suffix
-            document_id = str(uuid.uuid4())
-            unique_filename = f"{document_id}{file_extension}"
-            file_path = patient_dir / unique_filename
+            document_id = document_id or str(uuid.uuid4())
+            file_path = self._patient_dir(patient_id) / f"{document_id}{file_extension}"
             
-            # Save file
-            with open(file_path, "wb") as buffer:
-                content = await file_data.read() if hasattr(file_data, 'read') else file_data.read()
-                buffer.write(content)
+            written = await self._write_atomic(file_path, file_data)
             
             return {
                 "file_path": str(file_path),
                 "document_id": document_id,
-                "file_size": file_size,
+                "file_size": written,
                 "upload_date": datetime.utcnow().isoformat(),
                 "storage_type": "local"
             }
@@ -93,39 +190,114 @@ class LocalStorageProvider(StorageProvider):
             logger.error(f"❌ Local storage upload failed: {str(e)}")
             raise
     
-    async def get_download_url(self, clinic_id: str, file_path: str) -> str:
+    async def upload_blob(
+        self,
+        clinic_id: str,
+        object_name: str,
+        file_data: BinaryIO,
+        file_size: int,
+        content_type: str = "application/octet-stream",
+        metadata: Optional[Dict[str, str]] = None
+    ) -> Dict[str, str]:
+        """Store blob on local filesystem under the clinic directory"""
+        try:
+            file_path = Path(self.blob_location(clinic_id, object_name))
+            written = await self._write_atomic(file_path, file_data)
+            
+            return {
+                "file_path": str(file_path),
+                "object_name": str(file_path),
+                "file_size": written,
+                "upload_date": datetime.utcnow().isoformat(),
+                "storage_type": "local"
+            }
+            
+        except Exception as e:
+            logger.error(f"❌ Local blob upload failed: {str(e)}")
+            raise
+    
+    def blob_location(self, clinic_id: str, object_name: str) -> str:
+        """Blobs live under uploads/clinics/{clinic_id}/{ab}/{cd}/"""
+        return str(self.upload_dir / "clinics" / clinic_id / self._shard(object_name) / object_name)
+    
+    async def read_blob(self, clinic_id: str, file_path: str) -> bytes:
+        """Read file content from local filesystem"""
+        async with aiofiles.open(file_path, "rb") as file_handle:
+            return await file_handle.read()
+    
+    async def iter_blob(
+        self,
+        clinic_id: str,
+        file_path: str,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+        offset: int = 0,
+        length: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """Stream file content from local filesystem"""
+        async with aiofiles.open(file_path, "rb") as file_handle:
+            if offset:
+                await file_handle.seek(offset)
+            remaining = length
+            while remaining is None or remaining > 0:
+                read_size = chunk_size if remaining is None else min(chunk_size, remaining)
+                chunk = await file_handle.read(read_size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+    
+    async def get_download_url(self, clinic_id: str, file_path: str, filename: Optional[str] = None) -> str:
         """Return local file path (no URL generation needed)"""
         return file_path
     
     async def delete_document(self, clinic_id: str, file_path: str) -> bool:
         """Delete file from local filesystem"""
         try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                return True
+            await aiofiles.os.remove(file_path)
+            return True
+        except FileNotFoundError:
             return False
         except Exception as e:
             logger.error(f"❌ Local storage delete failed: {str(e)}")
             return False
     
-    async def list_patient_documents(self, clinic_id: str, patient_id: str) -> List[Dict[str, str]]:
+    def _list_patient_files(self, patient_id: str) -> List[Path]:
+        """Patient files in the sharded layout plus the legacy flat one"""
+        files = []
+        for patient_dir in (self._patient_dir(patient_id), self.upload_dir / "patients" / patient_id):
+            if patient_dir.is_dir():
+                files.extend(
+                    path for path in patient_dir.iterdir()
+                    if path.is_file() and not path.name.startswith(".")
+                )
+        return sorted(files, key=lambda path: path.name)
+    
+    async def list_patient_documents(
+        self,
+        clinic_id: str,
+        patient_id: str,
+        limit: Optional[int] = None,
+        start_after: Optional[str] = None
+    ) -> List[Dict[str, str]]:
         """List documents in local filesystem"""
         try:
-            patient_dir = self.upload_dir / "patients" / patient_id
-            if not patient_dir.exists():
-                return []
+            files = await asyncio.to_thread(self._list_patient_files, patient_id)
             
             documents = []
-            for file_path in patient_dir.glob("*"):
-                if file_path.is_file():
-                    stat = file_path.stat()
-                    documents.append({
-                        "file_path": str(file_path),
-                        "filename": file_path.name,
-                        "size": stat.st_size,
-                        "last_modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                        "storage_type": "local"
-                    })
+            for file_path in files:
+                if start_after and file_path.name <= start_after:
+                    continue
+                if limit is not None and len(documents) >= limit:
+                    break
+                stat = await aiofiles.os.stat(file_path)
+                documents.append({
+                    "file_path": str(file_path),
+                    "filename": file_path.name,
+                    "size": stat.st_size,
+                    "last_modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+                    "storage_type": "local"
+                })
             
             return documents
             
@@ -147,7 +319,8 @@ class MinIOStorageProvider(StorageProvider):
         filename: str, 
         file_size: int,
         content_type: str = "application/octet-stream",
-        metadata: Optional[Dict[str, str]] = None
+        metadata: Optional[Dict[str, str]] = None,
+        document_id: Optional[str] = None
     ) -> Dict[str, str]:
         """Upload document to MinIO"""
         try:
@@ -158,7 +331,8 @@ class MinIOStorageProvider(StorageProvider):
                 filename=filename,
                 file_size=file_size,
                 content_type=content_type,
-                metadata=metadata
+                metadata=metadata,
+                document_id=document_id
             )
             
             result["storage_type"] = "minio"
@@ -168,10 +342,61 @@ class MinIOStorageProvider(StorageProvider):
             logger.error(f"❌ MinIO storage upload failed: {str(e)}")
             raise
     
-    async def get_download_url(self, clinic_id: str, object_name: str) -> str:
+    async def upload_blob(
+        self,
+        clinic_id: str,
+        object_name: str,
+        file_data: BinaryIO,
+        file_size: int,
+        content_type: str = "application/octet-stream",
+        metadata: Optional[Dict[str, str]] = None
+    ) -> Dict[str, str]:
+        """Upload blob to MinIO"""
+        try:
+            result = await self.client.upload_blob(
+                clinic_id=clinic_id,
+                object_name=object_name,
+                file_data=file_data,
+                file_size=file_size,
+                content_type=content_type,
+                metadata=metadata
+            )
+            
+            result["storage_type"] = "minio"
+            return result
+            
+        except Exception as e:
+            logger.error(f"❌ MinIO blob upload failed: {str(e)}")
+            raise
+    
+    async def read_blob(self, clinic_id: str, object_name: str) -> bytes:
+        """Read object content from MinIO"""
+        return await self.client.download_object(clinic_id, object_name)
+    
+    async def get_object_etag(self, clinic_id: str, object_name: str) -> str:
+        """Current ETag of an object (stat)"""
+        return await self.client.get_object_etag(clinic_id, object_name)
+    
+    async def check_connection(self) -> None:
+        """List buckets in a worker thread"""
+        await asyncio.to_thread(self.client.check_connection)
+    
+    async def iter_blob(
+        self,
+        clinic_id: str,
+        object_name: str,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+        offset: int = 0,
+        length: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """Stream object content from MinIO"""
+        async for chunk in self.client.iter_object(clinic_id, object_name, chunk_size, offset, length):
+            yield chunk
+    
+    async def get_download_url(self, clinic_id: str, object_name: str, filename: Optional[str] = None) -> str:
         """Get presigned download URL from MinIO"""
         try:
-            return await self.client.get_presigned_download_url(clinic_id, object_name)
+            return await self.client.get_presigned_download_url(clinic_id, object_name, filename=filename)
         except Exception as e:
             logger.error(f"❌ MinIO download URL generation failed: {str(e)}")
             raise
@@ -182,18 +407,26 @@ class MinIOStorageProvider(StorageProvider):
             return await self.client.delete_medical_document(clinic_id, object_name)
         except Exception as e:
             logger.error(f"❌ MinIO storage delete failed: {str(e)}")
-            return False
+            raise
     
-    async def list_patient_documents(self, clinic_id: str, patient_id: str) -> List[Dict[str, str]]:
+    async def list_patient_documents(
+        self,
+        clinic_id: str,
+        patient_id: str,
+        limit: Optional[int] = None,
+        start_after: Optional[str] = None
+    ) -> List[Dict[str, str]]:
         """List patient documents from MinIO"""
         try:
-            documents = await self.client.list_patient_documents(clinic_id, patient_id)
+            documents = await self.client.list_patient_documents(
+                clinic_id, patient_id, limit=limit, start_after=start_after
+            )
             for doc in documents:
                 doc["storage_type"] = "minio"
             return documents
         except Exception as e:
             logger.error(f"❌ MinIO storage list failed: {str(e)}")
-            return []
+            raise
 
 class MedicalDocumentStorageService:
     """
@@ -209,9 +442,25 @@ class MedicalDocumentStorageService:
             use_minio: If True, use MinIO storage; if False, use local storage
         """
         self.use_minio = use_minio
+        self._legacy_local_provider = None
+        
+        # Last readiness probe result, refreshed in the background
+        self._readiness = {"ready": None, "checked_at": None, "error": None}
+        self._readiness_checked = None
+        self._probe_task: Optional[asyncio.Task] = None
+        
+        # Optional disk cache for object bytes streamed through the backend
+        self.cache = None
+        if use_minio and settings.document_cache_enabled:
+            self.cache = DocumentCache(
+                settings.document_cache_dir,
+                settings.document_cache_max_mb * 1024 * 1024
+            )
+            logger.info(f"🗄️ Document cache enabled at {settings.document_cache_dir}")
         
         if use_minio:
-            self.provider = MinIOStorageProvider()
+            # Deadlines, retries and a circuit breaker around remote storage
+            self.provider = ResilientStorageProvider(MinIOStorageProvider(), name="minio")
             logger.info("🔧 Initialized MinIO storage provider")
         else:
             self.provider = LocalStorageProvider()
@@ -226,58 +475,211 @@ class MedicalDocumentStorageService:
         file_size: int,
         document_type: str = "medical_record",
         description: Optional[str] = None,
-        content_type: str = "application/octet-stream"
+        content_type: str = "application/octet-stream",
+        document_id: Optional[str] = None,
+        blob_id: Optional[str] = None,
+        on_blob_acquired: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Dict[str, str]:
         """
-        Upload medical document with metadata
+        Upload medical document as a content-addressed, deduplicated blob
+        
+        The content is hashed (SHA-256) in chunks, then a reference is taken
+        on the clinic's blob for that hash. Only the first upload of a given
+        content stores an object; later uploads are metadata-only.
+        
+        Retried uploads (migrations) pass on_blob_acquired to record the new
+        reference before the object is stored, and blob_id to reuse it on the
+        next attempt. The caller then owns that reference: it is kept when
+        the upload fails.
         
         Args:
             clinic_id: Clinic identifier
             patient_id: Patient identifier
-            file_data: File binary data
+            file_data: Seekable binary stream with the file content
             filename: Original filename
             file_size: File size in bytes
             document_type: Type of medical document
             description: Document description
             content_type: MIME type
+            document_id: Stable document identifier (defaults to a new UUID)
+            blob_id: Blob referenced by an earlier attempt of this upload
+            on_blob_acquired: Awaited with the blob id after a new reference is taken
             
         Returns:
-            Upload result with storage information
+            Upload result with storage information, including blob_id and
+            sha256 to be stored on the documents record
         """
         try:
-            # Prepare metadata
-            metadata = {
-                "document-type": document_type,
-                "description": description or f"Medical document: {filename}",
-                "clinic-id": clinic_id,
-                "patient-id": patient_id
-            }
+            sha256, size = await asyncio.to_thread(document_blobs.hash_stream, file_data)
+            blob = None
+            if blob_id:
+                blob = await document_blobs.reuse_blob(clinic_id, self.get_storage_type(), blob_id, sha256)
+                if blob is None:
+                    # Content changed since the earlier attempt - drop its reference
+                    await self.release_document_blob(clinic_id, blob_id)
             
-            result = await self.provider.upload_document(
-                clinic_id=clinic_id,
-                patient_id=patient_id,
-                file_data=file_data,
-                filename=filename,
-                file_size=file_size,
-                content_type=content_type,
-                metadata=metadata
-            )
+            if blob is None:
+                blob, _ = await document_blobs.acquire_blob(
+                    clinic_id, self.get_storage_type(), sha256, size, content_type
+                )
+                if on_blob_acquired:
+                    try:
+                        await on_blob_acquired(str(blob["_id"]))
+                    except Exception:
+                        await self.release_document_blob(clinic_id, blob["_id"])
+                        raise
+            needs_upload = blob["state"] != "ready"
             
-            logger.info(f"✅ Uploaded medical document: {filename} for patient {patient_id}")
-            return result
+            try:
+                etag = blob.get("etag")
+                if needs_upload:
+                    # Metadata describes the content, not any single document
+                    metadata = {
+                        "clinic-id": clinic_id,
+                        "sha256": sha256,
+                        "content-type": content_type
+                    }
+                    stored = await self.provider.upload_blob(
+                        clinic_id=clinic_id,
+                        object_name=blob["object_name"],
+                        file_data=file_data,
+                        file_size=size,
+                        content_type=content_type,
+                        metadata=metadata
+                    )
+                    etag = stored.get("etag")
+                    await document_blobs.mark_blob_ready(blob["_id"], etag)
+                    # Thumbnails are rendered by background workers, never inline
+                    document_previews.enqueue_preview(self, clinic_id, blob["_id"])
+            except Exception:
+                if not on_blob_acquired:
+                    await self.release_document_blob(clinic_id, blob["_id"])
+                raise
+            
+            if needs_upload:
+                logger.info(f"✅ Uploaded medical document: {filename} for patient {patient_id}")
+            else:
+                logger.info(f"♻️ Deduplicated medical document: {filename} for patient {patient_id} (sha256 {sha256[:12]})")
+            
+            location = self.provider.blob_location(clinic_id, blob["object_name"])
+            return {
+                "storage_type": self.get_storage_type(),
+                "bucket_name": f"clinic-{clinic_id}" if self.use_minio else None,
+                "object_name": location,
+                "file_path": location,
+                "document_id": document_id or str(uuid.uuid4()),
+                "file_size": size,
+                "etag": etag,
+                "blob_id": str(blob["_id"]),
+                "sha256": sha256,
+                "deduplicated": not needs_upload,
+                "preview_ready": blob.get("preview_state") == "ready",
+                "upload_date": datetime.utcnow().isoformat()
+            }
             
         except Exception as e:
             logger.error(f"❌ Medical document upload failed: {str(e)}")
             raise
     
-    async def get_document_download_url(self, clinic_id: str, file_path: str) -> str:
+    async def release_document_blob(self, clinic_id: str, blob_id) -> None:
+        """Drop a document's reference on its blob, deleting the object when unused"""
+        orphaned_blob = await document_blobs.release_blob(blob_id)
+        if orphaned_blob:
+            await self._delete_blob_objects(clinic_id, orphaned_blob)
+    
+    def blob_provider(self, blob: Dict) -> "StorageProvider":
+        """Provider holding a blob's objects (local blobs outlive a switch to MinIO)"""
+        if blob.get("backend") == "local":
+            return self._local_provider()
+        return self.provider
+    
+    async def _delete_blob_objects(self, clinic_id: str, blob: Dict) -> None:
+        """Delete an unreferenced blob's object and its preview"""
+        provider = self.blob_provider(blob)
+        object_names = [blob["object_name"]]
+        if blob.get("preview_object_name"):
+            object_names.append(blob["preview_object_name"])
+        for object_name in object_names:
+            location = provider.blob_location(clinic_id, object_name)
+            try:
+                if await provider.delete_document(clinic_id, location):
+                    logger.info(f"✅ Deleted medical document: {location}")
+                else:
+                    logger.warning(f"⚠️ Failed to delete medical document: {location}")
+            except Exception as e:
+                logger.error(f"❌ Delete medical document failed: {str(e)}")
+    
+    async def reconcile_blobs(self, clinic_id: str) -> Dict[str, int]:
+        """Fix blob reference counts and delete objects of unreferenced blobs"""
+        try:
+            result = await document_blobs.reconcile_blob_references(clinic_id)
+            for blob in result["orphaned_blobs"]:
+                await self._delete_blob_objects(clinic_id, blob)
+            return {"checked": result["checked"], "corrected": result["corrected"]}
+        except Exception as e:
+            logger.error(f"❌ Blob reconciliation failed for clinic {clinic_id}: {str(e)}")
+            return {"error": str(e)}
+    
+    async def get_document_download_url(self, clinic_id: str, file_path: str, filename: Optional[str] = None) -> str:
         """Get secure download URL for medical document"""
         try:
-            return await self.provider.get_download_url(clinic_id, file_path)
+            return await self.provider.get_download_url(clinic_id, file_path, filename=filename)
         except Exception as e:
             logger.error(f"❌ Failed to get download URL: {str(e)}")
             raise
     
+    def iter_document_content(
+        self,
+        document: Dict,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+        offset: int = 0,
+        length: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Stream a documents record's content from wherever it is stored
+        
+        Args:
+            document: Record from the documents collection
+            chunk_size: Bytes per chunk
+            offset: First byte to read
+            length: Number of bytes to read (None = to the end)
+            
+        Returns:
+            Async iterator over content chunks
+        """
+        if document.get("storage_type") == "minio" and self.use_minio:
+            clinic_id = document["clinic_id"]
+            object_name = document.get("object_name") or document.get("file_path")
+            if self.cache:
+                if offset == 0 and length is not None and length >= document.get("file_size", length + 1):
+                    # A "range" covering the whole object (full-body 200) is a full read the cache can fill
+                    length = None
+                return self.cache.iter_object(
+                    clinic_id,
+                    object_name,
+                    fetch=lambda start, count: self.provider.iter_blob(
+                        clinic_id, object_name, chunk_size, start, count
+                    ),
+                    expected_etag=document.get("etag"),
+                    resolve_etag=lambda: self.provider.get_object_etag(clinic_id, object_name),
+                    offset=offset,
+                    length=length
+                )
+            return self.provider.iter_blob(clinic_id, object_name, chunk_size, offset, length)
+        
+        # Legacy local documents, or a local-only deployment
+        return self._local_provider().iter_blob(
+            document.get("clinic_id"), document["file_path"], chunk_size, offset, length
+        )
+    
+    def _local_provider(self) -> "LocalStorageProvider":
+        """Provider used for records still stored on the local filesystem"""
+        if isinstance(self.provider, LocalStorageProvider):
+            return self.provider
+        if self._legacy_local_provider is None:
+            self._legacy_local_provider = LocalStorageProvider()
+        return self._legacy_local_provider
+    
     async def delete_medical_document(self, clinic_id: str, file_path: str) -> bool:
         """Delete medical document"""
         try:
@@ -291,62 +693,99 @@ class MedicalDocumentStorageService:
             logger.error(f"❌ Delete medical document failed: {str(e)}")
             return False
     
-    async def list_patient_medical_documents(self, clinic_id: str, patient_id: str) -> List[Dict[str, str]]:
-        """List all medical documents for a patient"""
+    async def list_patient_medical_documents(
+        self,
+        clinic_id: str,
+        patient_id: str,
+        limit: Optional[int] = None,
+        start_after: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """List medical documents for a patient (paginated with limit/start_after)"""
         try:
-            documents = await self.provider.list_patient_documents(clinic_id, patient_id)
+            documents = await self.provider.list_patient_documents(
+                clinic_id, patient_id, limit=limit, start_after=start_after
+            )
             logger.info(f"📋 Listed {len(documents)} medical documents for patient {patient_id}")
             return documents
         except Exception as e:
             logger.error(f"❌ Failed to list patient documents: {str(e)}")
             return []
     
-    async def get_clinic_storage_statistics(self, clinic_id: str) -> Dict[str, any]:
-        """Get storage statistics for a clinic"""
-        try:
-            if self.use_minio:
-                return await self.provider.client.get_clinic_storage_stats(clinic_id)
-            else:
-                # Calculate local storage stats
-                upload_dir = Path("uploads")
-                clinic_dir = upload_dir / "patients"
-                
-                if not clinic_dir.exists():
-                    return {"total_objects": 0, "total_size": 0, "patients_with_documents": 0}
-                
-                total_size = 0
-                total_objects = 0
-                patients = set()
-                
-                for file_path in clinic_dir.rglob("*"):
-                    if file_path.is_file():
-                        total_objects += 1
-                        total_size += file_path.stat().st_size
-                        patients.add(file_path.parent.name)
-                
-                return {
-                    "total_objects": total_objects,
-                    "total_size": total_size,
-                    "total_size_mb": round(total_size / (1024 * 1024), 2),
-                    "patients_with_documents": len(patients),
-                    "storage_type": "local"
-                }
-                
-        except Exception as e:
-            logger.error(f"❌ Failed to get storage statistics: {str(e)}")
-            return {"error": str(e)}
+    def get_cache_stats(self) -> Dict[str, any]:
+        """Disk cache metrics (enabled flag only when the cache is off)"""
+        if not self.cache:
+            return {"enabled": False}
+        return {"enabled": True, **self.cache.get_stats()}
+    
+    def get_storage_health(self) -> Dict[str, any]:
+        """Storage provider state for health checks"""
+        health = {"storage_type": self.get_storage_type()}
+        if isinstance(self.provider, ResilientStorageProvider):
+            health.update(self.provider.get_health())
+        return health
     
     def get_storage_type(self) -> str:
         """Get current storage type"""
         return "minio" if self.use_minio else "local"
+    
+    def schedule_readiness_probe(self) -> None:
+        """Start a background connectivity check unless one is running"""
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.create_task(self._probe_storage())
+    
+    async def _probe_storage(self) -> None:
+        try:
+            await asyncio.wait_for(
+                self.provider.check_connection(),
+                settings.storage_probe_timeout_seconds
+            )
+            if self._readiness["ready"] is not True:
+                logger.info(f"✅ {self.get_storage_type()} storage reachable")
+            self._readiness = {"ready": True, "checked_at": datetime.utcnow().isoformat(), "error": None}
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if self._readiness["ready"] is not False:
+                logger.error(f"❌ {self.get_storage_type()} storage unreachable: {error}")
+            self._readiness = {"ready": False, "checked_at": datetime.utcnow().isoformat(), "error": error}
+        finally:
+            self._readiness_checked = asyncio.get_running_loop().time()
+    
+    def get_readiness(self) -> Dict[str, any]:
+        """
+        Last probe result, without waiting on storage
+        
+        A stale result triggers a background re-probe; callers see its
+        outcome on a later request. ``ready`` is None until the first
+        probe has finished.
+        """
+        loop_time = asyncio.get_running_loop().time()
+        if self._readiness_checked is None or loop_time - self._readiness_checked >= settings.storage_probe_interval_seconds:
+            self.schedule_readiness_probe()
+        readiness = {"storage_type": self.get_storage_type(), **self._readiness}
+        if isinstance(self.provider, ResilientStorageProvider):
+            circuit_state = self.provider.breaker.state
+            readiness["circuit"] = circuit_state
+            if circuit_state == "open":
+                readiness["ready"] = False
+        return readiness
 
-# Global storage service instance
+# Global storage service instance, created on first use
 _storage_service = None
 
-def get_storage_service(use_minio: bool = True) -> MedicalDocumentStorageService:
-    """Get singleton storage service instance"""
+def get_storage_service(use_minio: Optional[bool] = None) -> MedicalDocumentStorageService:
+    """
+    Get singleton storage service instance
+    
+    Args:
+        use_minio: Override the backend chosen by settings.storage_backend
+            (only honoured when the singleton is first created)
+    """
     global _storage_service
     if _storage_service is None:
+        if use_minio is None:
+            use_minio = settings.storage_backend.lower() == "minio"
         _storage_service = MedicalDocumentStorageService(use_minio=use_minio)
     return _storage_service
 
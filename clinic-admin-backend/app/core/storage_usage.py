@@ -0,0 +1,363 @@
+# Per-clinic storage usage counters and plan quota enforcement
+#
+# Counters live in two collections:
+# - clinic_storage_usage: one document per clinic with total_size,
+#   total_objects and patients_with_documents
+# - patient_storage_usage: one document per (clinic, patient) holding the
+#   patient's document count, used to maintain patients_with_documents
+#
+# Every change is a single atomic $inc, so the stats endpoint is a single
+# find_one instead of a walk over the clinic's bucket. Quota admission is a
+# conditional $inc guarded by the plan's storage_limit_gb.
+#
+# An admitted upload counts in pending_uploads until its documents record is
+# written (record_document_added) or the reservation is cancelled, so
+# reconciliation can tell in-flight reservations apart from drift.
+
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+import logging
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from .database import get_collection
+
+logger = logging.getLogger(__name__)
+
+CLINIC_USAGE_COLLECTION = "clinic_storage_usage"
+PATIENT_USAGE_COLLECTION = "patient_storage_usage"
+
+BYTES_PER_GB = 1024 * 1024 * 1024
+
+# Clinic counters rebuilt by reconciliation, and how often it retries them
+RECONCILED_FIELDS = ("total_size", "total_objects", "patients_with_documents", "pending_uploads")
+RECONCILE_ATTEMPTS = 3
+
+# Reservations older than this belong to uploads that died before settling
+RESERVATION_TIMEOUT = timedelta(hours=1)
+
+
+async def get_clinic_storage_limit_bytes(clinic_id: str) -> Optional[int]:
+    """
+    Resolve the storage quota of a clinic from its subscription plan
+
+    Args:
+        clinic_id: Clinic identifier
+
+    Returns:
+        Quota in bytes, or None when the clinic or plan has no limit configured
+    """
+    clinics_collection = await get_collection("clinics")
+    clinic = await clinics_collection.find_one(
+        {"clinic_id": clinic_id},
+        {"subscription_plan": 1}
+    )
+    if not clinic or not clinic.get("subscription_plan"):
+        return None
+
+    plans_collection = await get_collection("subscription_plans")
+    plan = await plans_collection.find_one(
+        {"plan_id": clinic["subscription_plan"]},
+        {"storage_limit_gb": 1}
+    )
+    if not plan or not plan.get("storage_limit_gb"):
+        return None
+
+    return int(plan["storage_limit_gb"]) * BYTES_PER_GB
+
+
+async def _ensure_clinic_usage(clinic_id: str) -> None:
+    """Create the clinic counters document if it does not exist yet"""
+    usage_collection = await get_collection(CLINIC_USAGE_COLLECTION)
+    try:
+        await usage_collection.update_one(
+            {"clinic_id": clinic_id},
+            {"$setOnInsert": {
+                "clinic_id": clinic_id,
+                "total_size": 0,
+                "total_objects": 0,
+                "patients_with_documents": 0,
+                "created_at": datetime.utcnow()
+            }},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Another request created it concurrently
+        pass
+
+
+async def reserve_document_storage(clinic_id: str, file_size: int) -> Tuple[bool, Optional[int]]:
+    """
+    Atomically account a new document against the clinic quota
+
+    The increment only applies when the clinic stays within its plan's
+    storage limit, so concurrent uploads cannot overshoot the quota.
+
+    Args:
+        clinic_id: Clinic identifier
+        file_size: Document size in bytes
+
+    Returns:
+        Tuple of (accepted, limit_bytes)
+    """
+    await _ensure_clinic_usage(clinic_id)
+    limit_bytes = await get_clinic_storage_limit_bytes(clinic_id)
+
+    usage_filter = {"clinic_id": clinic_id}
+    if limit_bytes is not None:
+        usage_filter["total_size"] = {"$lte": limit_bytes - file_size}
+
+    usage_collection = await get_collection(CLINIC_USAGE_COLLECTION)
+    now = datetime.utcnow()
+    result = await usage_collection.update_one(
+        usage_filter,
+        {
+            "$inc": {"total_size": file_size, "total_objects": 1, "pending_uploads": 1},
+            "$set": {"updated_at": now, "last_reserved_at": now}
+        }
+    )
+
+    return result.modified_count == 1, limit_bytes
+
+
+async def cancel_document_reservation(clinic_id: str, file_size: int) -> None:
+    """Undo the reservation of an upload whose documents record was never written"""
+    usage_collection = await get_collection(CLINIC_USAGE_COLLECTION)
+    await usage_collection.update_one(
+        {"clinic_id": clinic_id},
+        {
+            "$inc": {"total_size": -file_size, "total_objects": -1, "pending_uploads": -1},
+            "$set": {"updated_at": datetime.utcnow()}
+        }
+    )
+
+
+async def release_document_storage(clinic_id: str, file_size: int) -> None:
+    """Account a deleted document's bytes"""
+    usage_collection = await get_collection(CLINIC_USAGE_COLLECTION)
+    await usage_collection.update_one(
+        {"clinic_id": clinic_id},
+        {
+            "$inc": {"total_size": -file_size, "total_objects": -1},
+            "$set": {"updated_at": datetime.utcnow()}
+        }
+    )
+
+
+async def record_document_added(clinic_id: str, patient_id: str) -> None:
+    """Settle the upload's reservation and count the document for the patient"""
+    patient_usage_collection = await get_collection(PATIENT_USAGE_COLLECTION)
+
+    try:
+        result = await patient_usage_collection.update_one(
+            {"clinic_id": clinic_id, "patient_id": patient_id},
+            {"$inc": {"documents": 1}},
+            upsert=True
+        )
+        first_document = result.upserted_id is not None
+    except DuplicateKeyError:
+        # Lost an upsert race - the other request counted the patient
+        await patient_usage_collection.update_one(
+            {"clinic_id": clinic_id, "patient_id": patient_id},
+            {"$inc": {"documents": 1}}
+        )
+        first_document = False
+
+    clinic_increments = {"pending_uploads": -1}
+    if first_document:
+        clinic_increments["patients_with_documents"] = 1
+    usage_collection = await get_collection(CLINIC_USAGE_COLLECTION)
+    await usage_collection.update_one(
+        {"clinic_id": clinic_id},
+        {"$inc": clinic_increments}
+    )
+
+
+async def record_document_removed(clinic_id: str, patient_id: str, file_size: int) -> None:
+    """Account a deleted document for the clinic and the patient"""
+    await release_document_storage(clinic_id, file_size)
+
+    patient_usage_collection = await get_collection(PATIENT_USAGE_COLLECTION)
+    patient_usage = await patient_usage_collection.find_one_and_update(
+        {"clinic_id": clinic_id, "patient_id": patient_id},
+        {"$inc": {"documents": -1}},
+        return_document=ReturnDocument.AFTER
+    )
+
+    if patient_usage and patient_usage["documents"] <= 0:
+        # Only the request that removes the counter decrements the clinic
+        result = await patient_usage_collection.delete_one({
+            "_id": patient_usage["_id"],
+            "documents": {"$lte": 0}
+        })
+        if result.deleted_count:
+            usage_collection = await get_collection(CLINIC_USAGE_COLLECTION)
+            await usage_collection.update_one(
+                {"clinic_id": clinic_id},
+                {"$inc": {"patients_with_documents": -1}}
+            )
+
+
+async def record_document_resized(clinic_id: str, old_size: int, new_size: int) -> None:
+    """Adjust the clinic byte counter when a document is re-stored (migration)"""
+    if old_size == new_size:
+        return
+    usage_collection = await get_collection(CLINIC_USAGE_COLLECTION)
+    await usage_collection.update_one(
+        {"clinic_id": clinic_id},
+        {
+            "$inc": {"total_size": new_size - old_size},
+            "$set": {"updated_at": datetime.utcnow()}
+        }
+    )
+
+
+async def get_clinic_storage_usage(clinic_id: str) -> Dict[str, any]:
+    """
+    Get storage usage counters for a clinic (single document read)
+
+    Args:
+        clinic_id: Clinic identifier
+
+    Returns:
+        Storage statistics
+    """
+    usage_collection = await get_collection(CLINIC_USAGE_COLLECTION)
+    usage = await usage_collection.find_one({"clinic_id": clinic_id}) or {}
+
+    total_size = usage.get("total_size", 0)
+    limit_bytes = await get_clinic_storage_limit_bytes(clinic_id)
+
+    return {
+        "total_objects": usage.get("total_objects", 0),
+        "total_size": total_size,
+        "total_size_mb": round(total_size / (1024 * 1024), 2),
+        "patients_with_documents": usage.get("patients_with_documents", 0),
+        "storage_limit_bytes": limit_bytes,
+        "storage_limit_gb": limit_bytes // BYTES_PER_GB if limit_bytes else None,
+        "reconciled_at": usage.get("reconciled_at")
+    }
+
+
+async def _reconcile_patient_counter(clinic_id: str, patient_id: str, observed: Optional[int], expected: int) -> None:
+    """Move one patient counter from the value read to the recount, unless it changed meanwhile"""
+    patient_usage_collection = await get_collection(PATIENT_USAGE_COLLECTION)
+    counter_filter = {"clinic_id": clinic_id, "patient_id": patient_id}
+
+    if observed is None:
+        try:
+            # Only creates the counter; one recreated concurrently is left alone
+            await patient_usage_collection.update_one(
+                counter_filter,
+                {"$setOnInsert": {**counter_filter, "documents": expected}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass
+    elif expected > 0:
+        await patient_usage_collection.update_one(
+            {**counter_filter, "documents": observed},
+            {"$set": {"documents": expected}}
+        )
+    else:
+        await patient_usage_collection.delete_one({**counter_filter, "documents": observed})
+
+
+async def reconcile_clinic_storage_usage(clinic_id: str) -> Dict[str, any]:
+    """
+    Rebuild a clinic's counters from the documents collection
+
+    Meant to run as a background job to correct any drift (documents stored
+    before counters existed, crashes between upload and accounting). A clinic
+    with uploads in flight is left alone: their reservations are counted but
+    their documents are not written yet. Reservations older than
+    RESERVATION_TIMEOUT are treated as abandoned and dropped. Every write is
+    conditional on the counter values read before recounting, so an $inc
+    that lands meanwhile makes it retry (a few times, then the next run).
+
+    Args:
+        clinic_id: Clinic identifier
+
+    Returns:
+        Reconciled counters, with "applied" False when uploads in flight or
+        concurrent activity kept the clinic totals from being written
+    """
+    await _ensure_clinic_usage(clinic_id)
+    usage_collection = await get_collection(CLINIC_USAGE_COLLECTION)
+    patient_usage_collection = await get_collection(PATIENT_USAGE_COLLECTION)
+    documents_collection = await get_collection("documents")
+    pipeline = [
+        {"$match": {"clinic_id": clinic_id}},
+        {"$group": {
+            "_id": "$patient_id",
+            "documents": {"$sum": 1},
+            "size": {"$sum": {"$ifNull": ["$file_size", 0]}}
+        }}
+    ]
+
+    for _ in range(RECONCILE_ATTEMPTS):
+        # Snapshot the counters before recounting; writes are conditional on it
+        observed = await usage_collection.find_one(
+            {"clinic_id": clinic_id},
+            {"_id": 0, "total_size": 1, "total_objects": 1, "patients_with_documents": 1,
+             "pending_uploads": 1, "last_reserved_at": 1}
+        )
+        pending_uploads = observed.get("pending_uploads") or 0
+        if pending_uploads > 0 and observed["last_reserved_at"] > datetime.utcnow() - RESERVATION_TIMEOUT:
+            logger.info(
+                f"⏳ Storage usage of clinic {clinic_id} has {pending_uploads} uploads in flight, "
+                f"left for the next run"
+            )
+            return {"pending_uploads": pending_uploads, "applied": False}
+        observed_patients = {
+            counter["patient_id"]: counter["documents"]
+            async for counter in patient_usage_collection.find(
+                {"clinic_id": clinic_id}, {"patient_id": 1, "documents": 1}
+            )
+        }
+
+        total_size = 0
+        total_objects = 0
+        expected_patients = {}
+        async for patient_data in documents_collection.aggregate(pipeline):
+            total_size += patient_data["size"]
+            total_objects += patient_data["documents"]
+            expected_patients[patient_data["_id"]] = patient_data["documents"]
+
+        for patient_id in observed_patients.keys() | expected_patients.keys():
+            observed_count = observed_patients.get(patient_id)
+            expected_count = expected_patients.get(patient_id, 0)
+            if observed_count != expected_count and not (observed_count is None and expected_count == 0):
+                await _reconcile_patient_counter(clinic_id, patient_id, observed_count, expected_count)
+
+        now = datetime.utcnow()
+        reconciled = {
+            "total_size": total_size,
+            "total_objects": total_objects,
+            "patients_with_documents": len(expected_patients),
+            "pending_uploads": 0,
+            "reconciled_at": now,
+            "updated_at": now
+        }
+        result = await usage_collection.update_one(
+            {"clinic_id": clinic_id, **{field: observed.get(field) for field in RECONCILED_FIELDS}},
+            {"$set": reconciled}
+        )
+        if result.matched_count:
+            logger.info(
+                f"📊 Reconciled storage usage for clinic {clinic_id}: "
+                f"{total_objects} objects, {total_size} bytes, {len(expected_patients)} patients"
+            )
+            return {**reconciled, "applied": True}
+
+    logger.warning(f"⚠️ Storage usage of clinic {clinic_id} kept changing while reconciling, left for the next run")
+    return {**reconciled, "applied": False}
+
+
+async def run_storage_reconciliation(clinic_id: str) -> None:
+    """Background task wrapper that logs instead of raising"""
+    try:
+        await reconcile_clinic_storage_usage(clinic_id)
+    except Exception as e:
+        logger.error(f"❌ Storage reconciliation failed for clinic {clinic_id}: {str(e)}")
@@ -21,6 +21,8 @@ class DocumentCreate(BaseModel):
     object_name: Optional[str] = None
     document_id: Optional[str] = None  # Unique document identifier
     etag: Optional[str] = None  # MinIO ETag for integrity
+    blob_id: Optional[str] = None  # Shared content-addressed blob
+    sha256: Optional[str] = None  # Content hash
 
 
 class DocumentResponse(BaseModel):
@@ -42,7 +44,10 @@ class DocumentResponse(BaseModel):
     object_name: Optional[str] = None
     document_id: Optional[str] = None
     etag: Optional[str] = None
+    blob_id: Optional[str] = None
+    sha256: Optional[str] = None
     download_url: Optional[str] = None  # Presigned URL for downloads
+    preview_url: Optional[str] = None  # Thumbnail endpoint, set once the preview is rendered
     migrated_at: Optional[datetime] = None  # When migrated to MinIO
     
     model_config = {"populate_by_name": True, "arbitrary_types_allowed": True}
@@ -68,6 +73,8 @@ class DocumentInDB(BaseModel):
     object_name: Optional[str] = None
     document_id: Optional[str] = None
     etag: Optional[str] = None
+    blob_id: Optional[str] = None
+    sha256: Optional[str] = None
     migrated_at: Optional[datetime] = None
     
     @classmethod
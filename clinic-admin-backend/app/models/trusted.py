@@ -0,0 +1,125 @@
+# Trusted-read serialization for documents loaded from our own database
+#
+# The regular path validates a document up to three times: Model.from_mongo,
+# Response(**model.model_dump()), then FastAPI's response_model check. For
+# data we wrote ourselves, trusted_response() skips validation entirely: a
+# projection compiled once per response model reshapes the raw document
+# (response_model fields only, aliases applied, defaults for missing fields,
+# nested models and lists of them projected recursively) and pydantic-core's
+# compiled JSON encoder writes it out. The Response is returned as-is, so
+# FastAPI does not validate it again; the body is the same JSON the
+# validated path produces.
+#
+# Datetimes stored in ``date`` fields (BSON has no date type) are narrowed
+# to dates, and ObjectIds are written as strings.
+#
+# Use it for reads only - request bodies and anything not written by this
+# backend must keep going through validation.
+
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Annotated, Any, Callable, Dict, List, Optional, Type, Union, get_args, get_origin
+import types
+
+from pydantic import BaseModel
+from pydantic_core import PydanticUndefined, to_json
+from starlette.responses import Response
+
+Converter = Optional[Callable[[Any], Any]]
+
+
+def _converter(annotation) -> Converter:
+    """Conversion a raw value needs before encoding, if any"""
+    origin = get_origin(annotation)
+
+    if origin is Annotated:
+        return _converter(get_args(annotation)[0])
+
+    if origin is Union or origin is types.UnionType:
+        members = [arg for arg in get_args(annotation) if arg is not type(None)]
+        return _converter(members[0]) if len(members) == 1 else None
+
+    if origin in (list, List):
+        args = get_args(annotation)
+        item = _converter(args[0]) if args else None
+        if item is None:
+            return None
+        return lambda value: [item(entry) for entry in value] if isinstance(value, list) else value
+
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        nested = _projection(annotation)
+        return lambda value: nested(value) if isinstance(value, dict) else value
+
+    if annotation is date:
+        return lambda value: value.date() if isinstance(value, datetime) else value
+
+    return None
+
+
+@lru_cache(maxsize=None)
+def _projection(model_cls: Type[BaseModel]) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """Compile a raw document -> response dict function for a model class"""
+    fields = []
+    for name, field in model_cls.model_fields.items():
+        key = field.alias or name
+        default = None if field.default is PydanticUndefined else field.default
+        fields.append((key, name, default, field.default_factory, _converter(field.annotation)))
+
+    def project(data: Dict[str, Any]) -> Dict[str, Any]:
+        result = {}
+        for key, name, default, default_factory, convert in fields:
+            if key in data:
+                value = data[key]
+            elif name in data:
+                value = data[name]
+            else:
+                value = default_factory() if default_factory is not None else default
+            if convert is not None and value is not None:
+                value = convert(value)
+            result[key] = value
+        return result
+
+    return project
+
+
+def dump_trusted_json(model_cls: Type[BaseModel], documents: Union[Dict[str, Any], List[Dict[str, Any]]]) -> bytes:
+    """
+    JSON bytes of one document or a list of documents shaped as model_cls
+
+    Args:
+        model_cls: Pydantic model (usually a *Response model)
+        documents: Raw MongoDB document(s)
+
+    Returns:
+        Encoded JSON
+    """
+    project = _projection(model_cls)
+    if isinstance(documents, list):
+        payload = [project(document) for document in documents]
+    else:
+        payload = project(documents)
+    # ObjectId (and any other BSON type) falls back to its string form
+    return to_json(payload, fallback=str)
+
+
+def trusted_response(
+    model_cls: Type[BaseModel],
+    documents: Union[Dict[str, Any], List[Dict[str, Any]]],
+    status_code: int = 200
+) -> Response:
+    """
+    Response for trusted database documents, bypassing response_model validation
+
+    Args:
+        model_cls: Response model the endpoint declares
+        documents: A document or a list of documents read from MongoDB
+        status_code: HTTP status code
+
+    Returns:
+        JSON response with the same body the validated path would produce
+    """
+    return Response(
+        content=dump_trusted_json(model_cls, documents),
+        status_code=status_code,
+        media_type="application/json"
+    )
@@ -2,7 +2,6 @@
 Email generator utilities for professionals
 """
 import re
-from typing import Tuple
 from unidecode import unidecode
 
 def normalize_name(name: str) -> str:
@@ -93,35 +92,74 @@ def generate_clinic_email_domain(clinic_name: str, suscriber: str = None) -> str
     
     return domain
 
-def validate_email_uniqueness(email: str, existing_emails: list) -> Tuple[bool, str]:
+def email_prefix_pattern(email: str) -> str:
     """
-    Check if email is unique and suggest alternative if not.
+    Anchored regex matching an email and its numbered variants.
+    
+    The pattern starts with a literal prefix, so MongoDB answers it with an
+    index range scan instead of reading every address.
     
     Args:
-        email: Proposed email address
-        existing_emails: List of existing email addresses
+        email: Base email address (e.g. juan.perez@clinica.com)
         
     Returns:
-        Tuple of (is_unique, suggested_email)
+        Pattern matching juan.perez@clinica.com, juan.perez1@clinica.com, ...
+    """
+    local_part, domain = email.split('@', 1)
+    return f"^{re.escape(local_part)}[0-9]*@{re.escape(domain)}$"
+
+def email_variants_filter(email: str) -> dict:
     """
-    if email not in existing_emails:
-        return True, email
+    MongoDB condition on an email field matching an email and its numbered variants.
     
-    # Generate alternatives
-    base_email = email.split('@')[0]
-    domain = email.split('@')[1]
+    The case-sensitive regex is bounded by an explicit key range: every
+    variant starts with the local part followed by a digit or "@", which
+    sort below "A". The email index is scanned over that range only,
+    whatever the escaping in the pattern.
     
-    for i in range(1, 100):
-        alternative = f"{base_email}{i}@{domain}"
-        if alternative not in existing_emails:
-            return False, alternative
+    Args:
+        email: Base email address (e.g. juan.perez@clinica.com)
+        
+    Returns:
+        Condition for the email field
+    """
+    local_part = email.split('@', 1)[0]
+    return {
+        "$gte": local_part,
+        "$lt": local_part + "A",
+        "$regex": email_prefix_pattern(email)
+    }
+
+def next_available_email(email: str, taken_emails: list) -> str:
+    """
+    Next free numbered variant of an email.
+    
+    Suffixes are never reused: the result is one past the highest suffix in
+    use, so an address freed by a deleted professional is not handed out
+    again.
+    
+    Args:
+        email: Base email address
+        taken_emails: Addresses matching email_variants_filter(email)
+        
+    Returns:
+        email itself if unused, otherwise local_part{n}@domain
+        
+    Examples:
+        >>> next_available_email("ana.gil@clinica.com", ["ana.gil@clinica.com", "ana.gil2@clinica.com"])
+        'ana.gil3@clinica.com'
+    """
+    if email not in taken_emails:
+        return email
     
-    # If we can't find a unique one after 99 attempts, use timestamp
-    import time
-    timestamp = str(int(time.time()))[-4:]  # Last 4 digits of timestamp
-    fallback = f"{base_email}{timestamp}@{domain}"
+    local_part, domain = email.split('@', 1)
+    highest = 0
+    for taken in taken_emails:
+        suffix = taken.split('@', 1)[0][len(local_part):]
+        if suffix.isdigit():
+            highest = max(highest, int(suffix))
     
-    return False, fallback
+    return f"{local_part}{highest + 1}@{domain}"
 
 def get_n8n_folder_name(suscriber: str, clinic_name: str = None) -> str:
     """
@@ -0,0 +1,62 @@
+# orjson-backed JSON responses
+#
+# BSONJSONResponse is the application's default response class. orjson
+# encodes datetime, date, UUID, Enum and dataclasses natively; the default
+# hook below adds the BSON and numeric types MongoDB documents carry
+# (ObjectId -> str, Decimal/Decimal128 -> int or float like FastAPI's own
+# encoder), so a raw document or a list of them can be returned as-is.
+#
+# Handlers that return plain values still go through FastAPI's
+# jsonable_encoder first; ObjectId is registered there too so raw
+# documents work on that path. Large lists should be returned wrapped in
+# BSONJSONResponse directly, which skips jsonable_encoder entirely.
+
+from decimal import Decimal
+from typing import Any
+
+from bson import Decimal128, ObjectId
+from fastapi import encoders
+from pydantic import BaseModel
+from starlette.responses import JSONResponse
+import orjson
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _decimal(value: Decimal):
+    # Same rule as fastapi.encoders.decimal_encoder
+    return int(value) if value.as_tuple().exponent >= 0 else float(value)
+
+
+def bson_default(obj: Any) -> Any:
+    """Encode the types orjson does not handle natively"""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, Decimal):
+        return _decimal(obj)
+    if isinstance(obj, Decimal128):
+        return _decimal(obj.to_decimal())
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json", by_alias=True)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Encode content (raw MongoDB documents included) as JSON bytes"""
+    return orjson.dumps(content, default=bson_default, option=ORJSON_OPTIONS)
+
+
+class BSONJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson, ObjectId and Decimal aware"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+# Raw documents returned through jsonable_encoder (no response_model)
+encoders.ENCODERS_BY_TYPE.setdefault(ObjectId, str)
+encoders.ENCODERS_BY_TYPE.setdefault(Decimal128, lambda value: _decimal(value.to_decimal()))
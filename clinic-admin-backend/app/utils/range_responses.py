@@ -0,0 +1,246 @@
+# HTTP Range / conditional request support for document downloads
+#
+# build_range_response evaluates If-None-Match / If-Modified-Since, Range and
+# If-Range against a document's validators and returns the matching
+# 200 / 206 / 304 / 416 response. Bodies come either from a local file (sent
+# with the ASGI zero-copy extension when the server offers it) or from an
+# async stream factory, which is how MinIO objects are proxied.
+
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import AsyncIterator, Callable, Mapping, Optional, Tuple
+from urllib.parse import quote
+import asyncio
+import os
+
+from starlette.responses import Response
+
+FILE_CHUNK_SIZE = 256 * 1024
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+StreamFactory = Callable[[int, int], AsyncIterator[bytes]]
+
+
+class RangeNotSatisfiable(Exception):
+    """Range header does not overlap the representation"""
+
+
+def parse_byte_range(value: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range ``Range`` header
+
+    Args:
+        value: Header value, e.g. ``bytes=0-1023``, ``bytes=1024-`` or ``bytes=-500``
+        size: Representation size in bytes
+
+    Returns:
+        Inclusive (start, end) offsets, or None when the header must be
+        ignored (other units, multiple ranges, invalid syntax)
+
+    Raises:
+        RangeNotSatisfiable: If the range lies outside the representation
+    """
+    unit, _, ranges = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+
+    first, dash, last = ranges.strip().partition("-")
+    if not dash:
+        return None
+
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            suffix = int(last)
+            if suffix <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(size - suffix, 0), size - 1
+
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+
+    if start < 0 or (last and end < start):
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def _etag_matches(header_value: str, etag: str, weak: bool) -> bool:
+    """Compare an If-None-Match / If-Range value against our ETag"""
+    if header_value.strip() == "*":
+        return True
+    candidates = [candidate.strip() for candidate in header_value.split(",")]
+    if weak:
+        bare = etag[2:] if etag.startswith("W/") else etag
+        return any((c[2:] if c.startswith("W/") else c) == bare for c in candidates)
+    # Strong comparison: both sides must be strong validators
+    return not etag.startswith("W/") and etag in candidates
+
+
+def _parse_http_date(value: str) -> Optional[datetime]:
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class RangeResponse(Response):
+    """Response sending a byte range of a file or of a streamed object"""
+
+    def __init__(
+        self,
+        status_code: int,
+        headers: Mapping[str, str],
+        media_type: str,
+        body_range: Tuple[int, int],
+        file_path: Optional[str] = None,
+        stream_factory: Optional[StreamFactory] = None,
+        send_body: bool = True
+    ):
+        super().__init__(status_code=status_code, headers=dict(headers), media_type=media_type)
+        self.body_range = body_range
+        self.file_path = file_path
+        self.stream_factory = stream_factory
+        self.send_body = send_body
+
+    async def __call__(self, scope, receive, send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+
+        start, end = self.body_range
+        count = end - start + 1
+        if not self.send_body or count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if self.file_path:
+            await self._send_file(scope, send, start, count)
+        else:
+            async for chunk in self.stream_factory(start, count):
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _send_file(self, scope, send, start: int, count: int) -> None:
+        file_handle = await asyncio.to_thread(open, self.file_path, "rb")
+        try:
+            if ZEROCOPY_EXTENSION in scope.get("extensions", {}):
+                # Server copies file -> socket in the kernel (sendfile)
+                await send({
+                    "type": ZEROCOPY_EXTENSION,
+                    "file": file_handle,
+                    "offset": start,
+                    "count": count,
+                    "more_body": False
+                })
+                return
+
+            await asyncio.to_thread(file_handle.seek, start)
+            remaining = count
+            while remaining > 0:
+                chunk = await asyncio.to_thread(file_handle.read, min(FILE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # File shrank underneath us - close the body anyway
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            file_handle.close()
+
+
+def build_range_response(
+    request_headers: Mapping[str, str],
+    method: str,
+    *,
+    size: int,
+    media_type: str,
+    etag: Optional[str] = None,
+    last_modified: Optional[datetime] = None,
+    filename: Optional[str] = None,
+    file_path: Optional[str] = None,
+    stream_factory: Optional[StreamFactory] = None
+) -> Response:
+    """
+    Build a 200/206/304/416 response honoring conditional and range headers
+
+    Args:
+        request_headers: Incoming request headers
+        method: Request method (HEAD responses carry no body)
+        size: Representation size in bytes
+        media_type: Content type
+        etag: Quoted ETag; strong validators enable If-Range resumes
+        last_modified: Modification time of the representation
+        filename: Download filename for Content-Disposition
+        file_path: Local file to serve (mutually exclusive with stream_factory)
+        stream_factory: Callable(start, count) returning the body stream
+
+    Returns:
+        Response ready to be returned from an endpoint
+    """
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": "private, no-cache"}
+    if etag:
+        headers["ETag"] = etag
+    if last_modified:
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        last_modified = last_modified.replace(microsecond=0)
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    if filename:
+        headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(filename)}"
+
+    # Conditional GET
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag and _etag_matches(if_none_match, etag, weak=True):
+            return Response(status_code=304, headers=headers)
+    elif last_modified and request_headers.get("if-modified-since"):
+        since = _parse_http_date(request_headers["if-modified-since"])
+        if since and last_modified <= since:
+            return Response(status_code=304, headers=headers)
+
+    body_range = (0, size - 1)
+    status_code = 200
+
+    range_header = request_headers.get("range")
+    if range_header and method in ("GET", "HEAD"):
+        honor_range = True
+        if_range = request_headers.get("if-range")
+        if if_range:
+            if if_range.strip().startswith(("\"", "W/")):
+                honor_range = bool(etag) and _etag_matches(if_range, etag, weak=False)
+            else:
+                if_range_date = _parse_http_date(if_range)
+                honor_range = bool(last_modified and if_range_date and last_modified == if_range_date)
+
+        if honor_range:
+            try:
+                requested = parse_byte_range(range_header, size)
+            except RangeNotSatisfiable:
+                headers["Content-Range"] = f"bytes */{size}"
+                return Response(status_code=416, headers=headers)
+            if requested:
+                body_range = requested
+                status_code = 206
+                headers["Content-Range"] = f"bytes {requested[0]}-{requested[1]}/{size}"
+
+    headers["Content-Length"] = str(body_range[1] - body_range[0] + 1)
+    return RangeResponse(
+        status_code=status_code,
+        headers=headers,
+        media_type=media_type,
+        body_range=body_range,
+        file_path=file_path,
+        stream_factory=stream_factory,
+        send_body=method != "HEAD"
+    )
+
+
+def file_validators(file_path: str) -> Tuple[int, str, datetime]:
+    """Size, weak ETag and mtime of a local file without a stored checksum"""
+    stat = os.stat(file_path)
+    modified = datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+    return stat.st_size, f'W/"{stat.st_size:x}-{int(stat.st_mtime_ns):x}"', modified
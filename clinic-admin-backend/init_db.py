@@ -6,6 +6,7 @@ Creates default admin user and sample clinic for testing
 
 import asyncio
 from datetime import datetime
+from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorClient
 from app.core.config import settings
 from app.auth.security import get_password_hash
@@ -59,11 +60,55 @@ async def create_collections_and_indexes(db):
     await db.patients.create_index("status_patient")
     
     # Professionals collection
-    await db.professionals.create_index([("clinic_id", 1), ("email", 1)], unique=True)
+    await db.professionals.create_index([("clinic_id", 1), ("email", 1)], unique=True)  # Also serves email allocation prefix scans
     await db.professionals.create_index("clinic_id")
+    await db.professionals.create_index("email")  # Login lookups
     await db.professionals.create_index("status_professional")
     await db.professionals.create_index("license_number", unique=True, sparse=True)
     
+    # Documents collection
+    await db.documents.create_index([("patient_id", 1), ("created_at", -1)])
+    await db.documents.create_index("clinic_id")
+    await db.documents.create_index([("clinic_id", 1), ("storage_type", 1), ("migration_status", 1)])
+    
+    # Patient shares
+    await db.patient_shares.create_index([("shared_with", 1), ("shared_at", -1)])
+    await db.patient_shares.create_index([("patient_id", 1), ("shared_by", 1), ("shared_with", 1)])
+    
+    # Access-control index (patients visible to each professional)
+    await db.patient_access.create_index([("professional_id", 1), ("patient_id", 1)], unique=True)
+    await db.patient_access.create_index([("professional_id", 1), ("granted_at", -1)])
+    await db.patient_access.create_index("patient_id")
+    
+    # Storage usage counters
+    await db.clinic_storage_usage.create_index("clinic_id", unique=True)
+    await db.patient_storage_usage.create_index([("clinic_id", 1), ("patient_id", 1)], unique=True)
+    
+    # Content-addressed document blobs
+    # Blobs written before the backend was part of the key take it from a referencing document
+    async for row in db.documents.aggregate([
+        {"$match": {"blob_id": {"$exists": True}}},
+        {"$group": {"_id": "$blob_id", "backend": {"$first": "$storage_type"}}}
+    ]):
+        if ObjectId.is_valid(row["_id"]):
+            await db.document_blobs.update_one(
+                {"_id": ObjectId(row["_id"]), "backend": {"$exists": False}},
+                {"$set": {"backend": row["backend"] or "local"}}
+            )
+    if "clinic_id_1_sha256_1" in await db.document_blobs.index_information():
+        await db.document_blobs.drop_index("clinic_id_1_sha256_1")
+    await db.document_blobs.create_index([("clinic_id", 1), ("backend", 1), ("sha256", 1)], unique=True)
+    await db.document_blobs.create_index([("state", 1), ("preview_state", 1)])
+    await db.documents.create_index([("clinic_id", 1), ("blob_id", 1)])
+    
+    # Storage migration jobs
+    await db.storage_migration_jobs.create_index("job_id", unique=True)
+    await db.storage_migration_jobs.create_index([("clinic_id", 1), ("status", 1)])
+    # At most one active (queued/running) migration job per clinic
+    await db.storage_migration_jobs.create_index(
+        "clinic_id", unique=True, partialFilterExpression={"active": True}, name="clinic_id_active_unique"
+    )
+    
     print(">> Collections and indexes created")
 
 async def create_default_admin(db):
@@ -1,39 +1,58 @@
-from fastapi import FastAPI, HTTPException, Depends
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
+import logging
 import os
 
 from app.core.config import settings
+from app.core.logging_config import configure_logging, RequestIdMiddleware
 from app.core.database import connect_to_mongo, close_mongo_connection
+from app.core.storage_service import get_storage_service
+from app.core.document_previews import start_preview_workers, stop_preview_workers
+from app.core import plan_limits
+from app.core.db_instrumentation import DbInstrumentationMiddleware
+from app.core import metrics
+from app.core.profiling import ProfilingMiddleware
+from app.core.loop_monitor import loop_monitor, LoopMonitorMiddleware
+from app.core.compression import CompressionMiddleware
+from app.core.static_assets import SpaAssets
 from app.api import auth, clinics, patients, professionals, admin_dashboard, subscription_plans, documents
 from app.auth.dependencies import get_user_or_api_key, verify_api_key
+from app.utils.json_response import BSONJSONResponse
 
+# Structured logs through a background writer thread (see app/core/logging_config.py)
+configure_logging()
+logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    print("Starting Clinic Admin Backend...")
+    logger.info("Starting Clinic Admin Backend...")
+    loop_monitor.start()
     await connect_to_mongo()
-    print("SUCCESS: Application started successfully")
-    
-    # Admin frontend setup
-    admin_static_dir = "static/admin"
-    admin_index = os.path.join(admin_static_dir, "index.html")
-    print(f"Admin static dir exists: {os.path.exists(admin_static_dir)}")
-    print(f"Admin index exists: {os.path.exists(admin_index)}")
+    # Storage is created here, not at import; connectivity is probed in the background
+    storage_service = get_storage_service()
+    storage_service.schedule_readiness_probe()
+    await start_preview_workers(storage_service)
+    plan_limits.start_reconciliation()
+    logger.info("SUCCESS: Application started successfully")
     
     # Check if running in admin-only mode
     admin_only = os.getenv('ADMIN_ONLY', 'false').lower() == 'true'
     if admin_only:
-        print("Running in ADMIN-ONLY mode")
+        logger.info("Running in ADMIN-ONLY mode")
     
     yield
     # Shutdown
-    print("Shutting down Clinic Admin Backend...")
+    logger.info("Shutting down Clinic Admin Backend...")
+    await stop_preview_workers()
+    await plan_limits.stop_reconciliation()
+    await loop_monitor.stop()
     await close_mongo_connection()
-    print("Application stopped")
+    metrics.mark_process_dead()
+    logger.info("Application stopped")
 
 
 # Create FastAPI application
@@ -44,6 +63,7 @@ app = FastAPI(
     docs_url="/docs",
     redoc_url="/redoc",
     lifespan=lifespan,
+    default_response_class=BSONJSONResponse,
     openapi_tags=[
         {"name": "health", "description": "Health check endpoints"},
         {"name": "auth", "description": "Authentication operations"},
@@ -113,71 +133,69 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip / brotli / zstd per Accept-Encoding (streaming responses chunk by chunk)
+if settings.compression_enabled:
+    app.add_middleware(CompressionMiddleware)
+# Sampling profiler for X-Profile / sampled requests; not installed unless enabled
+if settings.profiling_enabled:
+    app.add_middleware(ProfilingMiddleware)
+# Attribute MongoDB commands to the request (and route) that issued them
+app.add_middleware(DbInstrumentationMiddleware)
+# Lets the loop watchdog name the route that blocked the event loop
+if settings.loop_monitor_enabled:
+    app.add_middleware(LoopMonitorMiddleware)
+# HTTP latency and in-flight requests for /metrics (no-op without prometheus_client)
+app.add_middleware(metrics.MetricsMiddleware)
+# Outermost: every log record of a request carries its X-Request-ID
+app.add_middleware(RequestIdMiddleware)
+
 # Create uploads directory if it doesn't exist
 uploads_dir = "uploads"
 if not os.path.exists(uploads_dir):
     os.makedirs(uploads_dir)
-    print(f"Created uploads directory: {uploads_dir}")
+    logger.info(f"Created uploads directory: {uploads_dir}")
 
-# Mount static files for uploads
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Uploaded documents are only served through the authenticated
+# /api/documents/{id}/download endpoint (range requests, ETags)
 
 # ===========================================
 # UNIFIED FRONTEND SERVING CONFIGURATION
 # ===========================================
 
-# Mount unified admin frontend static files
+# Unified admin frontend static files
 admin_static_dir = "static/admin"
 legacy_frontend_dist = "frontend/dist"  # Legacy path for backward compatibility
 
 # Check for unified admin frontend (production)
 if os.path.exists(admin_static_dir):
-    print(f"Found UNIFIED frontend at {admin_static_dir}")
+    logger.info(f"Found UNIFIED frontend at {admin_static_dir}")
     
-    # Mount static files for assets (CSS, JS, etc.)
-    app.mount("/admin/assets", StaticFiles(directory=f"{admin_static_dir}/assets"), name="admin-assets")
-    app.mount("/assets", StaticFiles(directory=f"{admin_static_dir}/assets"), name="assets")
-    print(f"Mounted admin assets at /admin/assets and /assets")
+    # Indexed once here: hashed assets are served immutable, precompressed
+    # .br/.gz siblings are preferred, index.html is answered from memory
+    admin_spa = SpaAssets(admin_static_dir)
+    admin_spa.load()
     
-    # Serve admin app at root of /admin  
-    @app.get("/admin")
-    async def serve_unified_admin_root():
-        """Serve the unified admin frontend application (without trailing slash)"""
-        admin_index = os.path.join(admin_static_dir, "index.html")
-        if os.path.exists(admin_index):
-            return FileResponse(admin_index)
-        else:
-            raise HTTPException(status_code=404, detail="Unified admin frontend not built")
+    @app.api_route("/assets/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+    async def serve_admin_assets(path: str, request: Request):
+        """Hashed admin assets (index.html references them at /assets)"""
+        response = admin_spa.respond(f"assets/{path}", request.headers, request.method)
+        if response is None:
+            raise HTTPException(status_code=404, detail="Asset not found")
+        return response
     
-    @app.get("/admin/")
-    async def serve_unified_admin():
-        """Serve the unified admin frontend application (with trailing slash)"""
-        admin_index = os.path.join(admin_static_dir, "index.html")
-        if os.path.exists(admin_index):
-            return FileResponse(admin_index)
-        else:
-            raise HTTPException(status_code=404, detail="Unified admin frontend not built")
-    
-    # Catch-all route for React Router (SPA routing) - must be last
-    @app.get("/admin/{path:path}")
-    async def serve_unified_admin_spa(path: str):
-        """Handle React Router SPA routing for admin frontend"""
-        # Serve static files if they exist
-        static_file_path = os.path.join(admin_static_dir, path)
-        if os.path.isfile(static_file_path):
-            return FileResponse(static_file_path)
-        
-        # For all non-asset routes, serve index.html (SPA routing)
-        admin_index = os.path.join(admin_static_dir, "index.html")
-        if os.path.exists(admin_index):
-            return FileResponse(admin_index)
-        else:
-            raise HTTPException(status_code=404, detail="Unified admin frontend not found")
+    @app.api_route("/admin", methods=["GET", "HEAD"], include_in_schema=False)
+    @app.api_route("/admin/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+    async def serve_unified_admin(request: Request, path: str = ""):
+        """Admin frontend files, with index.html for React Router (SPA) routes"""
+        response = admin_spa.respond(path, request.headers, request.method)
+        if response is None:
+            raise HTTPException(status_code=404, detail="Asset not found")
+        return response
 
 # Fallback to legacy frontend (development)
 elif os.path.exists(legacy_frontend_dist):
     app.mount("/admin", StaticFiles(directory=legacy_frontend_dist, html=True), name="legacy-admin")
-    print(f"⚠️ Using LEGACY frontend at /admin from {legacy_frontend_dist}")
+    logger.warning(f"⚠️ Using LEGACY frontend at /admin from {legacy_frontend_dist}")
     
     @app.get("/admin/")
     async def serve_legacy_admin():
@@ -189,9 +207,7 @@ elif os.path.exists(legacy_frontend_dist):
             raise HTTPException(status_code=404, detail="Legacy admin frontend not built. Run 'npm run build' in frontend directory.")
 
 else:
-    print(f"WARNING: No admin frontend found!")
-    print(f"   Expected: {admin_static_dir} (unified) or {legacy_frontend_dist} (legacy)")
-    print(f"   Run build process to create frontend files.")
+    logger.warning(f"No admin frontend found! Expected: {admin_static_dir} (unified) or {legacy_frontend_dist} (legacy). Run build process to create frontend files.")
 
 # Include routers
 app.include_router(auth.router, prefix="/api")
@@ -217,13 +233,38 @@ async def root_redirect():
 @app.get("/health", tags=["health"])
 async def health_check():
     """Health check endpoint - No authentication required"""
+    storage = get_storage_service().get_storage_health()
+    circuit_state = storage.get("circuit", {}).get("state", "closed")
     return {
-        "status": "healthy",
+        # Liveness stays 200: a storage outage degrades documents, not the API
+        "status": "healthy" if circuit_state == "closed" else "degraded",
         "service": "clinic-admin-backend",
         "version": "1.0.0",
-        "database": "connected"
+        "database": "connected",
+        "storage": storage,
+        "event_loop": loop_monitor.get_stats()
     }
 
+# Readiness probe endpoint
+@app.get("/health/ready", tags=["health"])
+async def readiness_check():
+    """Readiness probe - 503 while document storage is unreachable (never blocks on storage)"""
+    storage = get_storage_service().get_readiness()
+    ready = storage["ready"] is True
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready", "storage": storage}
+    )
+
+# Prometheus metrics endpoint
+@app.get("/metrics", tags=["health"], include_in_schema=False)
+async def metrics_endpoint():
+    """Prometheus exposition - No authentication required (all workers in multiprocess mode)"""
+    payload, content_type = metrics.render_latest()
+    if payload is None:
+        return Response("Metrics disabled (prometheus_client not installed or METRICS_ENABLED=False)\n", status_code=503, media_type=content_type)
+    return Response(payload, headers={"Content-Type": content_type})
+
 # Authenticated health check endpoint
 @app.get("/api/health-auth", tags=["health"])
 async def authenticated_health_check(user: dict = Depends(get_user_or_api_key)):
@@ -256,9 +297,9 @@ async def debug_all_data():
                 plan["_id"] = str(plan["_id"])
             plans_list.append(plan)
             
-        print(f"DEBUG NEW: Found {len(plans_list)} active subscription plans")
+        logger.debug("DEBUG NEW: Found %d active subscription plans", len(plans_list))
         for plan in plans_list:
-            print(f"  - {plan.get('plan_id', 'NO_ID')}: {plan.get('name', 'NO_NAME')} (${plan.get('price', 0)})")
+            logger.debug("  - %s: %s ($%s)", plan.get('plan_id', 'NO_ID'), plan.get('name', 'NO_NAME'), plan.get('price', 0))
             
         # Also get clinics for testing
         clinics_collection = await get_collection("clinics")
@@ -272,9 +313,9 @@ async def debug_all_data():
             clinic.pop("password_hash", None)
             clinics_list.append(clinic)
         
-        print(f"DEBUG NEW: Found {len(clinics_list)} active clinics")
+        logger.debug("DEBUG NEW: Found %d active clinics", len(clinics_list))
         for clinic in clinics_list:
-            print(f"  - {clinic.get('clinic_id', 'NO_ID')}: {clinic.get('name_clinic', 'NO_NAME')}")
+            logger.debug("  - %s: %s", clinic.get('clinic_id', 'NO_ID'), clinic.get('name_clinic', 'NO_NAME'))
         
         return {
             "status": "success", 
@@ -284,7 +325,7 @@ async def debug_all_data():
             "clinics": clinics_list
         }
     except Exception as e:
-        print(f"DEBUG NEW ERROR: {e}")
+        logger.error(f"DEBUG NEW ERROR: {e}", exc_info=True)
         return {"error": str(e)}
 
 
@@ -304,9 +345,9 @@ async def debug_plans(api_key_valid: bool = Depends(verify_api_key)):
                 plan["_id"] = str(plan["_id"])
             plans.append(plan)
             
-        print(f"DEBUG: Found {len(plans)} active subscription plans")
+        logger.debug("DEBUG: Found %d active subscription plans", len(plans))
         for plan in plans:
-            print(f"  - {plan.get('plan_id', 'NO_ID')}: {plan.get('name', 'NO_NAME')} (${plan.get('price', 0)})")
+            logger.debug("  - %s: %s ($%s)", plan.get('plan_id', 'NO_ID'), plan.get('name', 'NO_NAME'), plan.get('price', 0))
             
         # Also get clinics for testing
         clinics_collection = await get_collection("clinics")
@@ -320,9 +361,9 @@ async def debug_plans(api_key_valid: bool = Depends(verify_api_key)):
             clinic.pop("password_hash", None)
             clinics.append(clinic)
         
-        print(f"DEBUG: Found {len(clinics)} active clinics")
+        logger.debug("DEBUG: Found %d active clinics", len(clinics))
         for clinic in clinics:
-            print(f"  - {clinic.get('clinic_id', 'NO_ID')}: {clinic.get('name_clinic', 'NO_NAME')}")
+            logger.debug("  - %s: %s", clinic.get('clinic_id', 'NO_ID'), clinic.get('name_clinic', 'NO_NAME'))
         
         return {
             "status": "success", 
@@ -332,7 +373,7 @@ async def debug_plans(api_key_valid: bool = Depends(verify_api_key)):
             "clinics": clinics
         }
     except Exception as e:
-        print(f"DEBUG ERROR: {e}")
+        logger.error(f"DEBUG ERROR: {e}", exc_info=True)
         return {"error": str(e)}
 
 
@@ -628,9 +669,7 @@ async def api_info():
 # Global exception handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
-    import traceback
-    print(f"Global exception: {exc}")
-    print(f"Traceback: {traceback.format_exc()}")
+    logger.error(f"Global exception: {exc}", exc_info=(type(exc), exc, exc.__traceback__))
     
     from fastapi.responses import JSONResponse
     return JSONResponse(
@@ -641,12 +680,7 @@ async def global_exception_handler(request, exc):
 if __name__ == "__main__":
     import uvicorn
     
-    print(f"Configuration:")
-    print(f"   Database: {settings.database_name}")
-    print(f"   Host: {settings.api_host}")
-    print(f"   Port: {settings.api_port}")
-    print(f"   Debug: {settings.debug}")
-    print(f"   CORS Origins: {settings.cors_origins_list}")
+    logger.info(f"Configuration: database={settings.database_name} host={settings.api_host} port={settings.api_port} debug={settings.debug} cors_origins={settings.cors_origins_list}")
     
     uvicorn.run(
         "main:app",
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Test that a failing documents cursor ends the ZIP bundle stream with its error
+"""
+import asyncio
+import sys
+import os
+
+# Add the app directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ''))
+
+from app.core.document_bundle import stream_documents_zip
+
+
+class FakeStorageService:
+    """Serves every document with the same small content"""
+
+    def __init__(self):
+        self.started = 0
+
+    async def iter_document_content(self, document, chunk_size):
+        self.started += 1
+        yield b"document content"
+
+
+class CursorTimeout(Exception):
+    pass
+
+
+async def failing_cursor():
+    """Yields one document, then fails like a Mongo cursor timeout"""
+    yield {"_id": "doc-1", "file_name": "report.pdf", "document_type": "lab_result", "file_size": 16}
+    raise CursorTimeout("cursor id not found")
+
+
+async def run_bundle_test():
+    storage_service = FakeStorageService()
+    received = b""
+
+    print("[1/2] Streaming a bundle whose cursor fails after one document...")
+    try:
+        async def consume():
+            nonlocal received
+            async for chunk in stream_documents_zip(storage_service, failing_cursor()):
+                received += chunk
+        await asyncio.wait_for(consume(), timeout=5)
+    except CursorTimeout:
+        pass
+    else:
+        raise AssertionError("the cursor error was not raised")
+
+    print("[2/2] Checking the stream ended with the error instead of hanging...")
+    assert b"document content" in received
+    assert storage_service.started == 1
+    print("SUCCESS: Cursor failure ended the bundle stream")
+
+
+def test_failing_cursor_ends_the_bundle():
+    asyncio.run(run_bundle_test())
+
+
+if __name__ == "__main__":
+    asyncio.run(run_bundle_test())
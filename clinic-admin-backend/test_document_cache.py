@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Test that proxied document downloads fill and then hit the disk cache
+"""
+import asyncio
+import sys
+import os
+import tempfile
+
+# Add the app directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ''))
+
+from app.core.document_cache import DocumentCache
+from app.core.storage_service import MedicalDocumentStorageService
+from app.utils.range_responses import build_range_response
+
+CONTENT = b"%PDF-1.4 " + b"x" * 600_000
+
+
+class FakeProvider:
+    """Stands in for MinIO and counts how often the object is fetched"""
+
+    def __init__(self):
+        self.fetches = 0
+
+    async def iter_blob(self, clinic_id, object_name, chunk_size, offset=0, length=None):
+        self.fetches += 1
+        end = len(CONTENT) if length is None else offset + length
+        for start in range(offset, end, chunk_size):
+            yield CONTENT[start:min(start + chunk_size, end)]
+
+    async def get_object_etag(self, clinic_id, object_name):
+        return "etag-1"
+
+
+async def download(storage_service, document, headers=None):
+    """GET the document the way download_document proxies it"""
+    response = build_range_response(
+        headers or {},
+        "GET",
+        size=document["file_size"],
+        media_type="application/pdf",
+        etag='"etag-1"',
+        stream_factory=lambda start, count: storage_service.iter_document_content(
+            document, offset=start, length=count
+        )
+    )
+    start, end = response.body_range
+    body = b""
+    async for chunk in response.stream_factory(start, end - start + 1):
+        body += chunk
+    return body
+
+
+async def run_cache_test():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        storage_service = MedicalDocumentStorageService.__new__(MedicalDocumentStorageService)
+        storage_service.use_minio = True
+        storage_service.provider = FakeProvider()
+        storage_service.cache = DocumentCache(cache_dir, 10 * 1024 * 1024)
+        document = {
+            "storage_type": "minio",
+            "clinic_id": "clinic-1",
+            "object_name": "clinic-1/patient-1/report.pdf",
+            "file_size": len(CONTENT),
+            "etag": "etag-1"
+        }
+
+        print("[1/3] First full download (fills the cache)...")
+        assert await download(storage_service, document) == CONTENT
+        print("[2/3] Second full download (served from the cache)...")
+        assert await download(storage_service, document) == CONTENT
+        print("[3/3] Ranged download (served from the cached entry)...")
+        assert await download(storage_service, document, {"range": "bytes=100-199"}) == CONTENT[100:200]
+
+        stats = storage_service.cache.get_stats()
+        print(f"   fills={stats['fills']} hits={stats['hits']} entries={stats['entries']} fetches={storage_service.provider.fetches}")
+        assert stats["fills"] == 1
+        assert stats["hits"] == 2
+        assert stats["entries"] == 1
+        assert storage_service.provider.fetches == 1
+        print("SUCCESS: Second download was a cache hit")
+
+
+def test_second_download_is_a_cache_hit():
+    asyncio.run(run_cache_test())
+
+
+if __name__ == "__main__":
+    asyncio.run(run_cache_test())